@@ -1,23 +1,18 @@
 """Utility functions for the analytics dashboard."""
 
-from os import environ as ENV
+import sys
+from pathlib import Path
 
-from psycopg2 import connect
 from psycopg2.extensions import connection, cursor
 from psycopg2.extras import RealDictCursor
 
-from queries import decade_counts, genre_counts, tag_counts, album_count
+from queries import (decade_counts, genre_counts, tag_counts, album_count, all_counts,
+                     collection_version)
 
-
-def get_connection() -> connection:
-    """Returns a live database connection."""
-    return connect(
-        database=ENV['DB_NAME'],
-        user=ENV['DB_USER'],
-        password=ENV['DB_PASSWORD'],
-        port=ENV['DB_PORT'],
-        host=ENV['DB_HOST']
-    )
+# The dashboard is launched from this directory, so the shared pool in app/
+# has to be made importable explicitly.
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from db_pool import get_connection  # pylint: disable=wrong-import-position
 
 
 def get_cursor(conn: connection) -> cursor:
@@ -65,3 +60,22 @@ def get_album_count() -> int:
     """Returns the number of releases in the user's collection."""
     results = execute_query(album_count)
     return results[0]['count']
+
+
+def get_collection_version() -> int:
+    """Returns a number that changes whenever the collection does."""
+    return execute_query(collection_version)[0]['version']
+
+
+def get_all_counts() -> dict:
+    """Returns the decade, genre and tag breakdowns, the number of releases
+    and the collection version they were read at, all in a single query."""
+    counts = {'decades': {}, 'genres': {}, 'tags': {}, 'album_count': 0, 'version': 0}
+    for row in execute_query(all_counts):
+        if row['kind'] == 'album':
+            counts['album_count'] = row['count']
+        elif row['kind'] == 'version':
+            counts['version'] = row['count']
+        else:
+            counts[f"{row['kind']}s"][row['name']] = row['count']
+    return counts
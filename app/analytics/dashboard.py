@@ -1,21 +1,55 @@
 """Script for the analytics Streamlit dashboard."""
+from contextlib import contextmanager
+from os import environ as ENV
+from time import perf_counter
+
 import streamlit as st
 from dotenv import load_dotenv
 
-from analytics_utils import get_decade_counts, get_genre_counts
+from analytics_utils import get_all_counts, get_collection_version
 from graphs import decade_chart, genre_chart
 
+CACHE_TTL = int(ENV.get('DASHBOARD_CACHE_TTL', 600))
+
+
+@contextmanager
+def timed(stage_timings: dict, name: str):
+    """Records how long the enclosed block took, in milliseconds."""
+    start = perf_counter()
+    yield
+    stage_timings[name] = round((perf_counter() - start) * 1000, 2)
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def load_counts(collection_version: int) -> dict:  # pylint: disable=unused-argument
+    """Returns every panel's data from a single query. Results are memoised
+    per collection version, so any change to the collection invalidates
+    them on the next rerun."""
+    return get_all_counts()
+
+
+def render_timings(stage_timings: dict):
+    """Displays how long each stage of this render took."""
+    with st.expander("Render timings"):
+        for name, ms in stage_timings.items():
+            st.text(f"{name}: {ms} ms")
+
+
 if __name__ == "__main__":
     load_dotenv()
     st.set_page_config(layout="wide")
-    decade_data = get_decade_counts()
-    genre_data = get_genre_counts()
+    timings = {}
+    with timed(timings, "version check"):
+        version = get_collection_version()
+    with timed(timings, "data"):
+        counts = load_counts(version)
 
     cols = st.columns([1, 1])
-    decade_pie_chart = decade_chart(decade_data)
-    genre_bar_chart = genre_chart(genre_data)
-
     with cols[0]:
-        st.altair_chart(decade_pie_chart, use_container_width=False)
+        with timed(timings, "decade panel"):
+            st.altair_chart(decade_chart(counts['decades']), use_container_width=False)
     with cols[1]:
-        st.altair_chart(genre_bar_chart, use_container_width=True)
+        with timed(timings, "genre panel"):
+            st.altair_chart(genre_chart(counts['genres']), use_container_width=True)
+
+    render_timings(timings)
@@ -1,36 +1,47 @@
 # pylint: skip-file
 
+# Every count is read from the aggregate tables the schema's triggers keep up
+# to date, so none of these scan the album or assignment tables.
+
 tag_counts = """
-SELECT t.tag_name, COUNT(t.tag_id) AS tag_count
-FROM tag AS t
-JOIN album_tag_assignment
-AS ata ON ata.tag_id = t.tag_id
-GROUP BY t.tag_name
+SELECT t.tag_name, tc.album_count AS tag_count
+FROM tag_count AS tc
+JOIN tag AS t USING (tag_id)
 ORDER BY tag_count DESC;
 """
 
 genre_counts = """
-SELECT g.genre_name, COUNT(g.genre_id) AS genre_count
-FROM genre AS g
-JOIN artist_genre_assignment
-AS aga ON aga.genre_id = g.genre_id
-GROUP BY g.genre_name
+SELECT g.genre_name, gc.assignment_count AS genre_count
+FROM genre_count AS gc
+JOIN genre AS g USING (genre_id)
 ORDER BY genre_count DESC;
 """
 
 decade_counts = """
-WITH AlbumDecades AS (
-    SELECT a.album_name, 
-           FLOOR(EXTRACT(YEAR FROM a.release_date) 
-           / 10) * 10 AS decade_name
-    FROM album AS a
-)
-SELECT ad.decade_name, COUNT(ad.decade_name) AS decade_count
-FROM AlbumDecades AS ad
-GROUP BY ad.decade_name
+SELECT decade AS decade_name, album_count AS decade_count
+FROM decade_count
 ORDER BY decade_count DESC;
 """
 
 album_count = """
-SELECT COUNT(*) FROM album;
+SELECT album_count AS count FROM collection_stats;
+"""
+
+all_counts = """
+SELECT 'tag' AS kind, t.tag_name AS name, tc.album_count AS count
+FROM tag_count AS tc JOIN tag AS t USING (tag_id)
+UNION ALL
+SELECT 'genre', g.genre_name, gc.assignment_count
+FROM genre_count AS gc JOIN genre AS g USING (genre_id)
+UNION ALL
+SELECT 'decade', decade::TEXT, album_count FROM decade_count
+UNION ALL
+SELECT 'album', NULL, album_count FROM collection_stats
+UNION ALL
+SELECT 'version', NULL, version FROM collection_stats
+ORDER BY kind, count DESC;
+"""
+
+collection_version = """
+SELECT version FROM collection_stats;
 """
@@ -1,17 +1,25 @@
 """Script to handle the Spotify access tokens used for authorisation."""
 
+import logging
 from os import environ as ENV
+from datetime import datetime, timedelta, timezone
+from threading import Lock, Timer
 
-import requests as req
+import http_client
+from endpoints import TOKEN_ENDPOINT
+from authorisation.auth_db_handler import get_latest_token_expiry, insert_new_access_token
 
-from authorisation.auth_db_handler import get_latest_token, check_token_validity, insert_new_access_token
-
-TOKEN_ENDPOINT = "https://accounts.spotify.com/api/token"
 REQUIRED_AUTH_KEYS = ["CLIENT_ID", "CLIENT_SECRET"]
+REFRESH_MARGIN = 300
+EXPIRY_SKEW = 30
+RETRY_DELAY = 10
+
+logger = logging.getLogger(__name__)
 
 
-def call_token_api(client_id: str, client_secret: str) -> str:
-    """Calls the Spotify token API and returns an authorisation token."""
+def call_token_api(client_id: str, client_secret: str) -> tuple[str, int]:
+    """Calls the Spotify token API and returns an authorisation token
+    and its lifetime in seconds."""
     headers = {
         "Content-Type": "application/x-www-form-urlencoded"
     }
@@ -20,7 +28,7 @@ def call_token_api(client_id: str, client_secret: str) -> str:
         "client_id": client_id,
         "client_secret": client_secret
     }
-    response = req.post(TOKEN_ENDPOINT, headers=headers, data=data, timeout=10)
+    response = http_client.post(TOKEN_ENDPOINT, headers=headers, data=data, timeout=10)
 
     if response.status_code == 200:
         data = response.json()
@@ -28,15 +36,102 @@ def call_token_api(client_id: str, client_secret: str) -> str:
 
     raise ConnectionError("Error. Please check your credentials.")
 
-def get_valid_token() -> str:
-    """Returns the latest token if still valid. Else generates, stores, and returns
-    a new token."""
-    if not all(key in ENV for key in REQUIRED_AUTH_KEYS):
-        raise ValueError(".env has not been configured correctly.")
-    latest_token = get_latest_token(ENV['CLIENT_ID'], ENV['CLIENT_SECRET'])
-    if check_token_validity(ENV['CLIENT_ID'], latest_token):
-        return latest_token
-    new_token, expires_in = call_token_api(ENV['CLIENT_ID'], ENV['CLIENT_SECRET'])
-    insert_new_access_token(ENV['CLIENT_ID'], ENV['CLIENT_SECRET'], new_token, expires_in)
-    return new_token
 
+class TokenProvider:
+    """Holds an access token in memory and refreshes it in the background
+    shortly before it expires. Refreshes are single-flight, and the
+    access_tokens table is only read on a cold start."""
+
+    def __init__(self, client_id: str, client_secret: str,
+                 refresh_margin: int = REFRESH_MARGIN):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_margin = refresh_margin
+        self._token = None
+        self._expires_at = None
+        self._lock = Lock()
+        self._timer = None
+
+    def _seconds_left(self) -> float:
+        """Returns the number of seconds until the held token expires."""
+        if self._expires_at is None:
+            return 0
+        return (self._expires_at - datetime.now(timezone.utc)).total_seconds()
+
+    def _is_usable(self) -> bool:
+        """Returns true if the held token will not expire imminently."""
+        return self._token is not None and self._seconds_left() > EXPIRY_SKEW
+
+    def get_token(self) -> str:
+        """Returns a valid access token, fetching one only if none is held."""
+        if self._is_usable():
+            return self._token
+        with self._lock:
+            if not self._is_usable():
+                if self._token is None:
+                    self._load_from_db()
+                if not self._is_usable():
+                    self._refresh()
+            return self._token
+
+    def _load_from_db(self):
+        """Loads the latest stored token, so a cold start can reuse it."""
+        latest = get_latest_token_expiry(self.client_id, self.client_secret)
+        if latest:
+            self._token, self._expires_at = latest
+            if self._is_usable():
+                self._schedule_refresh()
+
+    def _refresh(self):
+        """Fetches, holds and stores a new token. Must hold the lock. Storing
+        is best-effort, as the held token is enough to keep serving."""
+        token, expires_in = call_token_api(self.client_id, self.client_secret)
+        self._token = token
+        self._expires_at = datetime.now(timezone.utc) + timedelta(seconds=expires_in)
+        self._schedule_refresh()
+        try:
+            insert_new_access_token(self.client_id, self.client_secret, token, expires_in)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Failed to store the new access token.")
+
+    def _schedule_refresh(self, delay: float = None):
+        """Schedules a background refresh ahead of the held token's expiry."""
+        if self._timer is not None:
+            self._timer.cancel()
+        if delay is None:
+            delay = max(0, self._seconds_left() - self.refresh_margin)
+        self._timer = Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        """Refreshes the token ahead of expiry, retrying shortly on failure."""
+        with self._lock:
+            if self._seconds_left() > self.refresh_margin:
+                return
+            try:
+                self._refresh()
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Background token refresh failed. Retrying.")
+                self._schedule_refresh(RETRY_DELAY)
+
+
+_provider = None
+_provider_lock = Lock()
+
+
+def get_token_provider() -> TokenProvider:
+    """Returns the process-wide token provider, creating it on first use."""
+    global _provider  # pylint: disable=global-statement
+    if _provider is None:
+        if not all(key in ENV for key in REQUIRED_AUTH_KEYS):
+            raise ValueError(".env has not been configured correctly.")
+        with _provider_lock:
+            if _provider is None:
+                _provider = TokenProvider(ENV['CLIENT_ID'], ENV['CLIENT_SECRET'])
+    return _provider
+
+
+def get_valid_token() -> str:
+    """Returns a valid access token, refreshing it if it is about to expire."""
+    return get_token_provider().get_token()
@@ -0,0 +1,265 @@
+"""Script to handle bulk imports of albums into the collection from a file
+of Spotify album IDs, URLs or URIs (plain text, CSV or JSONL)."""
+
+import csv
+import json
+import re
+from argparse import ArgumentParser
+from dataclasses import dataclass, field
+from itertools import islice
+from time import perf_counter
+from typing import Callable, Iterable, Iterator
+
+from psycopg2 import Error as DatabaseError
+from requests import RequestException
+
+from db_pool import PoolTimeoutError
+from db_utils import IngestBatch, get_artist_ids
+from collection_index import get_owned_album_ids
+from job_queue import enqueue_ingests
+from extract_spotify import (call_get_several_albums_endpoint, call_get_several_artists_endpoint,
+                             parse_album_from_api, get_album_info,
+                             MAX_ALBUMS_PER_CALL, MAX_ARTISTS_PER_CALL)
+
+SPOTIFY_ID_PATTERN = re.compile(
+    r"(?:(?:https?://)?open\.spotify\.com/(?:intl-[\w-]+/)?(?:embed/)?album/|spotify:album:)?"
+    r"([0-9A-Za-z]{22})(?:[?#/\s].*)?", re.DOTALL)
+ID_COLUMNS = ["spotify_album_id", "spotify_id", "album_id", "id", "url", "uri"]
+FILE_FORMATS = ["txt", "csv", "jsonl"]
+
+
+@dataclass
+class ImportReport:
+    """Running totals and per-item failures for a bulk import."""
+    imported: list = field(default_factory=list)
+    already_owned: list = field(default_factory=list)
+    failures: dict = field(default_factory=dict)
+    started_at: float = field(default_factory=perf_counter)
+
+    def to_dict(self) -> dict:
+        """Returns a summary of the import including its throughput."""
+        elapsed = perf_counter() - self.started_at
+        processed = len(self.imported) + len(self.already_owned) + len(self.failures)
+        return {
+            'imported': len(self.imported),
+            'already_owned': len(self.already_owned),
+            'failed': len(self.failures),
+            'failures': self.failures,
+            'elapsed_seconds': round(elapsed, 2),
+            'albums_per_second': round(processed / elapsed, 2) if elapsed else 0.0
+        }
+
+
+def parse_album_id(value: str) -> str:
+    """Returns the Spotify album ID from a raw ID, open.spotify.com album URL
+    or spotify:album: URI. Returns None for anything else, including links
+    to artists, tracks or playlists."""
+    match = SPOTIFY_ID_PATTERN.fullmatch(value.strip())
+    return match.group(1) if match else None
+
+
+def get_file_format(filename: str) -> str:
+    """Returns the import format implied by a file's extension."""
+    extension = filename.rsplit(".", 1)[-1].lower()
+    return extension if extension in FILE_FORMATS else "txt"
+
+
+def get_jsonl_value(line: str) -> str:
+    """Returns the album reference in a JSONL line: the line's string, or the
+    first ID field of its object. Anything else (invalid JSON, numbers,
+    booleans, nulls and arrays) is returned as the raw line, to be reported."""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return line
+    if isinstance(record, str):
+        return record
+    if isinstance(record, dict):
+        return next((str(record[x]) for x in ID_COLUMNS if x in record), line)
+    return line
+
+
+def read_raw_values(lines: Iterable[str], file_format: str) -> Iterator[str]:
+    """Yields the raw album references from the lines of an import file."""
+    if file_format == "csv":
+        rows = csv.reader(lines)
+        header = next(rows, [])
+        lowered = [x.strip().lower() for x in header]
+        column = next((lowered.index(x) for x in ID_COLUMNS if x in lowered), None)
+        if column is None:
+            # No recognised header, so the first row is data and the first column holds the ID.
+            column = 0
+            if header:
+                yield header[0]
+        for row in rows:
+            if len(row) > column:
+                yield row[column]
+    elif file_format == "jsonl":
+        for line in lines:
+            if line.strip():
+                yield get_jsonl_value(line)
+    else:
+        for line in lines:
+            if line.strip() and not line.lstrip().startswith("#"):
+                yield line
+
+
+def read_album_ids(lines: Iterable[str], file_format: str,
+                   report: ImportReport) -> Iterator[str]:
+    """Yields each distinct album ID in an import file, recording any
+    unparseable entries as failures."""
+    seen = set()
+    for value in read_raw_values(lines, file_format):
+        album_id = parse_album_id(value)
+        if album_id is None:
+            report.failures[value.strip()] = "Not a Spotify album ID or URL."
+        elif album_id not in seen:
+            seen.add(album_id)
+            yield album_id
+
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    """Yields successive lists of at most size items."""
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def fetch_artist_genres(spotify_artist_ids: list[str], access_token: str) -> dict:
+    """Returns a dict mapping artist IDs to their genres, batching the lookups."""
+    genres = {}
+    for chunk in chunked(spotify_artist_ids, MAX_ARTISTS_PER_CALL):
+        for artist in call_get_several_artists_endpoint(chunk, access_token):
+            if artist:
+                genres[artist['id']] = artist['genres']
+    return genres
+
+
+def make_batch(parsed: dict, genres: dict) -> IngestBatch:
+    """Returns an ingest batch of parsed albums and the artists they credit."""
+    batch = IngestBatch()
+    for album_data in parsed.values():
+        for artist in album_data['artists']:
+            batch.add_artist(artist['spotify_id'], artist['name'],
+                             genres.get(artist['spotify_id']))
+    for album_id, album_data in parsed.items():
+        batch.add_album(album_data['artists'][0]['spotify_id'],
+                        get_album_info(album_id, album_data))
+    return batch
+
+
+def write_albums(parsed: dict, genres: dict, report: ImportReport):
+    """Writes parsed albums in one transaction. If that fails, each album is
+    retried on its own, so one bad row only fails its own album."""
+    try:
+        inserted = make_batch(parsed, genres).write()
+    except (DatabaseError, PoolTimeoutError):
+        inserted = {}
+        for album_id, album_data in parsed.items():
+            try:
+                inserted.update(make_batch({album_id: album_data}, genres).write())
+            except (DatabaseError, PoolTimeoutError) as err:
+                report.failures[album_id] = f"Database error: {err}"
+
+    for album_id in parsed:
+        if album_id in inserted:
+            report.imported.append(album_id)
+        elif album_id not in report.failures:
+            report.already_owned.append(album_id)
+
+
+def import_batch(album_ids: list[str], access_token: str, report: ImportReport):
+    """Fetches, parses and writes a batch of up to 20 albums. Failures are
+    recorded against the offending album rather than raised. Albums already
+    in the collection are skipped before any Spotify call."""
+    try:
+        owned = get_owned_album_ids()
+    except (DatabaseError, PoolTimeoutError):
+        # Owned albums are still caught by the write, just after a Spotify call.
+        owned = frozenset()
+    report.already_owned.extend(x for x in album_ids if x in owned)
+    album_ids = [x for x in album_ids if x not in owned]
+    if not album_ids:
+        return
+    try:
+        responses = call_get_several_albums_endpoint(album_ids, access_token)
+    except (ConnectionError, RequestException) as err:
+        report.failures.update({x: str(err) for x in album_ids})
+        return
+
+    parsed = {}
+    for album_id, response in zip(album_ids, responses):
+        if response is None:
+            report.failures[album_id] = "Album not found on Spotify."
+            continue
+        try:
+            parsed[album_id] = parse_album_from_api(response)
+        except (KeyError, ValueError) as err:
+            report.failures[album_id] = f"{type(err).__name__}: {err}"
+
+    if not parsed:
+        return
+
+    artist_names = {artist['spotify_id']: artist['name']
+                    for album_data in parsed.values() for artist in album_data['artists']}
+    try:
+        known_artists = get_artist_ids(list(artist_names))
+        genres = fetch_artist_genres(
+            [x for x in artist_names if x not in known_artists], access_token)
+    except (ConnectionError, RequestException, DatabaseError, PoolTimeoutError) as err:
+        report.failures.update({x: str(err) for x in parsed})
+        return
+
+    write_albums(parsed, genres, report)
+
+
+def import_albums(lines: Iterable[str], file_format: str, get_token: Callable[[], str],
+                  batch_size: int = MAX_ALBUMS_PER_CALL) -> ImportReport:
+    """Streams the album IDs in an import file into the collection in batches.
+    A fresh token is requested per batch, as long imports outlive a single token.
+    Returns a report of what was imported and what failed."""
+    report = ImportReport()
+    album_ids = read_album_ids(lines, file_format, report)
+    for batch in chunked(album_ids, min(batch_size, MAX_ALBUMS_PER_CALL)):
+        import_batch(batch, get_token(), report)
+    return report
+
+
+def queue_import(lines: Iterable[str], file_format: str) -> dict:
+    """Queues every album in an import file that isn't already in the
+    collection as an ingestion job. Returns a summary of what was queued,
+    with each album's job ID, and of what was skipped or unreadable."""
+    report = ImportReport()
+    album_ids = list(read_album_ids(lines, file_format, report))
+    owned = get_owned_album_ids()
+    report.already_owned.extend(x for x in album_ids if x in owned)
+    jobs = enqueue_ingests([x for x in album_ids if x not in owned])
+    return {
+        'queued': len(jobs),
+        'already_owned': len(report.already_owned),
+        'failed': len(report.failures),
+        'failures': report.failures,
+        'jobs': jobs
+    }
+
+
+if __name__ == "__main__":
+    from authorisation.access_manager import get_valid_token
+    from tag_enrichment import enrich_missing_tags
+
+    parser = ArgumentParser(description="Bulk import albums into VinylVault.")
+    parser.add_argument("file", help="A .txt, .csv or .jsonl file of Spotify album IDs or URLs.")
+    parser.add_argument("--format", choices=FILE_FORMATS,
+                        help="Overrides the format implied by the file extension.")
+    parser.add_argument("--skip-tags", action="store_true",
+                        help="Leave the imported albums' Last.fm tags to the app's worker.")
+    args = parser.parse_args()
+
+    with open(args.file, encoding="utf-8", newline="") as import_file:
+        result = import_albums(import_file, args.format or get_file_format(args.file),
+                               get_valid_token)
+    summary = result.to_dict()
+    # This process exits once done, so tags are scraped here rather than on a worker thread.
+    if result.imported and not args.skip_tags:
+        summary['tag_enrichment'] = enrich_missing_tags().to_dict()
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,182 @@
+"""Script to provide bounded TTL + LRU caches with pluggable storage backends."""
+
+import pickle
+from collections import OrderedDict
+from os import environ as ENV
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable
+
+from metrics import add_stats_source
+
+DEFAULT_MAX_SIZE = 1024
+DEFAULT_TTL = 300
+
+_MISSING = object()
+
+
+class MemoryBackend:
+    """An in-process store that evicts the least recently used entry once
+    full and treats entries older than the TTL as missing."""
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, ttl: float = DEFAULT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: str) -> Any:
+        """Returns the stored value for a key, or _MISSING."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, value = entry
+            if expires_at <= monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        """Stores a value, evicting the least recently used entries if full."""
+        with self._lock:
+            self._entries[key] = (monotonic() + (ttl or self.ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        """Removes a key if present."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def size(self) -> int:
+        """Returns the number of stored entries, including any expired ones
+        not yet evicted."""
+        return len(self._entries)
+
+
+class RedisBackend:
+    """A store shared between worker processes, backed by Redis. TTLs are
+    enforced with SETEX and LRU eviction is left to the server's
+    maxmemory-policy (allkeys-lru). Values are pickled, so the Redis server
+    must only be writable by VinylVault."""
+
+    def __init__(self, url: str, namespace: str, ttl: float = DEFAULT_TTL):
+        import redis  # pylint: disable=import-outside-toplevel
+        self._client = redis.Redis.from_url(url)
+        self.namespace = namespace
+        self.ttl = ttl
+        self.evictions = 0
+
+    def _key(self, key: str) -> str:
+        """Returns the namespaced Redis key for a cache key."""
+        return f"vinylvault:{self.namespace}:{key}"
+
+    def get(self, key: str) -> Any:
+        """Returns the stored value for a key, or _MISSING."""
+        raw = self._client.get(self._key(key))
+        return _MISSING if raw is None else pickle.loads(raw)
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        """Stores a value with an expiry."""
+        self._client.setex(self._key(key), int(ttl or self.ttl), pickle.dumps(value))
+
+    def delete(self, key: str):
+        """Removes a key if present."""
+        self._client.delete(self._key(key))
+
+    def clear(self):
+        """Removes every key in this cache's namespace."""
+        keys = list(self._client.scan_iter(match=self._key("*")))
+        if keys:
+            self._client.delete(*keys)
+
+    def size(self) -> None:
+        """Returns None, as counting keys would scan the whole keyspace on
+        every metrics scrape."""
+        return None
+
+
+class Cache:
+    """A named cache recording hit, miss and eviction counts over a backend."""
+
+    def __init__(self, name: str, backend):
+        self.name = name
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Returns a cached value, or the default if absent or expired."""
+        value = self.backend.get(key)
+        with self._lock:
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        """Caches a value under a key."""
+        self.backend.set(key, value, ttl)
+
+    def get_or_set(self, key: str, compute: Callable[[], Any], ttl: float = None) -> Any:
+        """Returns a cached value, computing and caching it on a miss."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.set(key, value, ttl)
+        return value
+
+    def invalidate(self, key: str):
+        """Removes a single key from the cache."""
+        self.backend.delete(key)
+
+    def clear(self):
+        """Removes every entry from the cache."""
+        self.backend.clear()
+
+    def get_stats(self) -> dict:
+        """Returns the cache's hit, miss and eviction counts."""
+        lookups = self.hits + self.misses
+        return {
+            'size': self.backend.size(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.backend.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+_caches = {}
+
+
+def make_cache(name: str, max_size: int = DEFAULT_MAX_SIZE, ttl: float = DEFAULT_TTL) -> Cache:
+    """Returns a named cache. Uses Redis when CACHE_REDIS_URL is set, so
+    entries are shared between workers, otherwise an in-process store."""
+    if name not in _caches:
+        if ENV.get('CACHE_REDIS_URL'):
+            backend = RedisBackend(ENV['CACHE_REDIS_URL'], name, ttl)
+        else:
+            backend = MemoryBackend(max_size, ttl)
+        _caches[name] = Cache(name, backend)
+    return _caches[name]
+
+
+def get_cache_stats() -> dict:
+    """Returns the stats of every cache created by make_cache."""
+    return {name: cache.get_stats() for name, cache in _caches.items()}
+
+
+add_stats_source("vinylvault_cache", get_cache_stats, "cache")
@@ -0,0 +1,161 @@
+"""Script to hold in-memory indexes of the collection's album IDs, so random
+picks and ownership checks take constant time regardless of collection size."""
+
+from collections import OrderedDict
+from random import choice
+from threading import Lock
+from time import monotonic
+
+from db_utils import get_album_ids, get_owned_spotify_album_ids, add_album_listener
+
+REFRESH_INTERVAL = 300
+MAX_FILTERED_SETS = 128
+
+
+class AlbumIdIndex:
+    """An array of every album ID with a position map, giving O(1) random
+    picks, inserts and deletes. Filtered arrays (genre, tag, decade, artist)
+    are loaded on demand and dropped whenever the collection changes. The
+    whole index is reloaded periodically to pick up other workers' writes."""
+
+    def __init__(self, refresh_interval: float = REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._ids = []
+        self._positions = {}
+        self._filtered = OrderedDict()
+        self._loaded_at = None
+        self._lock = Lock()
+
+    def _ensure_loaded(self):
+        """Loads the index if it is empty or older than the refresh interval.
+        Must hold the lock."""
+        if self._loaded_at is not None and monotonic() - self._loaded_at < self.refresh_interval:
+            return
+        self._ids = get_album_ids()
+        self._positions = {album_id: i for i, album_id in enumerate(self._ids)}
+        self._filtered.clear()
+        self._loaded_at = monotonic()
+
+    def add(self, album_ids: list[int]):
+        """Adds newly inserted albums to the index."""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            for album_id in album_ids:
+                if album_id not in self._positions:
+                    self._positions[album_id] = len(self._ids)
+                    self._ids.append(album_id)
+            self._filtered.clear()
+
+    def remove(self, album_ids: list[int]):
+        """Removes deleted albums from the index by swapping with the last ID."""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            for album_id in album_ids:
+                position = self._positions.pop(album_id, None)
+                if position is None:
+                    continue
+                last = self._ids.pop()
+                if last != album_id:
+                    self._ids[position] = last
+                    self._positions[last] = position
+            self._filtered.clear()
+
+    def clear_filtered(self):
+        """Drops the filtered arrays, e.g. after albums' tags have changed."""
+        with self._lock:
+            self._filtered.clear()
+
+    def _get_filtered(self, key: tuple, filters: dict) -> list[int]:
+        """Returns the album IDs matching a set of filters, loading them once.
+        Must hold the lock."""
+        if key in self._filtered:
+            self._filtered.move_to_end(key)
+            return self._filtered[key]
+        ids = get_album_ids(**filters)
+        self._filtered[key] = ids
+        while len(self._filtered) > MAX_FILTERED_SETS:
+            self._filtered.popitem(last=False)
+        return ids
+
+    def random_album_id(self, **filters) -> int:
+        """Returns a random album ID, optionally restricted by the collection
+        filters, or None if no album matches."""
+        filters = {k: v for k, v in filters.items() if v is not None}
+        with self._lock:
+            self._ensure_loaded()
+            if filters:
+                ids = self._get_filtered(tuple(sorted(filters.items())), filters)
+            else:
+                ids = self._ids
+            return choice(ids) if ids else None
+
+    def handle_change(self, event: str, albums: dict):
+        """Keeps the index in step with inserts and deletes. Updates (such as
+        newly scraped tags) leave the album IDs alone but can change which
+        albums match a filter."""
+        if event == 'insert':
+            self.add(list(albums))
+        elif event == 'delete':
+            self.remove(list(albums))
+        elif event == 'update':
+            self.clear_filtered()
+
+
+class OwnedAlbumSet:
+    """The set of Spotify album IDs in the collection, kept in step with
+    inserts and deletes and reloaded periodically like AlbumIdIndex. The set
+    is replaced rather than mutated, so readers can hold it without a copy."""
+
+    def __init__(self, refresh_interval: float = REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._ids = frozenset()
+        self._loaded_at = None
+        self._lock = Lock()
+
+    def get(self) -> frozenset:
+        """Returns a snapshot of the owned Spotify album IDs."""
+        with self._lock:
+            if self._loaded_at is None or monotonic() - self._loaded_at >= self.refresh_interval:
+                self._ids = frozenset(get_owned_spotify_album_ids())
+                self._loaded_at = monotonic()
+            return self._ids
+
+    def handle_change(self, event: str, albums: dict):
+        """Keeps the set in step with inserts and deletes."""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            if event == 'insert':
+                self._ids = self._ids.union(albums.values())
+            elif event == 'delete':
+                self._ids = self._ids.difference(albums.values())
+
+
+ALBUM_INDEX = AlbumIdIndex()
+add_album_listener(ALBUM_INDEX.handle_change)
+OWNED_ALBUMS = OwnedAlbumSet()
+add_album_listener(OWNED_ALBUMS.handle_change)
+
+
+def get_random_album_id(**filters) -> int:
+    """Returns a random album ID from the collection, or None if it is empty."""
+    return ALBUM_INDEX.random_album_id(**filters)
+
+
+def get_owned_album_ids() -> frozenset:
+    """Returns the Spotify IDs of every album in the collection."""
+    return OWNED_ALBUMS.get()
+
+
+def is_owned(spotify_album_id: str) -> bool:
+    """Returns true if an album is already in the collection."""
+    return spotify_album_id in OWNED_ALBUMS.get()
+
+
+def mark_owned(albums: list[dict], key: str = 'spotify_id') -> list[dict]:
+    """Returns copies of album results with an 'owned' flag set on each,
+    leaving the originals (which may be cached) untouched."""
+    owned = OWNED_ALBUMS.get()
+    return [{**album, 'owned': album[key] in owned} for album in albums]
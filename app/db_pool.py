@@ -0,0 +1,205 @@
+"""Script to manage the shared pool of database connections used across the app."""
+
+from os import environ as ENV
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
+from time import monotonic, perf_counter
+
+from psycopg2 import Error as DatabaseError
+from psycopg2.extensions import connection as PgConnection, TRANSACTION_STATUS_IDLE
+from psycopg2.pool import ThreadedConnectionPool
+from dotenv import load_dotenv
+
+from metrics import TimedCursor, add_stats_source
+
+load_dotenv()
+
+DEFAULT_MIN_SIZE = 1
+DEFAULT_MAX_SIZE = 10
+CHECKOUT_TIMEOUT = 30
+HEALTH_CHECK_INTERVAL = 30
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection becomes available within the checkout timeout."""
+
+
+class ConnectionPool:
+    """A bounded, thread-safe pool of reusable database connections.
+    Callers block (up to a timeout) when every connection is checked out,
+    and connections idle for longer than the health check interval are
+    pinged before being handed out."""
+
+    def __init__(self, min_size: int, max_size: int,
+                 timeout: float = CHECKOUT_TIMEOUT,
+                 health_check_interval: float = HEALTH_CHECK_INTERVAL,
+                 **conn_kwargs):
+        self._pool = ThreadedConnectionPool(min_size, max_size, **conn_kwargs)
+        self._slots = BoundedSemaphore(max_size)
+        self._lock = Lock()
+        self._last_used = {}
+        self._checked_out_at = {}
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.min_size = min_size
+        self.max_size = max_size
+        self._stats = {
+            'checkouts': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+            'checkout_seconds_total': 0.0,
+            'checkout_seconds_max': 0.0,
+            'timeouts': 0,
+            'health_check_failures': 0,
+            'discarded': 0
+        }
+
+    def _is_healthy(self, conn: PgConnection) -> bool:
+        """Returns true if a connection is open and, if it has been idle for
+        a while, still answers a trivial query."""
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is None or monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except DatabaseError:
+            return False
+
+    def checkout(self) -> PgConnection:
+        """Returns a healthy connection from the pool, waiting if none are free."""
+        start = perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise PoolTimeoutError(
+                f"No database connection available after {self.timeout}s.")
+        try:
+            conn = self._pool.getconn()
+            while not self._is_healthy(conn):
+                with self._lock:
+                    self._stats['health_check_failures'] += 1
+                self._discard(conn)
+                conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+        waited = perf_counter() - start
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['wait_seconds_total'] += waited
+            self._stats['wait_seconds_max'] = max(
+                self._stats['wait_seconds_max'], waited)
+            self._checked_out_at[id(conn)] = perf_counter()
+        return conn
+
+    def _discard(self, conn: PgConnection):
+        """Closes a connection and removes it from the pool."""
+        self._last_used.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+        with self._lock:
+            self._stats['discarded'] += 1
+
+    def checkin(self, conn: PgConnection):
+        """Returns a connection to the pool, discarding it if it is unusable."""
+        with self._lock:
+            held = perf_counter() - self._checked_out_at.pop(id(conn), perf_counter())
+            self._stats['checkout_seconds_total'] += held
+            self._stats['checkout_seconds_max'] = max(
+                self._stats['checkout_seconds_max'], held)
+        try:
+            if conn.closed or conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                self._discard(conn)
+            else:
+                self._last_used[id(conn)] = monotonic()
+                self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Context manager yielding a pooled connection. Commits on success,
+        rolls back on error, and always returns the connection to the pool."""
+        conn = self.checkout()
+        try:
+            yield conn
+            if not conn.closed:
+                conn.commit()
+        except Exception:
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except DatabaseError:
+                    conn.close()
+            raise
+        finally:
+            self.checkin(conn)
+
+    def get_stats(self) -> dict:
+        """Returns a snapshot of the pool's usage counters."""
+        with self._lock:
+            stats = dict(self._stats)
+        checkouts = stats['checkouts'] or 1
+        stats['wait_seconds_avg'] = stats['wait_seconds_total'] / checkouts
+        stats['checkout_seconds_avg'] = stats['checkout_seconds_total'] / checkouts
+        stats['in_use'] = len(self._checked_out_at)
+        stats['min_size'] = self.min_size
+        stats['max_size'] = self.max_size
+        return stats
+
+    def close(self):
+        """Closes every connection held by the pool."""
+        self._pool.closeall()
+
+
+_POOL = None
+_POOL_LOCK = Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Returns the process-wide connection pool, creating it on first use."""
+    global _POOL  # pylint: disable=global-statement
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = ConnectionPool(
+                    min_size=int(ENV.get('DB_POOL_MIN_SIZE', DEFAULT_MIN_SIZE)),
+                    max_size=int(ENV.get('DB_POOL_MAX_SIZE', DEFAULT_MAX_SIZE)),
+                    timeout=float(ENV.get('DB_POOL_TIMEOUT', CHECKOUT_TIMEOUT)),
+                    dbname=ENV['DB_NAME'],
+                    user=ENV['DB_USER'],
+                    password=ENV['DB_PASSWORD'],
+                    host=ENV['DB_HOST'],
+                    port=ENV['DB_PORT'],
+                    cursor_factory=TimedCursor
+                )
+    return _POOL
+
+
+def get_connection():
+    """Returns a context manager for a pooled database connection."""
+    return get_pool().connection()
+
+
+def get_pool_stats() -> dict:
+    """Returns the usage counters of the process-wide pool."""
+    if _POOL is None:
+        return {}
+    return _POOL.get_stats()
+
+
+def close_pool():
+    """Closes the process-wide pool, if one has been created."""
+    global _POOL  # pylint: disable=global-statement
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.close()
+            _POOL = None
+
+
+add_stats_source("vinylvault_db_pool", get_pool_stats)
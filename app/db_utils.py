@@ -1,112 +1,204 @@
 """Script to handle the database interactions for the main app."""
 
-from os import environ as ENV
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodeError
 from datetime import datetime
+from dataclasses import dataclass, field
+from hashlib import sha1
+from os import environ as ENV
+from typing import Callable
 
-from psycopg2 import connect
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import execute_values
 from psycopg2.extensions import connection, cursor
-from dotenv import load_dotenv
 
-load_dotenv()
+from db_pool import get_connection
+from metrics import TimedDictCursor
+from cache import make_cache
 
-
-def get_connection() -> connection:
-    """Returns a database connection."""
-    return connect(
-        dbname=ENV['DB_NAME'],
-        user=ENV['DB_USER'],
-        password=ENV['DB_PASSWORD'],
-        host=ENV['DB_HOST'],
-        port=ENV['DB_PORT']
-    )
+ALBUM_ETAG_VERSION = 1
+# Album changes are invalidated by the process that made them. Other processes
+# (extra app workers, or a separate job_queue worker) only see them once their
+# in-process entries expire, so those are kept short unless Redis is shared.
+ALBUM_CACHE_TTL = 86400 if ENV.get('CACHE_REDIS_URL') else 60
+ALBUM_CACHE = make_cache("album_detail", max_size=int(ENV.get('ALBUM_CACHE_SIZE', 2048)),
+                         ttl=int(ENV.get('ALBUM_CACHE_TTL', ALBUM_CACHE_TTL)))
 
 
 def get_cursor(conn: connection) -> cursor:
     """Returns a database cursor for a connection."""
-    return conn.cursor(cursor_factory=RealDictCursor)
+    return conn.cursor(cursor_factory=TimedDictCursor)
 
 
-def insert_artist(spotify_artist_id: str, artist_name: str) -> int:
-    """Inserts an artist into the database, returning its ID."""
-    stmt = """INSERT INTO artist(spotify_artist_id, artist_name)
-    VALUES (%s, %s) RETURNING artist_id;"""
-    with get_connection() as conn:
-        with get_cursor(conn) as cur:
-            cur.execute(stmt, (spotify_artist_id, artist_name,))
-            artist_id = cur.fetchone()['artist_id']
-        conn.commit()
-    return artist_id
+_album_listeners = []
 
 
-def insert_genre(genre_name: str) -> int:
-    """Inserts an genre into the database, returning its ID."""
-    stmt = """INSERT INTO genre(genre_name)
-    VALUES (%s) RETURNING genre_id;"""
-    with get_connection() as conn:
-        with get_cursor(conn) as cur:
-            cur.execute(stmt, (genre_name,))
-            genre_id = cur.fetchone()['genre_id']
-        conn.commit()
-    return genre_id
+def add_album_listener(callback: Callable[[str, dict], None]):
+    """Registers a callback to run after albums are inserted, updated or deleted.
+    It is called with the event ('insert', 'update' or 'delete') and a dict
+    mapping the affected album IDs to their Spotify album IDs."""
+    _album_listeners.append(callback)
+
+
+def notify_album_listeners(event: str, albums: dict):
+    """Runs every registered album listener for a committed change."""
+    if albums:
+        for callback in _album_listeners:
+            callback(event, albums)
 
 
 def delete_album_by_id(album_id: int):
     """Deletes an album from the database. Handles foreign key dependencies."""
-    album_stmt = "DELETE FROM album WHERE album_id = %s"
     tag_stmt = "DELETE FROM album_tag_assignment WHERE album_id = %s"
+    album_stmt = "DELETE FROM album WHERE album_id = %s RETURNING spotify_album_id"
     with get_connection() as conn:
         with get_cursor(conn) as cur:
-            cur.execute(album_stmt, (album_id,))
             cur.execute(tag_stmt, (album_id,))
+            cur.execute(album_stmt, (album_id,))
+            deleted = cur.fetchone()
         conn.commit()
-
-def insert_tag(tag_name: str) -> int:
-    """Inserts an tag into the database, returning its ID."""
-    stmt = """INSERT INTO tag(tag_name)
-    VALUES (%s) RETURNING tag_id;"""
-    with get_connection() as conn:
-        with get_cursor(conn) as cur:
-            cur.execute(stmt, (tag_name,))
-            tag_id = cur.fetchone()['tag_id']
-        conn.commit()
-    return tag_id
-
-
-def insert_artist_genre_assignment(artist_id: int, genre_id: int):
-    """Inserts an artist genre assignment into the database."""
-    stmt = """INSERT INTO artist_genre_assignment(artist_id, genre_id)
-    VALUES (%s, %s);"""
-    with get_connection() as conn:
-        with get_cursor(conn) as cur:
-            cur.execute(stmt, (artist_id, genre_id,))
-        conn.commit()
-
-
-def insert_album_tag_assignment(album_id: int, tag_id: int):
-    """Inserts an album tag assignment into the database."""
-    stmt = """INSERT INTO album_tag_assignment(album_id, tag_id)
-    VALUES (%s, %s);"""
+    if deleted:
+        notify_album_listeners('delete', {album_id: deleted['spotify_album_id']})
+
+
+@dataclass
+class IngestBatch:
+    """A unit of work collecting the rows needed to add one or more albums.
+    Nothing touches the database until write() is called, at which point
+    every row is written in a single transaction."""
+    artists: dict = field(default_factory=dict)
+    albums: list = field(default_factory=list)
+
+    def add_artist(self, spotify_artist_id: str, artist_name: str,
+                   genres: list[str] = None):
+        """Adds an artist, along with any genres to assign if it is new."""
+        _, existing_genres = self.artists.get(spotify_artist_id, (None, []))
+        self.artists[spotify_artist_id] = (
+            artist_name, genres if genres is not None else existing_genres)
+
+    def add_album(self, spotify_artist_id: str, album_info: tuple,
+                  tags: list[str] = None):
+        """Adds an album credited to an artist already added to the batch.
+        album_info holds the album table's columns in insert order, minus artist_id."""
+        self.albums.append((spotify_artist_id, album_info, tags or []))
+
+    def write(self) -> dict:
+        """Writes the batch in one transaction. Returns a dict mapping
+        the Spotify IDs of newly inserted albums to their album IDs."""
+        if not self.albums:
+            return {}
+        with get_connection() as conn:
+            with get_cursor(conn) as cur:
+                album_ids = write_ingest_batch(cur, self)
+        notify_album_listeners('insert', {v: k for k, v in album_ids.items()})
+        return album_ids
+
+
+def upsert_names(cur: cursor, table: str, column: str, names: list[str]) -> dict:
+    """Inserts any missing names into a lookup table (genre or tag),
+    returning a dict of every given name mapped to its ID."""
+    names = sorted(set(names))
+    if not names:
+        return {}
+    execute_values(
+        cur, f"""INSERT INTO {table}({column}) VALUES %s
+        ON CONFLICT ({column}) DO NOTHING;""", [(x,) for x in names])
+    cur.execute(f"""SELECT {table}_id, {column} FROM {table}
+    WHERE {column} = ANY(%s);""", (names,))
+    return {x[column]: x[f'{table}_id'] for x in cur.fetchall()}
+
+
+def write_ingest_batch(cur: cursor, batch: IngestBatch) -> dict:
+    """Writes every row of an ingest batch using multi-row inserts on
+    an open cursor. Rows are inserted in key order, so overlapping batches
+    lock them in the same order. Returns a dict of new Spotify album IDs
+    to album IDs."""
+    inserted = execute_values(
+        cur, """INSERT INTO artist(spotify_artist_id, artist_name) VALUES %s
+        ON CONFLICT (spotify_artist_id) DO NOTHING
+        RETURNING artist_id, spotify_artist_id;""",
+        sorted((spotify_id, name) for spotify_id, (name, _) in batch.artists.items()),
+        fetch=True)
+    new_artists = {x['spotify_artist_id']: x['artist_id'] for x in inserted}
+    cur.execute("""SELECT artist_id, spotify_artist_id FROM artist
+    WHERE spotify_artist_id = ANY(%s);""", (list(batch.artists),))
+    artist_ids = {x['spotify_artist_id']: x['artist_id'] for x in cur.fetchall()}
+
+    genre_ids = upsert_names(cur, 'genre', 'genre_name', [
+        genre for spotify_id in new_artists
+        for genre in batch.artists[spotify_id][1]])
+    genre_rows = [(artist_id, genre_ids[genre])
+                  for spotify_id, artist_id in new_artists.items()
+                  for genre in set(batch.artists[spotify_id][1])]
+    if genre_rows:
+        execute_values(
+            cur, """INSERT INTO artist_genre_assignment(artist_id, genre_id)
+            VALUES %s ON CONFLICT DO NOTHING;""", genre_rows)
+
+    inserted = execute_values(
+        cur, """INSERT INTO album(artist_id, spotify_album_id, album_type,
+        album_name, release_date, num_tracks, runtime_seconds, album_art_url)
+        VALUES %s ON CONFLICT (spotify_album_id) DO NOTHING
+        RETURNING album_id, spotify_album_id;""",
+        sorted(((artist_ids[spotify_artist_id], *album_info)
+                for spotify_artist_id, album_info, _ in batch.albums), key=lambda x: x[1]),
+        fetch=True)
+    album_ids = {x['spotify_album_id']: x['album_id'] for x in inserted}
+
+    album_tags = {album_info[0]: tags for _, album_info, tags in batch.albums}
+    tag_ids = upsert_names(cur, 'tag', 'tag_name', [
+        tag for spotify_album_id in album_ids
+        for tag in album_tags[spotify_album_id]])
+    tag_rows = [(album_id, tag_ids[tag])
+                for spotify_album_id, album_id in album_ids.items()
+                for tag in set(album_tags[spotify_album_id])]
+    if tag_rows:
+        execute_values(
+            cur, """INSERT INTO album_tag_assignment(album_id, tag_id)
+            VALUES %s ON CONFLICT DO NOTHING;""", tag_rows)
+    if album_ids:
+        cur.execute("SELECT refresh_album_search(%s);", (list(album_ids.values()),))
+    return album_ids
+
+
+def get_albums_missing_tags(limit: int, max_attempts: int) -> list[dict]:
+    """Returns albums whose tags have not yet been scraped, oldest first,
+    skipping any that have already failed max_attempts times."""
+    stmt = """SELECT a.album_id, a.album_name, ar.artist_name
+    FROM album AS a JOIN artist AS ar USING (artist_id)
+    WHERE a.tags_checked_at IS NULL AND a.tag_attempts < %s
+    ORDER BY a.album_id LIMIT %s;"""
     with get_connection() as conn:
         with get_cursor(conn) as cur:
-            cur.execute(stmt, (album_id, tag_id,))
-        conn.commit()
+            cur.execute(stmt, (max_attempts, limit))
+            res = cur.fetchall()
+    return [dict(x) for x in res]
 
 
-def insert_album(album_info: tuple) -> int:
-    """Inserts an album into the database, returning its ID."""
-    (artist_id, spotify_album_id, album_type, album_name,
-     release_date, num_tracks, runtime_seconds, art_url) = album_info
-    stmt = """INSERT INTO album(artist_id, spotify_album_id, album_type,
-    album_name, release_date, num_tracks, runtime_seconds, album_art_url)
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING album_id;"""
+def save_album_tags(album_tags: dict, failed: list[int]) -> int:
+    """Writes scraped tags for a batch of albums in one transaction, marking
+    them as checked, and counts a failed attempt against the rest.
+    Returns the number of tag assignments written."""
     with get_connection() as conn:
         with get_cursor(conn) as cur:
-            cur.execute(stmt, (artist_id, spotify_album_id, album_type,
-                               album_name, release_date, num_tracks, runtime_seconds, art_url,))
-            album_id = cur.fetchone()['album_id']
-        conn.commit()
-    return album_id
+            tag_ids = upsert_names(cur, 'tag', 'tag_name', [
+                tag for tags in album_tags.values() for tag in tags])
+            tag_rows = [(album_id, tag_ids[tag])
+                        for album_id, tags in album_tags.items() for tag in set(tags)]
+            if tag_rows:
+                execute_values(
+                    cur, """INSERT INTO album_tag_assignment(album_id, tag_id)
+                    VALUES %s ON CONFLICT DO NOTHING;""", tag_rows)
+            cur.execute("""UPDATE album SET tags_checked_at = NOW()
+            WHERE album_id = ANY(%s) RETURNING album_id, spotify_album_id;""",
+                        (list(album_tags),))
+            updated = {x['album_id']: x['spotify_album_id'] for x in cur.fetchall()}
+            cur.execute("""UPDATE album SET tag_attempts = tag_attempts + 1
+            WHERE album_id = ANY(%s);""", (list(failed),))
+            if tag_rows:
+                cur.execute("SELECT refresh_album_search(%s);", (list(album_tags),))
+    notify_album_listeners('update', updated)
+    return len(tag_rows)
 
 
 def get_all_albums() -> list[dict]:
@@ -127,35 +219,214 @@ def get_all_albums() -> list[dict]:
         } for x in res]
 
 
-def get_all_artists() -> dict:
-    """Returns a dict of all Spotify artist IDs in the database."""
-    stmt = "SELECT artist_id, spotify_artist_id FROM artist;"
+PAGE_SIZE = 48
+MAX_PAGE_SIZE = 200
+SEARCH_PAGE_SIZE = 20
+SORT_ORDERS = {
+    'artist': ('ar.artist_name', 'ASC'),
+    'title': ('a.album_name', 'ASC'),
+    'oldest': ('a.release_date', 'ASC'),
+    'newest': ('a.release_date', 'DESC')
+}
+
+
+def encode_cursor(sort_value, album_id: int) -> str:
+    """Returns an opaque page cursor for the last album on a page."""
+    raw = json.dumps([str(sort_value), album_id]).encode()
+    return urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(page_cursor: str) -> tuple:
+    """Returns the (sort value, album ID) pair encoded in a page cursor."""
+    try:
+        sort_value, album_id = json.loads(urlsafe_b64decode(page_cursor.encode()))
+        return str(sort_value), int(album_id)
+    except (DecodeError, ValueError, TypeError) as err:
+        raise ValueError("Invalid page cursor.") from err
+
+
+def get_album_filters(artist: str = None, decade: int = None,
+                      genre: str = None, tag: str = None) -> tuple[list[str], list]:
+    """Returns the WHERE clauses and parameters for the collection filters.
+    Each clause is written to be served by an index."""
+    clauses, params = [], []
+    if artist:
+        clauses.append("LOWER(ar.artist_name) = LOWER(%s)")
+        params.append(artist)
+    if decade is not None:
+        clauses.append("""a.release_date >= MAKE_DATE(%s, 1, 1)
+        AND a.release_date < MAKE_DATE(%s, 1, 1)""")
+        params.extend([decade, decade + 10])
+    if genre:
+        clauses.append("""a.artist_id IN (SELECT aga.artist_id
+        FROM artist_genre_assignment AS aga JOIN genre AS g USING (genre_id)
+        WHERE g.genre_name = LOWER(%s))""")
+        params.append(genre)
+    if tag:
+        clauses.append("""a.album_id IN (SELECT ata.album_id
+        FROM album_tag_assignment AS ata JOIN tag AS t USING (tag_id)
+        WHERE LOWER(t.tag_name) = LOWER(%s))""")
+        params.append(tag)
+    return clauses, params
+
+
+def get_album_page(sort: str = 'artist', page_cursor: str = None, limit: int = PAGE_SIZE,
+                   **filters) -> tuple[list[dict], str]:
+    """Returns one page of the collection using keyset pagination on
+    (sort column, album_id), plus the cursor for the next page (None on
+    the last page). Only the columns rendered on the page are selected."""
+    if sort not in SORT_ORDERS:
+        raise ValueError(f"Unknown sort order: {sort}")
+    column, direction = SORT_ORDERS[sort]
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    clauses, params = get_album_filters(**filters)
+    if page_cursor:
+        comparison = ">" if direction == "ASC" else "<"
+        clauses.append(f"({column}, a.album_id) {comparison} (%s, %s)")
+        params.extend(decode_cursor(page_cursor))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    stmt = f"""SELECT a.album_id, a.album_name, ar.artist_name,
+    a.release_date, a.album_art_url, {column} AS sort_value
+    FROM album AS a JOIN artist AS ar USING (artist_id)
+    {where}
+    ORDER BY {column} {direction}, a.album_id {direction}
+    LIMIT %s;"""
     with get_connection() as conn:
-        with get_cursor(conn) as cur:
-            cur.execute(stmt)
-            results = cur.fetchall()
-    return {x['spotify_artist_id']: x['artist_id'] for x in results}
-
-
-def get_all_genres() -> dict:
-    """Returns a dict of all genres mapped to their IDs."""
-    stmt = "SELECT genre_id, genre_name FROM genre;"
+        with conn.cursor() as cur:
+            cur.execute(stmt, (*params, limit + 1))
+            rows = cur.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][5], rows[-1][0])
+    return [
+        {
+            'album_id': album_id,
+            'title': album_name,
+            'artist': artist_name,
+            'release_date': release_date.isoformat(),
+            'img_url': album_art_url
+        } for album_id, album_name, artist_name, release_date, album_art_url, _ in rows
+    ], next_cursor
+
+
+def search_collection(query: str, limit: int = SEARCH_PAGE_SIZE,
+                      offset: int = 0) -> tuple[list[dict], int]:
+    """Returns one page of the albums matching a query, best match first,
+    plus the offset of the next page (None on the last page). Albums match
+    on whole words of their name, artist, genres or tags, or fuzzily on
+    partial and misspelt words through the trigram index."""
+    query = " ".join(query.split())
+    if not query:
+        return [], None
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    stmt = """SELECT a.album_id, a.album_name, ar.artist_name, a.release_date,
+    a.album_art_url, a.spotify_album_id
+    FROM (
+        SELECT album_id,
+        TS_RANK(search_vector, q.tsq) + WORD_SIMILARITY(%(query)s, document) AS rank
+        FROM album_search, WEBSEARCH_TO_TSQUERY('simple', %(query)s) AS q(tsq)
+        WHERE search_vector @@ q.tsq OR %(query)s <%% document
+        ORDER BY rank DESC, album_id
+        LIMIT %(limit)s OFFSET %(offset)s) AS s
+    JOIN album AS a USING (album_id) JOIN artist AS ar USING (artist_id)
+    ORDER BY s.rank DESC, s.album_id;"""
     with get_connection() as conn:
-        with get_cursor(conn) as cur:
-            cur.execute(stmt)
-            res = cur.fetchall()
-    return {x['genre_name']: x['genre_id'] for x in res}
-
+        with conn.cursor() as cur:
+            cur.execute(stmt, {'query': query, 'limit': limit + 1, 'offset': max(0, offset)})
+            rows = cur.fetchall()
+
+    next_offset = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_offset = max(0, offset) + limit
+    return [
+        {
+            'album_id': album_id,
+            'title': album_name,
+            'artist': artist_name,
+            'release_date': release_date.isoformat(),
+            'img_url': album_art_url,
+            'spotify_id': spotify_album_id
+        } for album_id, album_name, artist_name, release_date, album_art_url, spotify_album_id
+        in rows
+    ], next_offset
+
+
+def get_album_ids(**filters) -> list[int]:
+    """Returns the IDs of every album in the collection matching the filters."""
+    clauses, params = get_album_filters(**filters)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    stmt = f"""SELECT a.album_id FROM album AS a
+    JOIN artist AS ar USING (artist_id) {where};"""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(stmt, params)
+            rows = cur.fetchall()
+    return [x[0] for x in rows]
 
 
-def get_all_tags() -> dict:
-    """Returns a dict of all tags mapped to their IDs."""
-    stmt = "SELECT tag_id, tag_name FROM tag;"
+def get_owned_spotify_album_ids() -> set[str]:
+    """Returns the Spotify IDs of every album in the collection."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT spotify_album_id FROM album;")
+            rows = cur.fetchall()
+    return {x[0] for x in rows}
+
+
+def get_album_features(album_ids: list[int] = None) -> list[tuple]:
+    """Returns (album_id, kind, name) rows for the genres (through the album's
+    artist) and tags of every album, or only of the given albums."""
+    where = "WHERE a.album_id = ANY(%(ids)s)" if album_ids is not None else ""
+    tag_where = "WHERE ata.album_id = ANY(%(ids)s)" if album_ids is not None else ""
+    stmt = f"""SELECT a.album_id, 'genre', g.genre_name FROM album AS a
+    JOIN artist_genre_assignment USING (artist_id) JOIN genre AS g USING (genre_id)
+    {where}
+    UNION ALL
+    SELECT ata.album_id, 'tag', t.tag_name FROM album_tag_assignment AS ata
+    JOIN tag AS t USING (tag_id) {tag_where};"""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(stmt, {'ids': list(album_ids or [])})
+            rows = cur.fetchall()
+    return rows
+
+
+def get_album_summaries(album_ids: list[int]) -> list[dict]:
+    """Returns the card details of the given albums, in the order given.
+    Albums that no longer exist are left out."""
+    stmt = """SELECT a.album_id, a.album_name, ar.artist_name,
+    a.release_date, a.album_art_url
+    FROM album AS a JOIN artist AS ar USING (artist_id)
+    WHERE a.album_id = ANY(%s);"""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(stmt, (list(album_ids),))
+            rows = {x[0]: x for x in cur.fetchall()}
+    return [
+        {
+            'album_id': album_id,
+            'title': album_name,
+            'artist': artist_name,
+            'release_date': release_date.isoformat(),
+            'img_url': album_art_url
+        } for album_id, album_name, artist_name, release_date, album_art_url
+        in (rows[x] for x in album_ids if x in rows)
+    ]
+
+
+def get_artist_ids(spotify_artist_ids: list[str]) -> dict:
+    """Returns a dict of the given Spotify artist IDs already in the
+    database mapped to their artist IDs."""
+    stmt = """SELECT artist_id, spotify_artist_id FROM artist
+    WHERE spotify_artist_id = ANY(%s);"""
     with get_connection() as conn:
         with get_cursor(conn) as cur:
-            cur.execute(stmt)
-            res = cur.fetchall()
-    return {x['tag_name']: x['tag_id'] for x in res}
+            cur.execute(stmt, (list(spotify_artist_ids),))
+            results = cur.fetchall()
+    return {x['spotify_artist_id']: x['artist_id'] for x in results}
 
 
 def format_runtime(seconds: int) -> str:
@@ -177,18 +448,21 @@ def format_release(release_date: datetime) -> str:
 
 
 def get_album_by_id(album_id: int) -> dict:
-    """Retrieves full details of an album from the database by a specific ID."""
+    """Retrieves full details of an album from the database by a specific ID.
+    Returns None if no such album exists."""
     stmt = """SELECT ar.artist_name, a.*,
-    STRING_AGG(g.genre_name, ', ' ORDER BY g.genre_name ASC)
-    AS genres FROM genre AS g JOIN artist_genre_assignment 
-    USING(genre_id) JOIN album AS a USING(artist_id) 
-    JOIN artist AS ar USING(artist_id) WHERE album_id = %s
+    COALESCE(STRING_AGG(g.genre_name, ', ' ORDER BY g.genre_name ASC), '')
+    AS genres FROM album AS a JOIN artist AS ar USING(artist_id)
+    LEFT JOIN artist_genre_assignment USING(artist_id)
+    LEFT JOIN genre AS g USING(genre_id) WHERE album_id = %s
     GROUP BY a.album_id, ar.artist_name;"""
     with get_connection() as conn:
         with get_cursor(conn) as cur:
             cur.execute(stmt, (album_id,))
             res = cur.fetchone()
 
+    if res is None:
+        return None
     return {
         'album_id': res['album_id'],
         "title": res['album_name'],
@@ -197,5 +471,34 @@ def get_album_by_id(album_id: int) -> dict:
         "release_date": format_release(res['release_date']),
         "num_tracks": res['num_tracks'],
         "runtime_seconds": format_runtime(res['runtime_seconds']),
-        "album_art_url": res['album_art_url']
+        "album_art_url": res['album_art_url'],
+        "added_at": res['added_at']
     }
+
+
+def get_album_detail(album_id: int) -> dict:
+    """Returns a cached, fully formatted album along with its ETag and
+    Last-Modified values, reading through to the database on a miss.
+    Returns None if no such album exists."""
+    detail = ALBUM_CACHE.get(str(album_id))
+    if detail is None:
+        album = get_album_by_id(album_id)
+        if album is None:
+            return None
+        digest = sha1(repr((ALBUM_ETAG_VERSION, sorted(album.items()))).encode())
+        detail = {
+            'album': album,
+            'etag': digest.hexdigest(),
+            'last_modified': album['added_at']
+        }
+        ALBUM_CACHE.set(str(album_id), detail)
+    return detail
+
+
+def invalidate_album_detail(event: str, albums: dict):  # pylint: disable=unused-argument
+    """Drops the cached details of albums that have changed."""
+    for album_id in albums:
+        ALBUM_CACHE.invalidate(str(album_id))
+
+
+add_album_listener(invalidate_album_detail)
@@ -1,8 +1,20 @@
-"""File to hold API endpoints as constants for reuse."""
+"""File to hold API endpoints as constants for reuse. The base URLs can be
+overridden through the environment, e.g. to point at local stand-ins."""
 
 # pylint: skip-file
-ARTIST_ENDPOINT = "https://api.spotify.com/v1/artists/"
-ALBUM_ENDPOINT = "https://api.spotify.com/v1/albums/"
-SEARCH_ENDPOINT = "https://api.spotify.com/v1/search?"
-RECOMMENDATIONS_ENDPOINT = "https://api.spotify.com/v1/recommendations?"
-DISCOGS_SEARCH = "https://www.discogs.com/sell/list?q="
+from os import environ as ENV
+
+SPOTIFY_API_URL = ENV.get('SPOTIFY_API_URL', "https://api.spotify.com/v1").rstrip("/")
+SPOTIFY_ACCOUNTS_URL = ENV.get('SPOTIFY_ACCOUNTS_URL', "https://accounts.spotify.com").rstrip("/")
+LASTFM_URL = ENV.get('LASTFM_URL', "https://www.last.fm").rstrip("/")
+DISCOGS_URL = ENV.get('DISCOGS_URL', "https://www.discogs.com").rstrip("/")
+
+ARTIST_ENDPOINT = f"{SPOTIFY_API_URL}/artists/"
+ALBUM_ENDPOINT = f"{SPOTIFY_API_URL}/albums/"
+SEVERAL_ARTISTS_ENDPOINT = f"{SPOTIFY_API_URL}/artists?ids="
+SEVERAL_ALBUMS_ENDPOINT = f"{SPOTIFY_API_URL}/albums?ids="
+SEARCH_ENDPOINT = f"{SPOTIFY_API_URL}/search?"
+RECOMMENDATIONS_ENDPOINT = f"{SPOTIFY_API_URL}/recommendations?"
+TOKEN_ENDPOINT = f"{SPOTIFY_ACCOUNTS_URL}/api/token"
+LASTFM_ALBUM_ENDPOINT = f"{LASTFM_URL}/music/"
+DISCOGS_SEARCH = f"{DISCOGS_URL}/sell/list?q="
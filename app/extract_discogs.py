@@ -1,9 +1,30 @@
 """Script to handle the extraction of listings from Discogs."""
+import atexit
 import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from os import environ as ENV
+from queue import Empty, Queue
+from threading import BoundedSemaphore, Lock
+from urllib.parse import urlsplit
+
 from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.firefox.options import Options
 import bs4
 from endpoints import DISCOGS_SEARCH
+from html_parsing import make_soup
+from metrics import UPSTREAM_SECONDS, timed
+
+DISCOGS_HOST = urlsplit(DISCOGS_SEARCH).hostname
+
+# Discogs renders the row class with trailing whitespace, so match on the class token.
+LISTING_ROWS = bs4.SoupStrainer(
+    "tr", class_=lambda classes: bool(classes) and "shortcut_navigable" in classes.split())
+
+# A currency symbol and an amount, either way round ('€1.234,56' or '1.234,56 €').
+PRICE_PATTERN = re.compile(r"((?:[A-Z]{1,3})?[€$£¥₹])\s?(\d(?:[\d.,]*\d)?)"
+                           r"|(\d(?:[\d.,]*\d)?)\s?((?:[A-Z]{1,3})?[€$£¥₹])")
 
 
 def format_search_url(artist_name: str, album_name: str) -> str:
@@ -15,9 +36,9 @@ def format_search_url(artist_name: str, album_name: str) -> str:
     return f"{DISCOGS_SEARCH}{artist_chunk}+{album_chunk}{filters}"
 
 
-def get_soop(page_source: str) -> bs4.BeautifulSoup:
-    """Returns a page soup from a URL."""
-    return bs4.BeautifulSoup(page_source, 'html.parser')
+def get_soop(page_source: str, parser: str = None) -> bs4.BeautifulSoup:
+    """Returns a page soup from a page's source, containing only the listing rows."""
+    return make_soup(page_source, LISTING_ROWS, parser)
 
 
 def scrape_listings(page_soop: bs4.BeautifulSoup) -> list[bs4.Tag]:
@@ -25,21 +46,155 @@ def scrape_listings(page_soop: bs4.BeautifulSoup) -> list[bs4.Tag]:
     return page_soop.find_all('tr', class_="shortcut_navigable")
 
 
-def load_page_source(url: str) -> str:
-    """Loads the page source using Selenium with Firefox WebDriver in headless mode.
-    Returns the page source as a string."""
+BROWSER_POOL_SIZE = 3
+MAX_PAGES_PER_BROWSER = 50
+PAGE_LOAD_TIMEOUT = 30
+
+
+def create_driver() -> webdriver.Firefox:
+    """Launches a headless Firefox WebDriver."""
     options = Options()
     options.headless = True
     options.add_argument("--headless")
     options.add_argument("--disable-gpu")
     options.add_argument("--no-sandbox")
     driver = webdriver.Firefox(options=options)
+    driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+    return driver
+
+
+def quit_driver(driver: webdriver.Firefox):
+    """Quits a WebDriver, ignoring errors from one that has already crashed."""
     try:
-        driver.get(url)
-        page_source = driver.page_source
-        return page_source
-    finally:
         driver.quit()
+    except WebDriverException:
+        pass
+
+
+class BrowserPool:
+    """A bounded pool of long-lived headless browsers. Each browser is
+    recycled after max_pages page loads, and discarded if it crashes."""
+
+    def __init__(self, size: int = BROWSER_POOL_SIZE,
+                 max_pages: int = MAX_PAGES_PER_BROWSER):
+        self.size = size
+        self.max_pages = max_pages
+        self._idle = Queue()
+        self._slots = BoundedSemaphore(size)
+        self._page_counts = {}
+        self._lock = Lock()
+        self.launched = 0
+        self.recycled = 0
+        self.crashed = 0
+
+    @contextmanager
+    def browser(self):
+        """Context manager lending out a browser, launching one if none are idle.
+        The browser goes back to the pool on success and is quit if the block
+        raises anything."""
+        self._slots.acquire()
+        try:
+            try:
+                driver = self._idle.get_nowait()
+            except Empty:
+                driver = create_driver()
+                with self._lock:
+                    self.launched += 1
+                    self._page_counts[id(driver)] = 0
+            try:
+                yield driver
+            except BaseException as err:
+                # The browser may be dead or mid-navigation, so it is never reused.
+                with self._lock:
+                    if isinstance(err, WebDriverException):
+                        self.crashed += 1
+                    self._page_counts.pop(id(driver), None)
+                quit_driver(driver)
+                raise
+            self._return(driver)
+        finally:
+            self._slots.release()
+
+    def _return(self, driver: webdriver.Firefox):
+        """Puts a browser back in the pool, or quits it if it is due a recycle."""
+        with self._lock:
+            self._page_counts[id(driver)] += 1
+            recycle = self._page_counts[id(driver)] >= self.max_pages
+            if recycle:
+                self.recycled += 1
+                del self._page_counts[id(driver)]
+        if recycle:
+            quit_driver(driver)
+        else:
+            self._idle.put(driver)
+
+    def fetch(self, url: str) -> str:
+        """Returns the page source of a URL, retrying once on a fresh browser
+        if the first one crashes."""
+        for attempt in range(2):
+            try:
+                with self.browser() as driver, timed(UPSTREAM_SECONDS, DISCOGS_HOST, "browser"):
+                    driver.get(url)
+                    return driver.page_source
+            except WebDriverException:
+                if attempt:
+                    raise
+        return None
+
+    def fetch_all(self, urls: list[str]) -> dict:
+        """Fetches many URLs concurrently across the pool. Returns a dict
+        mapping each URL to its page source, or to the exception it raised."""
+        def fetch_or_error(url: str):
+            try:
+                return self.fetch(url)
+            except WebDriverException as err:
+                return err
+
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            return dict(zip(urls, executor.map(fetch_or_error, urls)))
+
+    def get_stats(self) -> dict:
+        """Returns the pool's launch, recycle and crash counts."""
+        with self._lock:
+            return {'size': self.size, 'idle': self._idle.qsize(),
+                    'launched': self.launched, 'recycled': self.recycled,
+                    'crashed': self.crashed}
+
+    def close(self):
+        """Quits every idle browser."""
+        while True:
+            try:
+                quit_driver(self._idle.get_nowait())
+            except Empty:
+                break
+
+
+_browser_pool = None
+_browser_pool_lock = Lock()
+
+
+def get_browser_pool() -> BrowserPool:
+    """Returns the process-wide browser pool, creating it on first use."""
+    global _browser_pool  # pylint: disable=global-statement
+    with _browser_pool_lock:
+        if _browser_pool is None:
+            _browser_pool = BrowserPool(
+                size=int(ENV.get('BROWSER_POOL_SIZE', BROWSER_POOL_SIZE)),
+                max_pages=int(ENV.get('MAX_PAGES_PER_BROWSER', MAX_PAGES_PER_BROWSER)))
+            atexit.register(_browser_pool.close)
+    return _browser_pool
+
+
+def load_page_source(url: str) -> str:
+    """Loads the page source using a pooled headless Firefox WebDriver.
+    Returns the page source as a string."""
+    return get_browser_pool().fetch(url)
+
+
+def load_page_sources(urls: list[str]) -> dict:
+    """Loads many page sources concurrently using the browser pool. Returns a
+    dict mapping each URL to its page source, or to the exception it raised."""
+    return get_browser_pool().fetch_all(urls)
 
 
 def get_item_description(listing: bs4.Tag) -> str:
@@ -66,7 +221,7 @@ def get_listing_url(listing: bs4.Tag) -> str:
 
 def clean_price(price_string):
     """Removes the comment from a price label."""
-    match = re.search(r"[€$£¥₹]\s?\d+(\.\d{1,2})?", price_string)
+    match = PRICE_PATTERN.search(price_string)
     return match.group(0) if match else price_string
 
 
@@ -1,15 +1,24 @@
-"""Script to handle the scraping of LastFM album tags and their DB insertion."""
+"""Script to handle the scraping of LastFM album tags."""
 import bs4
-import requests as req
 
-from db_utils import get_all_tags, insert_tag, insert_album_tag_assignment
+import http_client
+from endpoints import LASTFM_ALBUM_ENDPOINT
+from html_parsing import make_soup
+
+TAG_SECTION = bs4.SoupStrainer("section", class_="catalogue-tags")
+
+
+class PageNotFoundError(ConnectionError):
+    """Raised when Last.fm has no page for an album."""
 
 
 def load_page_source(url: str) -> str:
     """Returns the page source from a URL."""
-    response = req.get(url, timeout=10)
+    response = http_client.get(url, timeout=10)
     if response.status_code == 200:
         return response.content
+    if response.status_code == 404:
+        raise PageNotFoundError(f"No Last.fm page at {url}.")
     raise ConnectionError("Failed to retrieve page source.")
 
 
@@ -17,12 +26,12 @@ def get_lastfm_url(album: str, artist: str) -> str:
     """Forms a Last FM page URL from an album and artist name."""
     album_str = "+".join(album.split(" "))
     artist_str = "+".join(artist.split(" "))
-    return f"https://www.last.fm/music/{artist_str}/{album_str}"
+    return f"{LASTFM_ALBUM_ENDPOINT}{artist_str}/{album_str}"
 
 
-def get_soup(source: str) -> bs4.BeautifulSoup:
-    """Returns a BS4 object from a page's source."""
-    return bs4.BeautifulSoup(source, 'html.parser')
+def get_soup(source: str, parser: str = None) -> bs4.BeautifulSoup:
+    """Returns a BS4 object from a page's source, containing only the tag section."""
+    return make_soup(source, TAG_SECTION, parser)
 
 
 def get_tag_section(soup: bs4.BeautifulSoup) -> bs4.Tag:
@@ -37,14 +46,10 @@ def parse_tags(tag_section: bs4.Tag) -> list[str]:
     return [tag.find("a").text for tag in tags]
 
 
-def process_tags(album_id: int, album_title: str, artist_name: str):
-    """Scrapes and inserts the tags of a particular album."""
+def get_album_tags(album_title: str, artist_name: str) -> list[str]:
+    """Scrapes the tags of a particular album. Returns an empty list if
+    the album's page has no tags."""
     url = get_lastfm_url(album_title, artist_name)
     source = load_page_source(url)
-    soup = get_soup(source)
-    tags = parse_tags(get_tag_section(soup))
-    existing_tags = get_all_tags()
-    for tag in tags:
-        if tag not in existing_tags:
-            existing_tags[tag] = insert_tag(tag)
-        insert_album_tag_assignment(album_id, existing_tags[tag])
+    tag_section = get_tag_section(get_soup(source))
+    return parse_tags(tag_section) if tag_section else []
@@ -1,34 +1,50 @@
 """Script to handle the querying of the external Spotify API."""
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from os import environ as ENV
+from urllib.parse import quote_plus
 
-import requests as req
+from requests import Response
 
-from endpoints import SEARCH_ENDPOINT, ARTIST_ENDPOINT, ALBUM_ENDPOINT
-from db_utils import (insert_artist, insert_genre, insert_artist_genre_assignment,
-                      insert_album, get_all_artists, get_all_genres)
-from extract_lastfm import process_tags
+import http_client
+from cache import make_cache
+from endpoints import (SEARCH_ENDPOINT, ARTIST_ENDPOINT, ALBUM_ENDPOINT,
+                       SEVERAL_ARTISTS_ENDPOINT, SEVERAL_ALBUMS_ENDPOINT)
+from db_utils import IngestBatch, get_artist_ids
+from collection_index import is_owned
 
 TIMEOUT = 10
+MAX_ALBUMS_PER_CALL = 20
+MAX_ARTISTS_PER_CALL = 50
+MAX_ARTIST_WORKERS = 8
+
+SEARCH_CACHE = make_cache("search", max_size=int(ENV.get('SEARCH_CACHE_SIZE', 512)),
+                          ttl=int(ENV.get('SEARCH_CACHE_TTL', 600)))
+
+
+def call_spotify_api(url: str, access_token: str) -> Response:
+    """Makes an authorised GET request to the Spotify API. Retries and 429
+    back-off are handled by the shared HTTP client."""
+    headers = {"Authorization": f"Bearer {access_token}"}
+    return http_client.get(url, headers=headers, timeout=TIMEOUT)
 
 
 def search_album(query: str, access_token: str) -> list[dict]:
     """Returns a list of album dictionaries matching a specific search
     query from the Spotify API."""
-    url = f"{SEARCH_ENDPOINT}q={query}&type=album"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = req.get(url, headers=headers, timeout=TIMEOUT)
+    url = f"{SEARCH_ENDPOINT}q={quote_plus(query)}&type=album"
+    response = call_spotify_api(url, access_token)
     if response.status_code == 200:
         return response.json()["albums"]["items"]
     raise ConnectionError(
-        f"Failed to retrieve data. Code: {response.status_code}:{access_token}")
+        f"Failed to retrieve data. Code: {response.status_code}")
 
 
 def call_get_artist_endpoint(artist_id: str, access_token: str) -> dict:
     """Makes an API call to the artist_id endpoint. Returns the response dict."""
     url = f"{ARTIST_ENDPOINT}{artist_id}"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = req.get(url, headers=headers, timeout=TIMEOUT)
+    response = call_spotify_api(url, access_token)
     if response.status_code == 200:
         return response.json()
     raise ConnectionError(
@@ -38,14 +54,39 @@ def call_get_artist_endpoint(artist_id: str, access_token: str) -> dict:
 def call_get_album_endpoint(album_id: str, access_token: str) -> dict:
     """Makes an API call to the artist_id endpoint. Returns the response dict."""
     url = f"{ALBUM_ENDPOINT}{album_id}"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = req.get(url, headers=headers, timeout=TIMEOUT)
+    response = call_spotify_api(url, access_token)
     if response.status_code == 200:
         return response.json()
     raise ConnectionError(
         f"Failed to retrieve data. Code: {response.status_code}")
 
 
+def call_get_several_albums_endpoint(album_ids: list[str], access_token: str) -> list[dict]:
+    """Makes one API call for up to 20 album IDs. Returns the album dicts in the
+    order requested, with None for any ID Spotify could not find."""
+    if len(album_ids) > MAX_ALBUMS_PER_CALL:
+        raise ValueError(f"At most {MAX_ALBUMS_PER_CALL} album IDs per call.")
+    url = f"{SEVERAL_ALBUMS_ENDPOINT}{','.join(album_ids)}"
+    response = call_spotify_api(url, access_token)
+    if response.status_code == 200:
+        return response.json()["albums"]
+    raise ConnectionError(
+        f"Failed to retrieve data. Code: {response.status_code}")
+
+
+def call_get_several_artists_endpoint(artist_ids: list[str], access_token: str) -> list[dict]:
+    """Makes one API call for up to 50 artist IDs. Returns the artist dicts in the
+    order requested, with None for any ID Spotify could not find."""
+    if len(artist_ids) > MAX_ARTISTS_PER_CALL:
+        raise ValueError(f"At most {MAX_ARTISTS_PER_CALL} artist IDs per call.")
+    url = f"{SEVERAL_ARTISTS_ENDPOINT}{','.join(artist_ids)}"
+    response = call_spotify_api(url, access_token)
+    if response.status_code == 200:
+        return response.json()["artists"]
+    raise ConnectionError(
+        f"Failed to retrieve data. Code: {response.status_code}")
+
+
 def parse_artist_from_api(response: dict) -> dict:
     """Removes unnecessary details from a get artist API response."""
     return {
@@ -107,9 +148,14 @@ def get_image_url(album: dict) -> str:
 
 
 def get_artists_from_artist_ids(artist_ids: list, access_token: str) -> list[dict]:
-    """Returns a list of artist dicts from an album ID."""
-    responses = [call_get_artist_endpoint(x, access_token) for x in artist_ids]
-    return [parse_artist_from_api(response) for response in responses]
+    """Returns a list of artist dicts from a list of artist IDs, in the same order.
+    Lookups run concurrently on a bounded thread pool."""
+    if not artist_ids:
+        return []
+    with ThreadPoolExecutor(max_workers=min(MAX_ARTIST_WORKERS, len(artist_ids))) as executor:
+        responses = executor.map(
+            lambda artist_id: call_get_artist_endpoint(artist_id, access_token), artist_ids)
+        return [parse_artist_from_api(response) for response in responses]
 
 
 def parse_search_results(albums: list[dict]) -> list[dict]:
@@ -127,20 +173,43 @@ def parse_search_results(albums: list[dict]) -> list[dict]:
     ]
 
 
-def add_album(spotify_album_id: str, access_token: str):
-    """Adds an album to the database, handling foreign key dependencies."""
+def normalise_query(query: str) -> str:
+    """Returns a search query lower-cased with its whitespace collapsed."""
+    return " ".join(query.lower().split())
+
+
+def search_albums_cached(query: str, access_token: str) -> list[dict]:
+    """Returns parsed search results for a query, served from the search
+    cache when the same normalised query has been made recently."""
+    key = normalise_query(query)
+    return SEARCH_CACHE.get_or_set(
+        key, lambda: parse_search_results(search_album(key, access_token)))
+
+
+def add_album(spotify_album_id: str, access_token: str) -> int:
+    """Adds an album to the database, handling foreign key dependencies.
+    All upstream data is fetched first and then written in one transaction,
+    so a failed API call leaves nothing behind. Tags are added later by the
+    tag enrichment stage. Returns the new album ID, or None if the album
+    was already in the collection, in which case Spotify is never called."""
+    if is_owned(spotify_album_id):
+        return None
     album_data = fetch_and_parse_album_data(spotify_album_id, access_token)
-    artist_ids = process_artists(album_data['artists'], access_token)
-    primary_artist_id = artist_ids[0]
-    album_info = (
-        primary_artist_id, spotify_album_id, album_data['album_type'],
+    batch = IngestBatch()
+    process_artists(album_data['artists'], access_token, batch)
+    batch.add_album(album_data['artists'][0]['spotify_id'],
+                    get_album_info(spotify_album_id, album_data))
+    return batch.write().get(spotify_album_id)
+
+
+def get_album_info(spotify_album_id: str, album_data: dict) -> tuple:
+    """Returns the album row values for an ingest batch from parsed album data."""
+    return (
+        spotify_album_id, album_data['album_type'],
         album_data['title'], album_data['release_date'],
         album_data['num_tracks'], album_data['runtime_seconds'],
         album_data['art_url']
     )
-    album_id = insert_album(album_info)
-    process_tags(album_id, album_data['title'],
-                 album_data['artists'][0]['name'])
 
 
 def fetch_and_parse_album_data(spotify_album_id: str, access_token: str) -> dict:
@@ -149,46 +218,15 @@ def fetch_and_parse_album_data(spotify_album_id: str, access_token: str) -> dict
     return parse_album_from_api(response)
 
 
-def process_artists(artists: list, access_token: str) -> list:
-    """Processes and inserts artists if necessary, returning their IDs."""
-    artist_ids = []
-    all_artists = get_all_artists()
-    all_genres = get_all_genres()
+def process_artists(artists: list, access_token: str, batch: IngestBatch):
+    """Adds an album's artists to an ingest batch, fetching the genres
+    of any artists not already in the database."""
+    known_artists = get_artist_ids([x['spotify_id'] for x in artists])
+    new_artist_ids = list(dict.fromkeys(x['spotify_id'] for x in artists
+                                        if x['spotify_id'] not in known_artists))
+    genres = {x['spotify_id']: x['genres']
+              for x in get_artists_from_artist_ids(new_artist_ids, access_token)}
 
     for artist in artists:
-        artist_id = get_or_create_artist(
-            artist, all_artists, all_genres, access_token)
-        artist_ids.append(artist_id)
-
-    return artist_ids
-
-
-def get_or_create_artist(artist: dict, all_artists: dict,
-                         all_genres: dict, access_token: str) -> int:
-    """Retrieves or inserts an artist and their genres."""
-    spotify_id = artist['spotify_id']
-
-    if spotify_id not in all_artists:
-        artist_id = insert_artist(spotify_id, artist['name'])
-        all_artists[spotify_id] = artist_id
-        fetch_and_assign_genres(artist_id, spotify_id,
-                                all_genres, access_token)
-    else:
-        artist_id = all_artists[spotify_id]
-
-    return artist_id
-
-
-def fetch_and_assign_genres(artist_id: int, spotify_id: str, all_genres: dict, access_token: str):
-    """Fetches and assigns genres to an artist, inserting any new genres."""
-    artist_info = parse_artist_from_api(
-        call_get_artist_endpoint(spotify_id, access_token))
-
-    for genre in artist_info.get('genres', []):
-        if genre not in all_genres:
-            genre_id = insert_genre(genre)
-            all_genres[genre] = genre_id
-        else:
-            genre_id = all_genres[genre]
-
-        insert_artist_genre_assignment(artist_id, genre_id)
+        batch.add_artist(artist['spotify_id'], artist['name'],
+                         genres.get(artist['spotify_id']))
@@ -0,0 +1,26 @@
+"""Script to build BeautifulSoup trees for the scrapers, restricted to the
+elements they actually read and using the fastest parser available."""
+
+from functools import lru_cache
+from importlib.util import find_spec
+from os import environ as ENV
+
+import bs4
+
+FALLBACK_PARSER = "html.parser"
+
+
+@lru_cache(maxsize=1)
+def get_html_parser() -> str:
+    """Returns the parser backend to use: HTML_PARSER if set, otherwise lxml
+    when it is installed, otherwise the standard library parser."""
+    if ENV.get('HTML_PARSER'):
+        return ENV['HTML_PARSER']
+    return "lxml" if find_spec("lxml") else FALLBACK_PARSER
+
+
+def make_soup(source: str, strainer: bs4.SoupStrainer = None,
+              parser: str = None) -> bs4.BeautifulSoup:
+    """Returns a soup of a page's source. With a strainer, only the matching
+    elements (and their descendants) are built into the tree."""
+    return bs4.BeautifulSoup(source, parser or get_html_parser(), parse_only=strainer)
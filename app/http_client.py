@@ -0,0 +1,174 @@
+"""Script to handle every outbound HTTP request through one shared session, with
+per-host connection pooling, retries and rate-limit back-off."""
+
+from collections import defaultdict
+from contextlib import nullcontext
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from random import uniform
+from threading import BoundedSemaphore, Lock
+from time import monotonic, perf_counter, sleep
+from urllib.parse import urlsplit
+
+import requests as req
+from requests.adapters import HTTPAdapter
+
+from metrics import UPSTREAM_SECONDS, add_stats_source
+
+DEFAULT_TIMEOUT = 10
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 20
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = Lock()
+_stats_lock = Lock()
+_host_stats = defaultdict(lambda: {
+    'requests': 0,
+    'errors': 0,
+    'retries': 0,
+    'latency_seconds_total': 0.0,
+    'latency_seconds_max': 0.0,
+    'statuses': defaultdict(int)
+})
+_rate_limited_until = {}
+_host_limits = {}
+
+
+def get_session() -> req.Session:
+    """Returns the shared session, creating it on first use. Connections are
+    kept alive and pooled per host."""
+    global _session  # pylint: disable=global-statement
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = req.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS,
+                                      pool_maxsize=POOL_MAXSIZE, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def parse_retry_after(value: str) -> float:
+    """Returns the delay in seconds given by a Retry-After header, which may be
+    a number of seconds or an HTTP date. Returns None if it cannot be parsed."""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def get_backoff(attempt: int, response: req.Response = None) -> float:
+    """Returns how long to wait before a retry. Honours Retry-After when the
+    server sends one, otherwise uses full-jitter exponential back-off."""
+    if response is not None:
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if retry_after is not None:
+            return min(retry_after, BACKOFF_MAX)
+    return uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def wait_for_host(host: str):
+    """Blocks until any rate-limit window set for a host has passed."""
+    with _stats_lock:
+        delay = _rate_limited_until.get(host, 0) - monotonic()
+    if delay > 0:
+        sleep(delay)
+
+
+def set_host_rate_limit(host: str, delay: float):
+    """Makes every caller to a host wait for a rate-limit window to pass."""
+    with _stats_lock:
+        _rate_limited_until[host] = max(_rate_limited_until.get(host, 0),
+                                        monotonic() + delay)
+
+
+def set_host_concurrency(host: str, limit: int):
+    """Caps the number of requests in flight to a host at once."""
+    _host_limits[host] = BoundedSemaphore(limit)
+
+
+def record_call(host: str, elapsed: float, status: int = None, retried: bool = False):
+    """Records the latency and outcome of a single call to a host."""
+    UPSTREAM_SECONDS.observe(elapsed, host, str(status or 'connection_error'))
+    with _stats_lock:
+        stats = _host_stats[host]
+        stats['requests'] += 1
+        stats['latency_seconds_total'] += elapsed
+        stats['latency_seconds_max'] = max(stats['latency_seconds_max'], elapsed)
+        if status is None or status >= 400:
+            stats['errors'] += 1
+        stats['statuses'][status or 'connection_error'] += 1
+        if retried:
+            stats['retries'] += 1
+
+
+def request(method: str, url: str, **kwargs) -> req.Response:
+    """Makes an HTTP request through the shared session. Connection errors,
+    timeouts and retryable statuses are retried up to MAX_RETRIES times.
+    The final response is returned whatever its status."""
+    host = urlsplit(url).hostname
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    for attempt in range(MAX_RETRIES + 1):
+        final_attempt = attempt == MAX_RETRIES
+        wait_for_host(host)
+        start = perf_counter()
+        try:
+            with _host_limits.get(host) or nullcontext():
+                start = perf_counter()
+                response = get_session().request(method, url, **kwargs)
+        except (req.ConnectionError, req.Timeout):
+            record_call(host, perf_counter() - start, retried=not final_attempt)
+            if final_attempt:
+                raise
+            sleep(get_backoff(attempt))
+            continue
+
+        retry = response.status_code in RETRY_STATUSES and not final_attempt
+        record_call(host, perf_counter() - start, response.status_code, retried=retry)
+        if not retry:
+            return response
+        delay = get_backoff(attempt, response)
+        if response.status_code == 429:
+            set_host_rate_limit(host, delay)
+        else:
+            sleep(delay)
+    return response
+
+
+def get(url: str, **kwargs) -> req.Response:
+    """Makes a GET request through the shared session."""
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> req.Response:
+    """Makes a POST request through the shared session."""
+    return request("POST", url, **kwargs)
+
+
+def get_host_stats() -> dict:
+    """Returns the request, error, retry and latency counters for each host."""
+    with _stats_lock:
+        snapshot = {}
+        for host, stats in _host_stats.items():
+            snapshot[host] = {
+                **stats,
+                'statuses': dict(stats['statuses']),
+                'latency_seconds_avg': stats['latency_seconds_total'] / stats['requests']
+            }
+    return snapshot
+
+
+add_stats_source("vinylvault_http", get_host_stats, "host")
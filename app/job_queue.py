@@ -0,0 +1,192 @@
+"""Script to handle the background queue of album ingestion jobs. Jobs are
+stored in the ingest_job table and claimed with FOR UPDATE SKIP LOCKED, so
+any number of worker threads or processes can share the queue."""
+
+import logging
+from os import environ as ENV
+from threading import Event, Lock, Thread
+from time import monotonic
+
+from psycopg2.extras import execute_values
+
+from db_utils import get_connection, get_cursor
+from extract_spotify import add_album
+from authorisation.access_manager import get_valid_token
+
+DEFAULT_WORKERS = 2
+POLL_INTERVAL = 5
+STALE_JOB_MINUTES = 15
+REQUEUE_INTERVAL = 60
+
+logger = logging.getLogger(__name__)
+
+_wake_up = Event()
+_workers_started = Event()
+_workers_lock = Lock()
+
+
+def enqueue_ingest(spotify_album_id: str) -> int:
+    """Queues an album to be added to the collection, returning its job ID.
+    If the album is already queued or running, the existing job ID is returned."""
+    insert_stmt = """INSERT INTO ingest_job(spotify_album_id) VALUES (%s)
+    ON CONFLICT (spotify_album_id) WHERE status IN ('queued', 'running')
+    DO NOTHING RETURNING job_id;"""
+    select_stmt = """SELECT job_id FROM ingest_job
+    WHERE spotify_album_id = %s AND status IN ('queued', 'running');"""
+    job = None
+    with get_connection() as conn:
+        with get_cursor(conn) as cur:
+            # The in-flight job may finish between the two statements, so retry once.
+            for _ in range(2):
+                cur.execute(insert_stmt, (spotify_album_id,))
+                job = cur.fetchone()
+                if job is None:
+                    cur.execute(select_stmt, (spotify_album_id,))
+                    job = cur.fetchone()
+                if job is not None:
+                    break
+    ensure_workers_started()
+    _wake_up.set()
+    return job['job_id']
+
+
+def enqueue_ingests(spotify_album_ids: list[str]) -> dict:
+    """Queues many albums in one transaction, returning a dict of each album's
+    job ID. Albums already queued or running keep their existing job."""
+    if not spotify_album_ids:
+        return {}
+    insert_stmt = """INSERT INTO ingest_job(spotify_album_id) VALUES %s
+    ON CONFLICT (spotify_album_id) WHERE status IN ('queued', 'running')
+    DO NOTHING RETURNING job_id, spotify_album_id;"""
+    select_stmt = """SELECT job_id, spotify_album_id FROM ingest_job
+    WHERE spotify_album_id = ANY(%s) AND status IN ('queued', 'running');"""
+    with get_connection() as conn:
+        with get_cursor(conn) as cur:
+            inserted = execute_values(cur, insert_stmt, [(x,) for x in spotify_album_ids],
+                                      fetch=True)
+            jobs = {x['spotify_album_id']: x['job_id'] for x in inserted}
+            existing = [x for x in spotify_album_ids if x not in jobs]
+            if existing:
+                cur.execute(select_stmt, (existing,))
+                jobs.update({x['spotify_album_id']: x['job_id'] for x in cur.fetchall()})
+    ensure_workers_started()
+    _wake_up.set()
+    return jobs
+
+
+def get_job(job_id: int) -> dict:
+    """Returns the status of an ingestion job, or None if it does not exist."""
+    stmt = """SELECT job_id, spotify_album_id, status, attempts, album_id, error,
+    created_at, updated_at FROM ingest_job WHERE job_id = %s;"""
+    with get_connection() as conn:
+        with get_cursor(conn) as cur:
+            cur.execute(stmt, (job_id,))
+            job = cur.fetchone()
+    return dict(job) if job else None
+
+
+def claim_job() -> dict:
+    """Marks the oldest queued job as running and returns it, skipping any
+    row another worker has locked. Returns None if the queue is empty."""
+    stmt = """UPDATE ingest_job SET status = 'running',
+    attempts = attempts + 1, updated_at = NOW()
+    WHERE job_id = (
+        SELECT job_id FROM ingest_job WHERE status = 'queued'
+        ORDER BY created_at, job_id
+        FOR UPDATE SKIP LOCKED LIMIT 1)
+    RETURNING job_id, spotify_album_id;"""
+    with get_connection() as conn:
+        with get_cursor(conn) as cur:
+            cur.execute(stmt)
+            job = cur.fetchone()
+    return job
+
+
+def finish_job(job_id: int, album_id: int = None, error: str = None):
+    """Records the outcome of a job."""
+    stmt = """UPDATE ingest_job SET status = %s, album_id = %s,
+    error = %s, updated_at = NOW() WHERE job_id = %s;"""
+    with get_connection() as conn:
+        with get_cursor(conn) as cur:
+            cur.execute(stmt, ('failed' if error else 'done', album_id, error, job_id))
+
+
+def requeue_stale_jobs(minutes: int = STALE_JOB_MINUTES) -> int:
+    """Requeues jobs left running by a worker that died. Returns how many."""
+    stmt = """UPDATE ingest_job SET status = 'queued', updated_at = NOW()
+    WHERE status = 'running'
+    AND updated_at < NOW() - MAKE_INTERVAL(mins => %s);"""
+    with get_connection() as conn:
+        with get_cursor(conn) as cur:
+            cur.execute(stmt, (minutes,))
+            count = cur.rowcount
+    return count
+
+
+def run_job(job: dict):
+    """Adds the album for a claimed job and records the outcome."""
+    try:
+        album_id = add_album(job['spotify_album_id'], get_valid_token())
+    except Exception as err:  # pylint: disable=broad-exception-caught
+        logger.exception("Ingest job %s failed.", job['job_id'])
+        finish_job(job['job_id'], error=f"{type(err).__name__}: {err}")
+    else:
+        finish_job(job['job_id'], album_id=album_id)
+
+
+def work():
+    """Claims and runs jobs until the process exits, sleeping when idle.
+    Stale jobs are requeued every REQUEUE_INTERVAL seconds, so a job left
+    running by a dead worker doesn't block its album until a restart."""
+    requeued_at = monotonic()
+    while True:
+        if monotonic() - requeued_at >= REQUEUE_INTERVAL:
+            requeued_at = monotonic()
+            try:
+                requeue_stale_jobs()
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Failed to requeue stale ingest jobs.")
+        try:
+            job = claim_job()
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Failed to claim an ingest job.")
+            job = None
+        if job is None:
+            _wake_up.wait(POLL_INTERVAL)
+            _wake_up.clear()
+            continue
+        try:
+            run_job(job)
+        except Exception:  # pylint: disable=broad-exception-caught
+            # The job stays 'running' and is requeued once it goes stale.
+            logger.exception("Failed to record the outcome of ingest job %s.", job['job_id'])
+
+
+def start_workers(count: int) -> list[Thread]:
+    """Starts a pool of daemon worker threads."""
+    requeue_stale_jobs()
+    threads = [Thread(target=work, name=f"ingest-worker-{i}", daemon=True)
+               for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def ensure_workers_started():
+    """Starts the in-process worker pool once. Setting INGEST_WORKERS to 0
+    leaves the queue to separate worker processes."""
+    if _workers_started.is_set():
+        return
+    with _workers_lock:
+        if not _workers_started.is_set():
+            count = int(ENV.get('INGEST_WORKERS', DEFAULT_WORKERS))
+            if count:
+                start_workers(count)
+            _workers_started.set()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    workers = start_workers(int(ENV.get('INGEST_WORKERS', DEFAULT_WORKERS)))
+    for worker in workers:
+        worker.join()
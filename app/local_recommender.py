@@ -0,0 +1,193 @@
+"""Script to handle offline recommendations from the collection itself. Albums
+are held as rows of a sparse album x (genre + tag) matrix with TF-IDF weights,
+so similarity queries are a single sparse matrix product."""
+
+from threading import Lock
+from time import monotonic
+
+import numpy as np
+from scipy import sparse
+
+from db_utils import get_album_features, get_album_summaries, add_album_listener
+
+REFRESH_INTERVAL = 900
+COMPACT_RATIO = 0.25
+MIN_COMPACT_ROWS = 64
+
+
+class FeatureMatrix:
+    """A binary album x feature matrix, where the features are an album's
+    artist genres and its Last.fm tags. Rows are appended on insert and
+    blanked on delete (compacted once enough are blank), so the matrix is
+    never rebuilt per request. The TF-IDF weighted, row-normalised copy is
+    recomputed only after the collection changes. The whole matrix is
+    reloaded periodically to pick up changes such as new artist genres."""
+
+    def __init__(self, refresh_interval: float = REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._album_ids = []
+        self._rows = {}
+        self._columns = {}
+        self._features = []
+        self._counts = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self._weighted = None
+        self._idf = None
+        self._blank_rows = 0
+        self._pending = set()
+        self._loaded_at = None
+        self._lock = Lock()
+
+    def _ensure_loaded(self):
+        """Loads the matrix if it is empty or older than the refresh interval,
+        otherwise applies any pending album changes. Must hold the lock."""
+        if self._loaded_at is None or monotonic() - self._loaded_at >= self.refresh_interval:
+            self._album_ids, self._rows = [], {}
+            self._columns, self._features = {}, []
+            self._counts = sparse.csr_matrix((0, 0), dtype=np.float32)
+            self._blank_rows = 0
+            self._pending.clear()
+            self._append(get_album_features())
+            self._loaded_at = monotonic()
+        elif self._pending:
+            album_ids = list(self._pending)
+            self._pending.clear()
+            self._blank(album_ids)
+            self._append(get_album_features(album_ids))
+
+    def _append(self, rows: list[tuple]):
+        """Appends a row per album for a set of (album_id, kind, name) rows,
+        adding columns for any unseen features. Must hold the lock."""
+        row_ids, column_ids = [], []
+        for album_id, kind, name in rows:
+            if album_id not in self._rows:
+                self._rows[album_id] = len(self._album_ids)
+                self._album_ids.append(album_id)
+            feature = (kind, name)
+            if feature not in self._columns:
+                self._columns[feature] = len(self._features)
+                self._features.append(feature)
+            row_ids.append(self._rows[album_id])
+            column_ids.append(self._columns[feature])
+
+        shape = (len(self._album_ids), len(self._features))
+        start = self._counts.shape[0]
+        new_rows = sparse.csr_matrix(
+            (np.ones(len(row_ids), dtype=np.float32),
+             (np.array(row_ids, dtype=np.int64) - start, column_ids)),
+            shape=(shape[0] - start, shape[1]))
+        new_rows.data[:] = 1
+        counts = self._counts.copy()
+        counts.resize((start, shape[1]))
+        self._counts = sparse.vstack([counts, new_rows], format="csr")
+        self._weighted = None
+
+    def _blank(self, album_ids: list[int]):
+        """Blanks the rows of removed or changed albums, compacting the matrix
+        once enough rows are blank. Must hold the lock."""
+        rows = [self._rows.pop(x) for x in album_ids if x in self._rows]
+        if not rows:
+            return
+        for row in rows:
+            self._album_ids[row] = None
+        mask = np.ones(self._counts.shape[0], dtype=np.float32)
+        mask[rows] = 0
+        self._counts = (sparse.diags(mask) @ self._counts).tocsr()
+        self._counts.eliminate_zeros()
+        self._blank_rows += len(rows)
+        self._weighted = None
+
+        if self._blank_rows > max(MIN_COMPACT_ROWS, COMPACT_RATIO * len(self._album_ids)):
+            keep = [i for i, x in enumerate(self._album_ids) if x is not None]
+            self._counts = self._counts[keep]
+            self._album_ids = [self._album_ids[i] for i in keep]
+            self._rows = {album_id: i for i, album_id in enumerate(self._album_ids)}
+            self._blank_rows = 0
+
+    def _get_weighted(self) -> sparse.csr_matrix:
+        """Returns the TF-IDF weighted matrix with unit-length rows,
+        recomputing it if the counts have changed. Must hold the lock."""
+        if self._weighted is None:
+            albums = len(self._rows)
+            document_frequency = np.diff(self._counts.tocsc().indptr)
+            self._idf = (np.log((1 + albums) / (1 + document_frequency)) + 1).astype(np.float32)
+            weighted = self._counts @ sparse.diags(self._idf)
+            norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+            norms[norms == 0] = 1
+            self._weighted = (sparse.diags(1 / norms) @ weighted).tocsr()
+        return self._weighted
+
+    def similar(self, album_id: int, n: int) -> list[tuple]:
+        """Returns up to n (album_id, similarity) pairs for the albums most
+        similar to an album, most similar first."""
+        with self._lock:
+            self._ensure_loaded()
+            row = self._rows.get(album_id)
+            if row is None:
+                return []
+            weighted = self._get_weighted()
+            scores = (weighted @ weighted[row].T).toarray().ravel()
+            scores[row] = 0
+            return self._top(scores, n)
+
+    def gaps(self, n: int) -> list[dict]:
+        """Returns up to n features that are rare in the collection but sit on
+        albums close to its overall profile, along with those albums."""
+        with self._lock:
+            self._ensure_loaded()
+            if not self._rows:
+                return []
+            weighted = self._get_weighted()
+            profile = np.asarray(weighted.sum(axis=0)).ravel() / len(self._rows)
+            typicality = weighted @ profile
+            counts = self._counts.tocsc()
+            document_frequency = np.diff(counts.indptr)
+            affinity = (counts.T @ typicality) / np.maximum(document_frequency, 1)
+            scores = np.where(document_frequency > 0, affinity * self._idf, 0)
+
+            gaps = []
+            for column, score in self._top(scores, n, ids=False):
+                rows = counts.indices[counts.indptr[column]:counts.indptr[column + 1]]
+                kind, name = self._features[column]
+                gaps.append({
+                    'kind': kind,
+                    'name': name,
+                    'score': score,
+                    'album_ids': [self._album_ids[x] for x in rows]
+                })
+            return gaps
+
+    def _top(self, scores: np.ndarray, n: int, ids: bool = True) -> list[tuple]:
+        """Returns the n highest positive scores as (id, score) pairs, where
+        the ID is an album ID or, with ids=False, the array index."""
+        n = min(n, np.count_nonzero(scores > 0))
+        if n <= 0:
+            return []
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self._album_ids[x] if ids else int(x), round(float(scores[x]), 4))
+                for x in top]
+
+    def handle_change(self, event: str, albums: dict):  # pylint: disable=unused-argument
+        """Queues changed albums to be re-read on the next query."""
+        with self._lock:
+            if self._loaded_at is not None:
+                self._pending.update(albums)
+
+
+FEATURE_MATRIX = FeatureMatrix()
+add_album_listener(FEATURE_MATRIX.handle_change)
+
+
+def get_similar_albums(album_id: int, n: int = 10) -> list[dict]:
+    """Returns the n collection albums most like an album, with their similarity."""
+    scores = dict(FEATURE_MATRIX.similar(album_id, n))
+    albums = get_album_summaries(list(scores))
+    for album in albums:
+        album['similarity'] = scores[album['album_id']]
+    return albums
+
+
+def get_collection_gaps(n: int = 10) -> list[dict]:
+    """Returns the genres and tags the collection only touches lightly, but
+    which belong to albums typical of it, as directions to explore next."""
+    return FEATURE_MATRIX.gaps(n)
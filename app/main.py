@@ -1,94 +1,330 @@
-"""The main endpoints for the app's front-end."""
-from random import choice
+"""The main endpoints for the app's front-end. The app is built by create_app.
+Modules with heavy imports (Spotify and Last.fm scraping, the recommenders and
+Streamlit) are only imported by the routes that use them, or by the background
+workers on their own thread, and the Spotify token is only requested by routes
+that call Spotify, so startup stays fast."""
+# pylint: disable=import-outside-toplevel,wrong-import-position
+import logging
+from contextlib import contextmanager
+from importlib import import_module
+from io import TextIOWrapper
+from os import environ as ENV
+from threading import Thread
+from time import perf_counter
 
-from flask import Flask, request, render_template, redirect, url_for
-import streamlit as st
-from dotenv import load_dotenv
+STARTUP_TIMINGS = {}
 
-from extract_spotify import (search_album, parse_search_results, add_album)
 
-from db_utils import get_album_by_id, get_all_albums, delete_album_by_id
+@contextmanager
+def startup_phase(name: str):
+    """Records how long a phase of startup took, in milliseconds."""
+    start = perf_counter()
+    yield
+    STARTUP_TIMINGS[name] = round((perf_counter() - start) * 1000, 2)
 
-from authorisation.access_manager import get_valid_token
-from recommendation_handler import get_recommendations
 
-app = Flask(__name__)
-load_dotenv()
-ACCESS_TOKEN = get_valid_token()
+with startup_phase("import flask"):
+    from flask import Flask, request, redirect, url_for, make_response
+    from flask import render_template as flask_render_template
+    from dotenv import load_dotenv
 
+with startup_phase("import metrics"):
+    from metrics import RENDER_SECONDS, timed, render_metrics, instrument_app
 
-@app.route("/", methods=["GET"])
+with startup_phase("import db_utils"):
+    from db_utils import (get_album_detail, get_album_page, search_collection,
+                          delete_album_by_id, SORT_ORDERS, PAGE_SIZE, SEARCH_PAGE_SIZE)
+
+with startup_phase("import collection_index"):
+    from collection_index import get_random_album_id, is_owned, mark_owned
+
+OWNED_SEARCH_RESULTS = 8
+ROUTES = []
+BACKGROUND_WORKERS = [("job_queue", "ensure_workers_started"),
+                      ("tag_enrichment", "start_enrichment_worker"),
+                      ("price_tracker", "start_price_worker")]
+
+logger = logging.getLogger(__name__)
+
+
+def render_template(template_name: str, **context) -> str:
+    """Renders a template, recording how long it took."""
+    with timed(RENDER_SECONDS, template_name):
+        return flask_render_template(template_name, **context)
+
+
+def route(rule: str, methods: list[str]):
+    """Registers a view to be added to the app by create_app."""
+    def register(view):
+        ROUTES.append((rule, methods, view))
+        return view
+    return register
+
+
+@route("/", methods=["GET"])
 def index():
     """Homepage for the app."""
     return render_template("index.html"), 200
 
 
-@app.route("/display_search", methods=["POST"])
+@route("/display_search", methods=["POST"])
 def display_search():
-    """Displays search results of a particular query (made through a POST request)."""
+    """Displays search results of a particular query (made through a POST request).
+    Matching albums already in the collection are found locally and shown first."""
     query = request.form.get("search_query").title()
-    results = search_album(query, ACCESS_TOKEN)
-    parsed_results = parse_search_results(results)
-    return render_template("display_search.html", albums=parsed_results, query=query)
+    from extract_spotify import search_albums_cached
+    from authorisation.access_manager import get_valid_token
+    owned, _ = search_collection(query, OWNED_SEARCH_RESULTS)
+    parsed_results = search_albums_cached(query, get_valid_token())
+    return render_template("display_search.html", albums=mark_owned(parsed_results),
+                           owned=owned, query=query)
 
 
-@app.route("/add/<string:spotify_album_id>", methods=["POST"])
+@route("/add/<string:spotify_album_id>", methods=["POST"])
 def add(spotify_album_id: str):
-    """Adds an album of a specific Spotify ID to the user's collection."""
-    add_album(spotify_album_id, ACCESS_TOKEN)
-    return {"message": "Adding album to collection..."}, 200
+    """Queues an album of a specific Spotify ID to be added to the user's
+    collection, returning the job ID to poll. Albums already in the
+    collection are not queued."""
+    if is_owned(spotify_album_id):
+        return {"message": "Album is already in your collection.", "owned": True}, 200
+    from job_queue import enqueue_ingest
+    job_id = enqueue_ingest(spotify_album_id)
+    return {"message": "Adding album to collection...", "job_id": job_id,
+            "status_url": url_for('job_status', job_id=job_id)}, 202
+
+
+@route("/jobs/<int:job_id>", methods=["GET"])
+def job_status(job_id: int):
+    """Returns the status of an album ingestion job."""
+    from job_queue import get_job
+    job = get_job(job_id)
+    if job is None:
+        return {"error": "Job not found."}, 404
+    return job, 200
 
 
-@app.route("/delete_album", methods=["DELETE"])
+@route("/import", methods=["POST"])
+def bulk_import():
+    """Queues every album listed in an uploaded .txt, .csv or .jsonl file to be
+    added by the background workers, returning each album's job ID to poll."""
+    from bulk_import import queue_import, get_file_format
+    upload = request.files.get("file")
+    if upload is None:
+        return {"error": "No file uploaded."}, 400
+    file_format = request.form.get("format") or get_file_format(upload.filename or "")
+    lines = TextIOWrapper(upload.stream, encoding="utf-8", newline="")
+    return queue_import(lines, file_format), 202
+
+
+def get_collection_args() -> dict:
+    """Returns the sort order and filters for a collection page from the query string."""
+    decade = request.args.get("decade", type=int)
+    return {
+        'sort': request.args.get("sort", "artist"),
+        'artist': request.args.get("artist") or None,
+        'decade': decade - decade % 10 if decade is not None else None,
+        'genre': request.args.get("genre") or None,
+        'tag': request.args.get("tag") or None
+    }
+
+
+def render_collection(status: int = 200):
+    """Renders the first page of the collection for the requested sort and filters."""
+    args = get_collection_args()
+    if args['sort'] not in SORT_ORDERS:
+        args['sort'] = "artist"
+    albums, next_cursor = get_album_page(**args)
+    return render_template("collection.html", albums=albums, next_cursor=next_cursor,
+                           sort_orders=list(SORT_ORDERS), filters=args), status
+
+
+@route("/delete_album", methods=["DELETE"])
 def delete_album():
     """Deletes an album from the collection by its ID."""
     album_id = request.get_json()['album_id']
     delete_album_by_id(album_id)
-    albums = get_all_albums()
-    return render_template("collection.html", albums=albums), 200
+    return render_collection()
 
 
-@app.route("/collection", methods=["GET"])
+@route("/collection", methods=["GET"])
 def collection():
-    """Displays the user's entire collection within their database."""
-    albums = get_all_albums()
-    return render_template("collection.html", albums=albums), 200
+    """Displays the first page of the user's collection. Further pages are
+    loaded from /collection/page as the user scrolls."""
+    return render_collection()
 
 
-@app.route("/random_choice", methods=["GET"])
+@route("/collection/page", methods=["GET"])
+def collection_page():
+    """Returns a page of the collection as JSON, continuing from a cursor."""
+    try:
+        albums, next_cursor = get_album_page(
+            page_cursor=request.args.get("cursor"),
+            limit=request.args.get("limit", PAGE_SIZE, type=int),
+            **get_collection_args())
+    except ValueError as err:
+        return {"error": str(err)}, 400
+    return {"albums": albums, "next_cursor": next_cursor}, 200
+
+
+@route("/collection/search", methods=["GET"])
+def collection_search():
+    """Returns a ranked page of the collection's albums matching a query,
+    as JSON, continuing from an offset."""
+    albums, next_offset = search_collection(
+        request.args.get("q", ""),
+        limit=request.args.get("limit", SEARCH_PAGE_SIZE, type=int),
+        offset=request.args.get("offset", 0, type=int))
+    return {"albums": albums, "next_offset": next_offset}, 200
+
+
+@route("/random_choice", methods=["GET"])
 def random_choice():
-    """Redirects the user to a random record in their collection."""
-    albums = get_all_albums()
-    if albums:
-        random_album = choice(albums)
-        random_album_id = random_album['album_id']
+    """Redirects the user to a random record in their collection, optionally
+    restricted by the same artist, decade, genre and tag filters as /collection."""
+    filters = get_collection_args()
+    del filters['sort']
+    random_album_id = get_random_album_id(**filters)
+    if random_album_id is not None:
         return redirect(url_for('display_album', album_id=random_album_id))
     return redirect(url_for('collection'))
 
 
-@app.route("/collection/<int:album_id>", methods=["GET"])
+@route("/collection/<int:album_id>", methods=["GET"])
 def display_album(album_id: int):
-    """Displays an album of a particular ID within the user's collection."""
-    # Get album by ID.
-    album_info = get_album_by_id(album_id)
-    return render_template("view_album.html", album=album_info), 200
+    """Displays an album of a particular ID within the user's collection.
+    Browsers revalidate with ETag/Last-Modified and get a 304 if unchanged."""
+    detail = get_album_detail(album_id)
+    if detail is None:
+        return redirect(url_for('collection'))
+
+    last_modified = detail['last_modified'].replace(microsecond=0)
+    not_modified = (detail['etag'] in request.if_none_match
+                    or (not request.if_none_match and request.if_modified_since
+                        and last_modified <= request.if_modified_since))
+    if not_modified:
+        response = make_response("", 304)
+    else:
+        response = make_response(
+            render_template("view_album.html", album=detail['album']), 200)
+    response.set_etag(detail['etag'])
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
 
 
-@app.route("/recommend", methods=["GET"])
+@route("/recommend", methods=["GET"])
 def recommend():
     """Gets recommendations and displays the page."""
-    recs = get_recommendations(ACCESS_TOKEN)
+    from recommendation_handler import get_recommendations
+    from authorisation.access_manager import get_valid_token
+    recs = get_recommendations(get_valid_token)
     return render_template("recommendations.html", albums=recs)
 
 
-@app.route("/analytics", methods=["GET"])
+@route("/collection/<int:album_id>/similar", methods=["GET"])
+def similar_albums(album_id: int):
+    """Returns the albums in the collection most like an album, as JSON."""
+    from local_recommender import get_similar_albums
+    n = max(1, min(request.args.get("n", 10, type=int), 50))
+    return {"albums": get_similar_albums(album_id, n)}, 200
+
+
+@route("/collection/<int:album_id>/prices", methods=["GET"])
+def album_prices(album_id: int):
+    """Returns an album's cheapest Discogs listing and recent price trend, as JSON."""
+    from price_tracker import get_album_prices
+    days = max(1, min(request.args.get("days", 90, type=int), 365))
+    return get_album_prices(album_id, days), 200
+
+
+@route("/recommend/gaps", methods=["GET"])
+def collection_gaps():
+    """Returns the genres and tags the collection is light on, as JSON."""
+    from local_recommender import get_collection_gaps
+    n = max(1, min(request.args.get("n", 10, type=int), 50))
+    return {"gaps": get_collection_gaps(n)}, 200
+
+
+@route("/analytics", methods=["GET"])
 def analytics():
     """Defines the Streamlit analytics dashboard for the user's collection."""
+    import streamlit as st
     st.set_page_config(page_title="VinylVault - Collection Analytics")
     return {"Message": "Hello, world"}, 200
 
 
+@route("/metrics", methods=["GET"])
+def metrics():
+    """Returns the latency histograms in the Prometheus text format."""
+    return render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+@route("/startup", methods=["GET"])
+def startup_report():
+    """Returns how long each import and init phase of startup took."""
+    return get_startup_report(), 200
+
+
+def get_startup_report() -> dict:
+    """Returns the startup phase timings and their total, in milliseconds."""
+    return {'phases': dict(STARTUP_TIMINGS),
+            'total_ms': round(sum(STARTUP_TIMINGS.values()), 2)}
+
+
+def start_background_workers():
+    """Starts the ingest worker pool (unless INGEST_WORKERS is 0), the tag
+    enrichment worker (unless TAG_ENRICHMENT_WORKER is 0) and the price
+    refresher (unless PRICE_REFRESH_WORKER is 0) on a background thread, so
+    queued jobs resume and albums added by any route get tagged without waiting
+    for the first /add. Failures are logged; the ingest pool is retried when
+    the next job is queued."""
+    def start():
+        for module_name, starter in BACKGROUND_WORKERS:
+            try:
+                getattr(import_module(module_name), starter)()
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Failed to start the %s worker.", module_name)
+
+    Thread(target=start, name="start-workers", daemon=True).start()
+
+
+def create_app(start_workers: bool = True) -> Flask:
+    """Builds the app, registers its routes and starts the background workers.
+    Nothing here blocks on the database or Spotify; connections and the token
+    are acquired on first use."""
+    with startup_phase("load dotenv"):
+        load_dotenv()
+    with startup_phase("create app"):
+        flask_app = Flask(__name__)
+    with startup_phase("register routes"):
+        for rule, methods, view in ROUTES:
+            flask_app.add_url_rule(rule, view_func=view, methods=methods)
+        instrument_app(flask_app)
+    if start_workers:
+        with startup_phase("start workers"):
+            start_background_workers()
+    logger.info("Started in %s ms: %s", get_startup_report()['total_ms'], STARTUP_TIMINGS)
+    return flask_app
+
+
+_app = None
+
+
+def __getattr__(name: str):
+    """Builds the module-level app on first access, so 'main:app' keeps working
+    without importing this module creating an app."""
+    global _app  # pylint: disable=global-statement
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == "__main__":
+    # The debug reloader's parent process only watches for changes; the workers
+    # are started by the child that serves requests.
+    app = create_app(start_workers=ENV.get("WERKZEUG_RUN_MAIN") == "true")
     app.config["DEBUG"] = True
     app.config["TESTING"] = True
     app.run(port=8080, debug=True)
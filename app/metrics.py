@@ -0,0 +1,210 @@
+"""Script to record latency histograms for the app's hot paths (routes, database
+queries, upstream calls and template renders), expose them in the Prometheus
+text format alongside the stats of the pool, caches, HTTP client and tag
+enrichment, and profile individual requests on demand."""
+
+import cProfile
+import logging
+import re
+import sys
+from bisect import bisect_left
+from contextlib import contextmanager
+from os import environ as ENV
+from pathlib import Path
+from threading import Lock
+from time import perf_counter, time_ns
+from typing import Callable
+
+from psycopg2.extensions import cursor
+from psycopg2.extras import RealDictCursor
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROFILE_DIR = Path(ENV.get('PROFILE_DIR', "profiles"))
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    """A Prometheus-style latency histogram, with one set of cumulative
+    bucket counts, a sum and a count for each combination of label values."""
+
+    def __init__(self, name: str, description: str, label_names: tuple,
+                 buckets: tuple = BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = Lock()
+
+    def observe(self, seconds: float, *label_values):
+        """Records a single observation for a set of label values."""
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        """Returns the histogram's lines in the Prometheus text format."""
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._series.items())
+        for label_values, (bucket_counts, total, count) in series:
+            labels = ",".join(f'{name}="{escape(value)}"'
+                              for name, value in zip(self.label_names, label_values))
+            prefix = f"{labels}," if labels else ""
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+def escape(value) -> str:
+    """Escapes a label value for the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+REQUEST_SECONDS = Histogram(
+    "vinylvault_request_seconds", "Time spent handling requests, by route.",
+    ("method", "route", "status"))
+QUERY_SECONDS = Histogram(
+    "vinylvault_query_seconds", "Time spent executing database queries, by calling function.",
+    ("query",))
+UPSTREAM_SECONDS = Histogram(
+    "vinylvault_upstream_seconds", "Time spent on outbound calls, by host.",
+    ("host", "status"))
+RENDER_SECONDS = Histogram(
+    "vinylvault_render_seconds", "Time spent rendering templates, by template.",
+    ("template",))
+HISTOGRAMS = [REQUEST_SECONDS, QUERY_SECONDS, UPSTREAM_SECONDS, RENDER_SECONDS]
+
+
+@contextmanager
+def timed(histogram: Histogram, *label_values):
+    """Records how long the enclosed block took in a histogram."""
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(perf_counter() - start, *label_values)
+
+
+def get_query_name() -> str:
+    """Returns the name of the function that issued the current query,
+    skipping over psycopg2 helpers such as execute_values."""
+    frame = sys._getframe(2)  # pylint: disable=protected-access
+    while frame is not None and frame.f_globals.get('__name__', '').startswith(
+            ('psycopg2', __name__)):
+        frame = frame.f_back
+    return frame.f_code.co_name if frame is not None else "unknown"
+
+
+class TimedCursorMixin:  # pylint: disable=too-few-public-methods
+    """Times every statement a cursor executes, labelled by the calling function."""
+
+    def execute(self, query, variables=None):
+        """Executes a statement, recording its latency."""
+        with timed(QUERY_SECONDS, get_query_name()):
+            return super().execute(query, variables)
+
+
+class TimedCursor(TimedCursorMixin, cursor):
+    """A tuple cursor that records query latencies."""
+
+
+class TimedDictCursor(TimedCursorMixin, RealDictCursor):
+    """A RealDictCursor that records query latencies."""
+
+
+_stats_sources = []
+
+
+def add_stats_source(name: str, get_stats: Callable[[], dict], label: str = None):
+    """Registers a stats accessor to be exported as gauges named after its keys.
+    With a label, get_stats returns a dict of label values to stats dicts
+    (e.g. one per cache). Only numeric values are exported."""
+    _stats_sources.append((name, get_stats, label))
+
+
+def render_stats(name: str, get_stats: Callable[[], dict], label: str = None) -> list[str]:
+    """Returns a stats accessor's values as gauges in the Prometheus text format."""
+    stats = get_stats()
+    series = {}
+    for label_value, entry in (stats.items() if label else [(None, stats)]):
+        labels = f'{{{label}="{escape(label_value)}"}}' if label else ""
+        for key, value in entry.items():
+            if isinstance(value, (int, float)):
+                series.setdefault(key, []).append(f"{name}_{key}{labels} {value}")
+
+    lines = []
+    for key, values in series.items():
+        lines.append(f"# TYPE {name}_{key} gauge")
+        lines.extend(values)
+    return lines
+
+
+def render_metrics() -> str:
+    """Returns every histogram and registered stats source in the Prometheus
+    text exposition format."""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    for source in _stats_sources:
+        try:
+            lines.extend(render_stats(*source))
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Failed to collect %s stats.", source[0])
+    return "\n".join(lines) + "\n"
+
+
+def is_profiling_enabled() -> bool:
+    """Returns true if per-request profiling has been switched on."""
+    return ENV.get('PROFILING_ENABLED', "").lower() in ("1", "true", "yes")
+
+
+def save_profile(profile: cProfile.Profile, name: str) -> Path:
+    """Writes a request's profile as a pstats file (viewable as a flame graph
+    with tools such as snakeviz or flameprof) and returns its path."""
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    safe_name = re.sub(r"[^\w.-]+", "_", name).strip("_") or "root"
+    path = PROFILE_DIR / f"{safe_name}-{time_ns()}.prof"
+    profile.dump_stats(path)
+    return path
+
+
+def instrument_app(flask_app):
+    """Times every request to a Flask app by route, and profiles a request
+    when it is made with ?profile=1 and PROFILING_ENABLED is set."""
+    from flask import g, request  # pylint: disable=import-outside-toplevel
+
+    @flask_app.before_request
+    def start_timer():
+        g.request_started = perf_counter()
+        if is_profiling_enabled() and request.args.get("profile") == "1":
+            g.profile = cProfile.Profile()
+            g.profile.enable()
+
+    @flask_app.after_request
+    def record_request(response):
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profile.disable()
+            path = save_profile(profile, request.path)
+            response.headers["X-Profile-Path"] = str(path)
+        started = g.pop('request_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            REQUEST_SECONDS.observe(perf_counter() - started, request.method, route,
+                                    str(response.status_code))
+        return response
+
+    return flask_app
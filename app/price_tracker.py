@@ -0,0 +1,268 @@
+"""Script to track Discogs marketplace prices for albums in the collection.
+Listings and price snapshots are stored so the cheapest current listing and
+price trends can be queried, and each refresh only rescrapes stale albums."""
+
+import json
+import logging
+import re
+from argparse import ArgumentParser
+from decimal import Decimal, InvalidOperation
+from os import environ as ENV
+from threading import Lock, Thread
+from time import sleep
+
+from psycopg2.extras import execute_values
+
+from db_utils import get_connection, get_cursor
+from extract_discogs import (format_search_url, load_page_sources, get_soop,
+                             scrape_listings, parse_listing, PRICE_PATTERN)
+
+STALE_AFTER_HOURS = 24
+REFRESH_BATCH_SIZE = 20
+REFRESH_INTERVAL = 3600
+PRICE_CURRENCY = ENV.get('PRICE_CURRENCY', "GBP")
+CURRENCY_SYMBOLS = {
+    "£": "GBP", "€": "EUR", "$": "USD", "US$": "USD", "CA$": "CAD", "A$": "AUD",
+    "NZ$": "NZD", "MX$": "MXN", "R$": "BRL", "HK$": "HKD", "¥": "JPY", "JP¥": "JPY",
+    "CN¥": "CNY", "₹": "INR"
+}
+RATING_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+
+logger = logging.getLogger(__name__)
+
+_worker_lock = Lock()
+_worker = None
+
+
+def parse_amount(amount: str) -> Decimal:
+    """Converts an amount written with either decimal mark ('1,234.56' or
+    '1.234,56') into a number. A final separator followed by one or two
+    digits is the decimal mark; any other separator groups thousands."""
+    separator = max(amount.rfind("."), amount.rfind(","))
+    if separator == -1 or len(amount) - separator - 1 > 2:
+        return Decimal(amount.replace(",", "").replace(".", ""))
+    whole = amount[:separator].replace(",", "").replace(".", "")
+    return Decimal(f"{whole}.{amount[separator + 1:]}")
+
+
+def parse_prices(price_strings: list[str]) -> list[tuple]:
+    """Converts a batch of price labels (e.g. '£12.50', 'about CA$1,020.00 total',
+    '€1.234,56', '1.234,56 €') into (amount, ISO currency code) pairs, with
+    (None, None) for any label that holds no recognisable price."""
+    parsed = []
+    search = PRICE_PATTERN.search
+    for price_string in price_strings:
+        match = search(price_string or "")
+        if match is None:
+            parsed.append((None, None))
+            continue
+        symbol_first, amount_after, amount_first, symbol_after = match.groups()
+        symbol, amount = symbol_first or symbol_after, amount_after or amount_first
+        try:
+            parsed.append((parse_amount(amount), CURRENCY_SYMBOLS.get(symbol)))
+        except InvalidOperation:
+            parsed.append((None, None))
+    return parsed
+
+
+def parse_rating(rating: str) -> Decimal:
+    """Converts a seller rating label such as '99.6%' into a number."""
+    match = RATING_PATTERN.search(rating or "")
+    return Decimal(match.group(0)) if match else None
+
+
+def get_stale_albums(limit: int, max_age_hours: int = STALE_AFTER_HOURS,
+                     exclude_ids: list[int] = None) -> list[dict]:
+    """Returns albums whose prices have never been checked or were last checked
+    more than max_age_hours ago, least recently checked first, leaving out
+    any excluded album IDs."""
+    stmt = """SELECT a.album_id, a.album_name, ar.artist_name
+    FROM album AS a JOIN artist AS ar USING (artist_id)
+    WHERE (a.prices_checked_at IS NULL
+    OR a.prices_checked_at < NOW() - MAKE_INTERVAL(hours => %s))
+    AND a.album_id <> ALL(%s)
+    ORDER BY a.prices_checked_at NULLS FIRST, a.album_id
+    LIMIT %s;"""
+    with get_connection() as conn:
+        with get_cursor(conn) as cur:
+            cur.execute(stmt, (max_age_hours, list(exclude_ids or []), limit))
+            res = cur.fetchall()
+    return [dict(x) for x in res]
+
+
+def parse_page_listings(page_source: str) -> list[dict]:
+    """Returns every listing that can be parsed from a marketplace page."""
+    listings = []
+    for listing in scrape_listings(get_soop(page_source)):
+        try:
+            listings.append(parse_listing(listing))
+        except (AttributeError, IndexError, KeyError, TypeError):
+            logger.debug("Skipping a listing that could not be parsed.")
+    return listings
+
+
+def scrape_album_listings(albums: list[dict]) -> tuple[dict, list[int]]:
+    """Scrapes the marketplace listings for a batch of albums concurrently.
+    Returns a dict of album IDs to listings and a list of failed album IDs."""
+    urls = {format_search_url(x['artist_name'], x['album_name']): x['album_id'] for x in albums}
+    album_listings, failed = {}, []
+    for url, page_source in load_page_sources(list(urls)).items():
+        if isinstance(page_source, Exception):
+            logger.warning("Failed to load %s: %s", url, page_source)
+            failed.append(urls[url])
+        else:
+            album_listings[urls[url]] = parse_page_listings(page_source)
+    return album_listings, failed
+
+
+def save_listings(album_listings: dict) -> int:
+    """Upserts listings and bulk-inserts a price snapshot for each one in a
+    single transaction, then marks the albums as checked. A listing found by
+    another album's search moves to that album, so it and its snapshots agree.
+    Returns the number of snapshots written."""
+    # A listing can turn up in more than one search, but may only be upserted once per statement.
+    rows = list({x['url']: (album_id, x) for album_id, listings in album_listings.items()
+                 for x in listings}.values())
+    prices = parse_prices([x['original_price'] for _, x in rows])
+    converted = parse_prices([x['converted_price'] for _, x in rows])
+
+    snapshots = []
+    with get_connection() as conn:
+        with get_cursor(conn) as cur:
+            if rows:
+                listing_ids = execute_values(
+                    cur, """INSERT INTO discogs_listing(album_id, listing_url, description,
+                    media_condition, sleeve_condition, seller_rating) VALUES %s
+                    ON CONFLICT (listing_url) DO UPDATE SET last_seen_at = NOW(),
+                    album_id = EXCLUDED.album_id,
+                    media_condition = EXCLUDED.media_condition,
+                    sleeve_condition = EXCLUDED.sleeve_condition,
+                    seller_rating = EXCLUDED.seller_rating
+                    RETURNING listing_id, listing_url;""",
+                    [(album_id, x['url'], x['description'], x['media_condition'],
+                      x['sleeve_condition'], parse_rating(x['seller_rating']))
+                     for album_id, x in rows], fetch=True)
+                listing_ids = {x['listing_url']: x['listing_id'] for x in listing_ids}
+                snapshots = [(listing_ids[x['url']], album_id, *price, *converted_price)
+                             for (album_id, x), price, converted_price
+                             in zip(rows, prices, converted)]
+                execute_values(
+                    cur, """INSERT INTO price_snapshot(listing_id, album_id, price,
+                    currency, converted_price, converted_currency) VALUES %s;""", snapshots)
+            cur.execute("""UPDATE album SET prices_checked_at = NOW()
+            WHERE album_id = ANY(%s);""", (list(album_listings),))
+    return len(snapshots)
+
+
+def refresh_prices(batch_size: int = REFRESH_BATCH_SIZE, max_batches: int = None,
+                   max_age_hours: int = STALE_AFTER_HOURS) -> dict:
+    """Rescrapes the listings of stale albums, least recently checked first,
+    until none are stale or max_batches have run. Albums that fail to load
+    keep their last check, so their listings are still served, and are
+    skipped for the rest of this refresh. Returns counts for the refresh."""
+    stats = {'albums_checked': 0, 'albums_failed': 0, 'snapshots': 0}
+    batches = 0
+    failed_ids = []
+    while max_batches is None or batches < max_batches:
+        albums = get_stale_albums(batch_size, max_age_hours, failed_ids)
+        if not albums:
+            break
+        album_listings, failed = scrape_album_listings(albums)
+        stats['snapshots'] += save_listings(album_listings)
+        stats['albums_checked'] += len(album_listings)
+        stats['albums_failed'] += len(failed)
+        failed_ids.extend(failed)
+        batches += 1
+    return stats
+
+
+def get_cheapest_listing(album_id: int, currency: str = PRICE_CURRENCY) -> dict:
+    """Returns the cheapest listing seen in an album's most recent price check,
+    with its latest price, or None if it has no current listings. Listings are
+    compared on their price converted into the given currency."""
+    stmt = """SELECT l.listing_id, l.listing_url, l.description, l.media_condition,
+    l.sleeve_condition, l.seller_rating, s.price, s.currency,
+    s.converted_price, s.converted_currency, s.captured_at
+    FROM discogs_listing AS l JOIN album AS a USING (album_id)
+    CROSS JOIN LATERAL (
+        SELECT price, currency, converted_price, converted_currency, captured_at
+        FROM price_snapshot WHERE listing_id = l.listing_id
+        ORDER BY captured_at DESC LIMIT 1) AS s
+    WHERE l.album_id = %s AND l.last_seen_at >= a.prices_checked_at
+    AND s.converted_currency = %s AND s.converted_price IS NOT NULL
+    ORDER BY s.converted_price ASC
+    LIMIT 1;"""
+    with get_connection() as conn:
+        with get_cursor(conn) as cur:
+            cur.execute(stmt, (album_id, currency))
+            res = cur.fetchone()
+    return dict(res) if res else None
+
+
+def get_price_trend(album_id: int, days: int = 90,
+                    currency: str = PRICE_CURRENCY) -> list[dict]:
+    """Returns the daily minimum and average price of an album's listings,
+    converted into the given currency, over the last number of days."""
+    stmt = """SELECT DATE_TRUNC('day', captured_at)::DATE AS day,
+    MIN(converted_price) AS min_price, ROUND(AVG(converted_price), 2) AS avg_price,
+    COUNT(*) AS listings
+    FROM price_snapshot
+    WHERE album_id = %s AND captured_at >= NOW() - MAKE_INTERVAL(days => %s)
+    AND converted_currency = %s AND converted_price IS NOT NULL
+    GROUP BY day ORDER BY day;"""
+    with get_connection() as conn:
+        with get_cursor(conn) as cur:
+            cur.execute(stmt, (album_id, days, currency))
+            res = cur.fetchall()
+    return [dict(x) for x in res]
+
+
+def get_album_prices(album_id: int, days: int = 90) -> dict:
+    """Returns an album's cheapest current listing and price trend, ready to
+    be served as JSON."""
+    cheapest = get_cheapest_listing(album_id)
+    if cheapest is not None:
+        cheapest = {k: float(v) if isinstance(v, Decimal) else v for k, v in cheapest.items()}
+        cheapest['captured_at'] = cheapest['captured_at'].isoformat()
+    trend = [{'day': x['day'].isoformat(), 'min_price': float(x['min_price']),
+              'avg_price': float(x['avg_price']), 'listings': x['listings']}
+             for x in get_price_trend(album_id, days)]
+    return {'currency': PRICE_CURRENCY, 'cheapest': cheapest, 'trend': trend}
+
+
+def run_price_worker(interval: float = REFRESH_INTERVAL):
+    """Refreshes stale prices forever, waiting an interval between refreshes."""
+    while True:
+        try:
+            stats = refresh_prices(max_age_hours=int(
+                ENV.get('PRICE_STALE_AFTER_HOURS', STALE_AFTER_HOURS)))
+            logger.info("Price refresh finished: %s", stats)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Price refresh failed.")
+        sleep(interval)
+
+
+def start_price_worker() -> Thread:
+    """Starts the background price refresher once per process. Setting
+    PRICE_REFRESH_WORKER to 0 turns it off, e.g. when the refresh is run
+    from cron instead. Returns the worker, or None if it is turned off."""
+    global _worker  # pylint: disable=global-statement
+    if ENV.get('PRICE_REFRESH_WORKER', "1") == "0":
+        return None
+    with _worker_lock:
+        if _worker is None:
+            _worker = Thread(target=run_price_worker, name="price-refresh", daemon=True,
+                             args=(float(ENV.get('PRICE_REFRESH_INTERVAL', REFRESH_INTERVAL)),))
+            _worker.start()
+    return _worker
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = ArgumentParser(description="Refresh Discogs prices for stale albums.")
+    parser.add_argument("--batch-size", type=int, default=REFRESH_BATCH_SIZE)
+    parser.add_argument("--max-batches", type=int)
+    parser.add_argument("--max-age-hours", type=int,
+                        default=int(ENV.get('PRICE_STALE_AFTER_HOURS', STALE_AFTER_HOURS)))
+    args = parser.parse_args()
+    print(json.dumps(refresh_prices(args.batch_size, args.max_batches, args.max_age_hours)))
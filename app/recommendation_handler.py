@@ -1,33 +1,90 @@
 """Script to handle record recommendations."""
 
-import requests as req
+import logging
+from collections import deque
+from os import environ as ENV
+from threading import Lock, Thread
+from typing import Callable
 
+from psycopg2 import Error as DatabaseError
+from requests import RequestException
+
+import http_client
+from cache import make_cache
 from endpoints import RECOMMENDATIONS_ENDPOINT
 from db_utils import get_connection, get_cursor
+from collection_index import get_owned_album_ids
 
+PREFETCH_DEPTH = 2
+RECOMMENDATION_CACHE = make_cache(
+    "recommendations", max_size=int(ENV.get('RECOMMENDATION_CACHE_SIZE', 128)),
+    ttl=int(ENV.get('RECOMMENDATION_CACHE_TTL', 3600)))
 
-def pull_artist_seeds(n: int = 3) -> list[str]:
-    """Pulls n random artists from the user's collection
-    to seed album recommendations."""
-    stmt = """SELECT spotify_artist_id
-    FROM artist ORDER BY RANDOM();"""
+logger = logging.getLogger(__name__)
+
+_prefetched = deque()
+_prefetch_lock = Lock()
+_prefetch_worker = None
+
+
+SEED_OVERSAMPLING = 3
+
+# Each probe jumps to a random point in a table's primary key range and takes
+# the next row from the index, so a draw costs one index lookup however large
+# the table is. IDs following a gap in the key range are slightly favoured.
+PROBES_CTE = """WITH bounds AS (SELECT MIN({key}) AS lo, MAX({key}) AS hi FROM {table}),
+probe AS (SELECT lo + FLOOR(RANDOM() * (hi - lo + 1))::INT AS target
+    FROM bounds, GENERATE_SERIES(1, %s))"""
+
+ARTIST_SEED_STMT = PROBES_CTE.format(table="artist", key="artist_id") + """
+SELECT ar.spotify_artist_id AS seed FROM probe CROSS JOIN LATERAL (
+    SELECT spotify_artist_id FROM artist WHERE artist_id >= probe.target
+    ORDER BY artist_id LIMIT 1) AS ar;"""
+
+GENRE_SEED_STMT = PROBES_CTE.format(table="genre", key="genre_id") + """
+SELECT g.genre_name AS seed FROM probe CROSS JOIN LATERAL (
+    SELECT genre_name FROM genre WHERE genre_id >= probe.target
+    ORDER BY genre_id LIMIT 1) AS g;"""
+
+# Weighted seeds are drawn through random albums, so an artist or genre is
+# picked in proportion to the number of albums the user owns from it.
+WEIGHTED_ARTIST_SEED_STMT = PROBES_CTE.format(table="album", key="album_id") + """
+SELECT ar.spotify_artist_id AS seed FROM probe CROSS JOIN LATERAL (
+    SELECT artist_id FROM album WHERE album_id >= probe.target
+    ORDER BY album_id LIMIT 1) AS a
+JOIN artist AS ar USING (artist_id);"""
+
+WEIGHTED_GENRE_SEED_STMT = PROBES_CTE.format(table="album", key="album_id") + """
+SELECT g.genre_name AS seed FROM probe CROSS JOIN LATERAL (
+    SELECT artist_id FROM album WHERE album_id >= probe.target
+    ORDER BY album_id LIMIT 1) AS a
+CROSS JOIN LATERAL (
+    SELECT genre_name FROM artist_genre_assignment JOIN genre USING (genre_id)
+    WHERE artist_id = a.artist_id ORDER BY RANDOM() LIMIT 1) AS g;"""
+
+
+def sample_seeds(stmt: str, n: int) -> list[str]:
+    """Returns up to n distinct seeds drawn by a sampling statement.
+    Extra probes are drawn so duplicate draws can be discarded."""
     with get_connection() as conn:
         with get_cursor(conn) as cur:
-            cur.execute(stmt)
+            cur.execute(stmt, (n * SEED_OVERSAMPLING,))
             results = cur.fetchall()
-    return [x['spotify_artist_id'] for x in results[:n]]
+    return list(dict.fromkeys(x['seed'] for x in results))[:n]
+
+
+def pull_artist_seeds(n: int = 3, weighted: bool = True) -> list[str]:
+    """Pulls n random artists from the user's collection
+    to seed album recommendations. Weighted draws favour
+    artists the user owns more albums by."""
+    return sample_seeds(WEIGHTED_ARTIST_SEED_STMT if weighted else ARTIST_SEED_STMT, n)
 
 
-def pull_genre_seeds(n: int = 2) -> list[str]:
+def pull_genre_seeds(n: int = 2, weighted: bool = True) -> list[str]:
     """Pulls n random genres from the user's collection
-    to seed album recommendations."""
-    stmt = """SELECT genre_name
-    FROM genre ORDER BY RANDOM();"""
-    with get_connection() as conn:
-        with get_cursor(conn) as cur:
-            cur.execute(stmt)
-            results = cur.fetchall()
-    return [x['genre_name'] for x in results[:n]]
+    to seed album recommendations. Weighted draws favour
+    genres the user owns more albums in."""
+    return sample_seeds(WEIGHTED_GENRE_SEED_STMT if weighted else GENRE_SEED_STMT, n)
 
 
 def form_api_url(artist_seeds: list[str], genre_seeds: list[str]) -> str:
@@ -41,7 +98,7 @@ def form_api_url(artist_seeds: list[str], genre_seeds: list[str]) -> str:
 def call_recommendation_endpoint(url: str, access_token: str) -> dict:
     """Calls the recommendations endpoint, returns the response."""
     headers = {"Authorization": f"Bearer {access_token}"}
-    response = req.get(url, headers=headers, timeout=10)
+    response = http_client.get(url, headers=headers, timeout=10)
     if response.status_code != 200:
         raise ConnectionError(
             f"Failed to call recommendation API. Code: {response.status_code}")
@@ -49,26 +106,100 @@ def call_recommendation_endpoint(url: str, access_token: str) -> dict:
 
 
 def parse_recommendations(recs_dict: dict) -> list[dict]:
-    """Returns a list of album objects from the recommendations JSON response."""
-    parsed = []
+    """Returns a list of album objects from the recommendations JSON response,
+    with one entry per album however many of its tracks were recommended."""
+    parsed = {}
     for rec in recs_dict['tracks']:
-        parsed.append(
-            {
-                'album_name': rec['album']['name'],
-                'artist_name': ", ".join(x['name'] for x in rec['artists']),
-                'release_date': rec['album']['release_date'],
-                'img_url': rec['album']['images'][0]['url']
-            }
-        )
-    return parsed
-
-
-def get_recommendations(access_token: str) -> list[dict]:
+        album = rec['album']
+        if album['id'] in parsed:
+            continue
+        parsed[album['id']] = {
+            'spotify_album_id': album['id'],
+            'album_name': album['name'],
+            'artist_name': ", ".join(x['name'] for x in rec['artists']),
+            'release_date': album['release_date'],
+            'img_url': album['images'][0]['url'] if album['images'] else None
+        }
+    return list(parsed.values())
+
+
+def pull_seeds() -> tuple:
+    """Returns a fresh seed set of (artist seeds, genre seeds), each sorted
+    so the same seeds always make the same cache key."""
+    return tuple(sorted(pull_artist_seeds())), tuple(sorted(pull_genre_seeds()))
+
+
+def get_seed_key(seeds: tuple) -> str:
+    """Returns the cache key for a seed set."""
+    artist_seeds, genre_seeds = seeds
+    return f"{','.join(artist_seeds)}|{','.join(genre_seeds)}"
+
+
+def fetch_recommendations(seeds: tuple, get_token: Callable[[], str]) -> list[dict]:
+    """Returns the parsed recommendations for a seed set, calling Spotify
+    only if they are not already cached."""
+    return RECOMMENDATION_CACHE.get_or_set(
+        get_seed_key(seeds),
+        lambda: parse_recommendations(
+            call_recommendation_endpoint(form_api_url(*seeds), get_token())))
+
+
+def prefetch_recommendations(get_token: Callable[[], str]):
+    """Fetches recommendations for new seed sets into the cache until
+    PREFETCH_DEPTH sets are ready to be served."""
+    global _prefetch_worker  # pylint: disable=global-statement
+    try:
+        while len(_prefetched) < PREFETCH_DEPTH:
+            seeds = pull_seeds()
+            fetch_recommendations(seeds, get_token)
+            _prefetched.append(seeds)
+    except (ConnectionError, RequestException, DatabaseError):
+        logger.exception("Failed to prefetch recommendations.")
+    finally:
+        with _prefetch_lock:
+            _prefetch_worker = None
+
+
+def start_prefetch(get_token: Callable[[], str]):
+    """Starts prefetching the next seed sets in the background, unless a
+    prefetch is already running."""
+    global _prefetch_worker  # pylint: disable=global-statement
+    with _prefetch_lock:
+        if _prefetch_worker is None:
+            _prefetch_worker = Thread(target=prefetch_recommendations, args=(get_token,),
+                                      name="recommendation-prefetch", daemon=True)
+            _prefetch_worker.start()
+
+
+def next_seeds() -> tuple[tuple, list[dict]]:
+    """Returns the next prefetched seed set whose recommendations are still
+    cached, along with those recommendations, or pulls a fresh seed set
+    (with None) if none are ready."""
+    while _prefetched:
+        try:
+            seeds = _prefetched.popleft()
+        except IndexError:
+            break
+        recs = RECOMMENDATION_CACHE.get(get_seed_key(seeds))
+        if recs is not None:
+            return seeds, recs
+    return pull_seeds(), None
+
+
+def remove_owned(albums: list[dict]) -> list[dict]:
+    """Returns the albums that are not already in the collection."""
+    owned = get_owned_album_ids()
+    return [x for x in albums if x['spotify_album_id'] not in owned]
+
+
+def get_recommendations(get_token: Callable[[], str]) -> list[dict]:
     """The main function for the recommendation handler.
-    Calls the recommendations endpoint and returns a list 
-    of parsed album objects."""
-    artist_seeds = pull_artist_seeds()
-    genre_seeds = pull_genre_seeds()
-    url = form_api_url(artist_seeds, genre_seeds)
-    recs = call_recommendation_endpoint(url, access_token)
-    return parse_recommendations(recs)
+    Serves recommendations for the next seed set (usually already
+    prefetched and cached), leaving out albums already owned, then
+    starts prefetching the following seed sets in the background.
+    A token is only requested if Spotify needs to be called."""
+    seeds, recs = next_seeds()
+    if recs is None:
+        recs = fetch_recommendations(seeds, get_token)
+    start_prefetch(get_token)
+    return remove_owned(recs)
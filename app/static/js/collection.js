@@ -0,0 +1,62 @@
+function make_album_card(album) {
+    const card = document.createElement("div");
+    card.className = "album-card";
+
+    const link = document.createElement("a");
+    link.href = `/collection/${album.album_id}`;
+    const img = document.createElement("img");
+    img.src = album.img_url;
+    img.draggable = false;
+    img.alt = `${album.title} album cover`;
+    link.appendChild(img);
+
+    const info = document.createElement("div");
+    info.className = "album-info";
+    [["album-title", album.title],
+     ["album-artist", album.artist],
+     ["album-release-date", `Released: ${album.release_date}`]].forEach(([cls, text]) => {
+        const div = document.createElement("div");
+        div.className = cls;
+        div.textContent = text;
+        info.appendChild(div);
+    });
+
+    card.appendChild(link);
+    card.appendChild(info);
+    return card;
+}
+
+function load_next_page(sentinel, observer) {
+    const cursor = sentinel.dataset.nextCursor;
+    if (!cursor || sentinel.dataset.loading) {
+        return;
+    }
+    sentinel.dataset.loading = "true";
+    const params = new URLSearchParams(window.location.search);
+    params.set("cursor", cursor);
+    fetch(`/collection/page?${params.toString()}`)
+    .then(response => response.json())
+    .then(page => {
+        const grid = document.getElementById("album-grid");
+        page.albums.forEach(album => grid.appendChild(make_album_card(album)));
+        sentinel.dataset.nextCursor = page.next_cursor || "";
+        if (!page.next_cursor) {
+            observer.disconnect();
+        }
+    })
+    .catch(error => console.error('Error:', error))
+    .finally(() => delete sentinel.dataset.loading);
+}
+
+document.addEventListener("DOMContentLoaded", () => {
+    const sentinel = document.getElementById("page-sentinel");
+    if (!sentinel || !sentinel.dataset.nextCursor) {
+        return;
+    }
+    const observer = new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) {
+            load_next_page(sentinel, observer);
+        }
+    }, { rootMargin: "600px" });
+    observer.observe(sentinel);
+});
@@ -1,3 +1,19 @@
+function poll_job(status_url) {
+    fetch(status_url)
+    .then(response => response.json())
+    .then(job => {
+        if (job.status === 'done') {
+            alert('Album added to collection.');
+        } else if (job.status === 'failed') {
+            console.error('Failed to add album to collection:', job.error);
+            alert('Failed to add album to collection.');
+        } else {
+            setTimeout(() => poll_job(status_url), 1000);
+        }
+    })
+    .catch(error => console.error('Error:', error));
+}
+
 function call_add(album_id) {
     console.log("Function called with album ID:", album_id);
     fetch(`/add/${album_id}`, {
@@ -5,7 +21,13 @@ function call_add(album_id) {
     })
     .then(response => {
         if (response.ok) {
-            alert('Album added to collection.');
+            return response.json().then(job => {
+                if (job.owned) {
+                    alert(job.message);
+                } else {
+                    poll_job(job.status_url);
+                }
+            });
         } else {
             console.error('Failed to add album to collection');
         }
@@ -31,4 +53,24 @@ function delete_album(album_id) {
             }
         });
     }
-}
\ No newline at end of file
+}
+function load_prices(album_id) {
+    fetch(`/collection/${album_id}/prices`)
+    .then(response => response.json())
+    .then(prices => {
+        const element = document.getElementById("discogs-price");
+        if (!prices.cheapest) {
+            element.textContent = "No current Discogs listings.";
+            return;
+        }
+        const price = new Intl.NumberFormat(undefined, {
+            style: "currency", currency: prices.currency
+        }).format(prices.cheapest.converted_price);
+        const link = document.createElement("a");
+        link.href = prices.cheapest.listing_url;
+        link.target = "_blank";
+        link.textContent = `${price} (${prices.cheapest.media_condition})`;
+        element.replaceChildren("Cheapest on Discogs: ", link);
+    })
+    .catch(error => console.error('Error:', error));
+}
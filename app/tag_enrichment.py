@@ -0,0 +1,159 @@
+"""Script to run the deferred Last.fm tag enrichment stage. Albums are added
+without tags; this stage picks up albums still missing them, scrapes their
+pages concurrently and writes the tags in bulk. Progress is stored on the
+album rows, so a pass can be stopped and resumed at any point."""
+
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from os import environ as ENV
+from threading import Event, Lock, Thread
+from time import perf_counter
+from urllib.parse import urlsplit
+
+import http_client
+from endpoints import LASTFM_URL
+from metrics import add_stats_source
+from db_utils import get_albums_missing_tags, save_album_tags, add_album_listener
+from extract_lastfm import get_album_tags, PageNotFoundError
+
+LASTFM_HOST = urlsplit(LASTFM_URL).hostname
+BATCH_SIZE = 50
+MAX_WORKERS = 8
+MAX_ATTEMPTS = 3
+IDLE_INTERVAL = 60
+
+http_client.set_host_concurrency(LASTFM_HOST, int(ENV.get('LASTFM_CONCURRENCY', 4)))
+
+logger = logging.getLogger(__name__)
+
+_new_albums = Event()
+_worker_lock = Lock()
+_worker = None
+
+
+@dataclass
+class EnrichmentStats:
+    """Throughput and failure counters for the tag enrichment stage."""
+    albums_processed: int = 0
+    albums_tagged: int = 0
+    albums_without_tags: int = 0
+    albums_failed: int = 0
+    tags_assigned: int = 0
+    fetch_seconds_total: float = 0.0
+    started_at: float = field(default_factory=perf_counter)
+
+    def to_dict(self) -> dict:
+        """Returns the counters along with the stage's throughput."""
+        elapsed = perf_counter() - self.started_at
+        stats = asdict(self)
+        del stats['started_at']
+        stats['elapsed_seconds'] = round(elapsed, 2)
+        stats['albums_per_second'] = round(self.albums_processed / elapsed, 2) if elapsed else 0.0
+        return stats
+
+
+TOTALS = EnrichmentStats()
+_totals_lock = Lock()
+
+
+def fetch_tags(album: dict) -> tuple:
+    """Scrapes the tags for an album. Returns (album_id, tags, error, seconds),
+    where tags is None if the scrape failed. Any error (including a parse
+    error from a changed page) is returned rather than raised, so it counts
+    as a failed attempt against this album alone."""
+    start = perf_counter()
+    try:
+        tags = get_album_tags(album['album_name'], album['artist_name'])
+        error = None
+    except PageNotFoundError:
+        tags, error = [], None
+    except Exception as err:  # pylint: disable=broad-exception-caught
+        tags, error = None, err
+    return album['album_id'], tags, error, perf_counter() - start
+
+
+def enrich_batch(albums: list[dict], stats: EnrichmentStats, max_workers: int = MAX_WORKERS):
+    """Scrapes the tags for a batch of albums concurrently and saves them in bulk."""
+    album_tags, failed = {}, []
+    elapsed = 0.0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for album_id, tags, error, seconds in executor.map(fetch_tags, albums):
+            elapsed += seconds
+            if tags is None:
+                logger.warning("Failed to scrape tags for album %s: %s", album_id, error)
+                failed.append(album_id)
+            else:
+                album_tags[album_id] = tags
+
+    assigned = save_album_tags(album_tags, failed)
+    for totals in (stats, TOTALS):
+        with _totals_lock:
+            totals.albums_processed += len(albums)
+            totals.albums_tagged += sum(1 for tags in album_tags.values() if tags)
+            totals.albums_without_tags += sum(1 for tags in album_tags.values() if not tags)
+            totals.albums_failed += len(failed)
+            totals.tags_assigned += assigned
+            totals.fetch_seconds_total += elapsed
+
+
+def enrich_missing_tags(batch_size: int = BATCH_SIZE, max_batches: int = None) -> EnrichmentStats:
+    """Runs the enrichment stage until no albums are left missing tags
+    (or max_batches have been processed). Returns the pass's stats."""
+    stats = EnrichmentStats()
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        albums = get_albums_missing_tags(batch_size, MAX_ATTEMPTS)
+        if not albums:
+            break
+        enrich_batch(albums, stats)
+        batches += 1
+    return stats
+
+
+def get_enrichment_stats() -> dict:
+    """Returns the stage's counters since the process started."""
+    with _totals_lock:
+        return TOTALS.to_dict()
+
+
+def wake_on_insert(event: str, albums: dict):  # pylint: disable=unused-argument
+    """Wakes the background enrichment worker when albums are added."""
+    if event == 'insert':
+        _new_albums.set()
+
+
+def run_enrichment_worker():
+    """Runs enrichment passes forever, waiting for new albums between passes."""
+    while True:
+        try:
+            enrich_missing_tags()
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Tag enrichment pass failed.")
+        _new_albums.wait(IDLE_INTERVAL)
+        _new_albums.clear()
+
+
+def start_enrichment_worker() -> Thread:
+    """Starts the background enrichment worker once per process. Setting
+    TAG_ENRICHMENT_WORKER to 0 turns it off, e.g. when another process
+    already runs it. Returns the worker, or None if it is turned off."""
+    global _worker  # pylint: disable=global-statement
+    if ENV.get('TAG_ENRICHMENT_WORKER', "1") == "0":
+        return None
+    with _worker_lock:
+        if _worker is None:
+            _worker = Thread(target=run_enrichment_worker, name="tag-enrichment", daemon=True)
+            _worker.start()
+    return _worker
+
+
+add_album_listener(wake_on_insert)
+add_stats_source("vinylvault_tag_enrichment", get_enrichment_stats)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    result = enrich_missing_tags()
+    print(json.dumps(result.to_dict(), indent=2))
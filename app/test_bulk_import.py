@@ -0,0 +1,64 @@
+"""Tests for the file parsing in bulk_import."""
+
+from bulk_import import ImportReport, parse_album_id, read_album_ids, read_raw_values
+
+ALBUM_ID = "4LH4d3cOWNNsVw41Gqt2kv"
+OTHER_ID = "1ATL5GLyefJaxhQzSPVrLX"
+
+
+def test_parse_album_id_accepts_ids_urls_and_uris():
+    """Bare IDs, album URLs and album URIs all resolve to the ID."""
+    assert parse_album_id(ALBUM_ID) == ALBUM_ID
+    assert parse_album_id(f"  {ALBUM_ID}\n") == ALBUM_ID
+    assert parse_album_id(f"https://open.spotify.com/album/{ALBUM_ID}") == ALBUM_ID
+    assert parse_album_id(f"https://open.spotify.com/album/{ALBUM_ID}?si=abc") == ALBUM_ID
+    assert parse_album_id(f"https://open.spotify.com/intl-de/album/{ALBUM_ID}") == ALBUM_ID
+    assert parse_album_id(f"open.spotify.com/album/{ALBUM_ID}/") == ALBUM_ID
+    assert parse_album_id(f"spotify:album:{ALBUM_ID}") == ALBUM_ID
+
+
+def test_parse_album_id_rejects_other_spotify_links():
+    """Links to anything but an album are not taken as album IDs."""
+    assert parse_album_id(f"https://open.spotify.com/artist/{ALBUM_ID}") is None
+    assert parse_album_id(f"https://open.spotify.com/playlist/{ALBUM_ID}") is None
+    assert parse_album_id(f"spotify:track:{ALBUM_ID}") is None
+    assert parse_album_id(f"x{ALBUM_ID}") is None
+    assert parse_album_id("not an id") is None
+    assert parse_album_id("") is None
+
+
+def test_read_raw_values_txt_skips_blanks_and_comments():
+    """Plain text files skip blank and commented lines."""
+    lines = [f"{ALBUM_ID}\n", "\n", "# a comment\n", f"{OTHER_ID}\n"]
+    assert list(read_raw_values(lines, "txt")) == [f"{ALBUM_ID}\n", f"{OTHER_ID}\n"]
+
+
+def test_read_raw_values_csv_uses_the_id_column():
+    """CSV files read the recognised ID column."""
+    lines = ["artist,spotify_album_id\n", f"Someone,{ALBUM_ID}\n", "Short\n"]
+    assert list(read_raw_values(lines, "csv")) == [ALBUM_ID]
+
+
+def test_read_raw_values_csv_without_header_uses_the_first_column():
+    """CSV files without a recognised header read the first column."""
+    lines = [f"{ALBUM_ID},x\n", f"{OTHER_ID},y\n"]
+    assert list(read_raw_values(lines, "csv")) == [ALBUM_ID, OTHER_ID]
+
+
+def test_read_raw_values_jsonl_handles_every_record_type():
+    """JSONL records that aren't strings or objects come back as raw lines."""
+    lines = [f'"{ALBUM_ID}"\n', f'{{"url": "spotify:album:{OTHER_ID}"}}\n',
+             '{"name": "no id"}\n', "42\n", "true\n", "null\n", "[1, 2]\n",
+             "{not json\n", "\n"]
+    assert list(read_raw_values(lines, "jsonl")) == [
+        ALBUM_ID, f"spotify:album:{OTHER_ID}", '{"name": "no id"}\n',
+        "42\n", "true\n", "null\n", "[1, 2]\n", "{not json\n"]
+
+
+def test_read_album_ids_dedupes_and_reports_invalid_items():
+    """Duplicate IDs are skipped and invalid lines are reported, not raised."""
+    report = ImportReport()
+    lines = [f'"{ALBUM_ID}"\n', f'{{"id": "{ALBUM_ID}"}}\n', "42\n", "null\n",
+             f'"spotify:track:{OTHER_ID}"\n', f'{{"uri": "spotify:album:{OTHER_ID}"}}\n']
+    assert list(read_album_ids(lines, "jsonl", report)) == [ALBUM_ID, OTHER_ID]
+    assert set(report.failures) == {"42", "null", f"spotify:track:{OTHER_ID}"}
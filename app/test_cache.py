@@ -0,0 +1,67 @@
+"""Tests for the TTL, LRU and invalidation behaviour in cache."""
+
+import cache
+from cache import Cache, MemoryBackend
+
+
+def make_test_cache(max_size: int = 3, ttl: float = 10) -> Cache:
+    """Returns an unregistered in-process cache."""
+    return Cache("test", MemoryBackend(max_size, ttl))
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    """Entries are served until their TTL passes, then count as misses."""
+    now = [100.0]
+    monkeypatch.setattr(cache, "monotonic", lambda: now[0])
+    test_cache = make_test_cache(ttl=10)
+    test_cache.set("a", 1)
+    test_cache.set("b", 2, ttl=30)
+    now[0] = 109.0
+    assert test_cache.get("a") == 1
+    now[0] = 110.0
+    assert test_cache.get("a") is None
+    assert test_cache.get("b") == 2
+    stats = test_cache.get_stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (2, 1, 1)
+
+
+def test_least_recently_used_entry_is_evicted_when_full():
+    """A full cache evicts the entry that was read or written longest ago."""
+    test_cache = make_test_cache(max_size=3)
+    for key in "abc":
+        test_cache.set(key, key)
+    test_cache.get("a")
+    test_cache.set("d", "d")
+    assert test_cache.get("b") is None
+    assert [test_cache.get(x) for x in "acd"] == ["a", "c", "d"]
+    assert test_cache.get_stats()['size'] == 3
+
+
+def test_invalidate_and_clear_remove_entries():
+    """Invalidating removes one key and clearing removes every key."""
+    test_cache = make_test_cache()
+    test_cache.set("a", 1)
+    test_cache.set("b", 2)
+    test_cache.invalidate("a")
+    test_cache.invalidate("missing")
+    assert test_cache.get("a") is None
+    assert test_cache.get("b") == 2
+    test_cache.clear()
+    assert test_cache.get_stats()['size'] == 0
+
+
+def test_get_or_set_computes_only_on_a_miss():
+    """get_or_set caches the computed value and counts one lookup per call."""
+    test_cache = make_test_cache()
+    calls = []
+
+    def compute():
+        """Returns a value, recording that it was computed."""
+        calls.append(1)
+        return "value"
+
+    assert test_cache.get_or_set("a", compute) == "value"
+    assert test_cache.get_or_set("a", compute) == "value"
+    assert len(calls) == 1
+    stats = test_cache.get_stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
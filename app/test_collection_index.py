@@ -0,0 +1,93 @@
+"""Tests for keeping the indexes in collection_index in step with changes."""
+
+import collection_index
+from collection_index import AlbumIdIndex, OwnedAlbumSet, mark_owned
+
+
+def fake_get_album_ids(calls: list):
+    """Returns a stand-in for get_album_ids that records its filters. Albums
+    1-3 are in the collection, and only album 2 is tagged 'dreamy'."""
+    def get_album_ids(**filters) -> list[int]:
+        """Returns the album IDs matching the filters."""
+        calls.append(filters)
+        return [2] if filters.get('tag') == 'dreamy' else [1, 2, 3]
+    return get_album_ids
+
+
+def test_album_index_tracks_inserts_and_deletes(monkeypatch):
+    """Inserted albums can be picked and deleted albums never are."""
+    monkeypatch.setattr(collection_index, "get_album_ids", fake_get_album_ids([]))
+    index = AlbumIdIndex()
+    assert index.random_album_id() in {1, 2, 3}
+    index.handle_change('insert', {4: "spotify4"})
+    index.handle_change('delete', {1: "spotify1", 3: "spotify3", 9: "unknown"})
+    assert {index.random_album_id() for _ in range(50)} == {2, 4}
+    index.handle_change('delete', {2: "spotify2", 4: "spotify4"})
+    assert index.random_album_id() is None
+
+
+def test_album_index_ignores_changes_before_loading(monkeypatch):
+    """Changes made before the first load are picked up by the load itself."""
+    calls = []
+    monkeypatch.setattr(collection_index, "get_album_ids", fake_get_album_ids(calls))
+    index = AlbumIdIndex()
+    index.handle_change('insert', {4: "spotify4"})
+    assert {index.random_album_id() for _ in range(50)} == {1, 2, 3}
+    assert calls == [{}]
+
+
+def test_album_index_reloads_filters_after_any_change(monkeypatch):
+    """Filtered picks are cached until an insert, delete or update."""
+    calls = []
+    monkeypatch.setattr(collection_index, "get_album_ids", fake_get_album_ids(calls))
+    index = AlbumIdIndex()
+    assert index.random_album_id(tag='dreamy', genre=None) == 2
+    assert index.random_album_id(tag='dreamy') == 2
+    assert calls == [{}, {'tag': 'dreamy'}]
+    for event in ['insert', 'update', 'delete']:
+        index.handle_change(event, {5: "spotify5"})
+        index.random_album_id(tag='dreamy')
+    assert calls[2:] == [{'tag': 'dreamy'}] * 3
+
+
+def test_album_index_reloads_after_the_refresh_interval(monkeypatch):
+    """A stale index is reloaded to pick up other workers' writes."""
+    now = [100.0]
+    calls = []
+    monkeypatch.setattr(collection_index, "monotonic", lambda: now[0])
+    monkeypatch.setattr(collection_index, "get_album_ids", fake_get_album_ids(calls))
+    index = AlbumIdIndex(refresh_interval=60)
+    index.random_album_id()
+    now[0] = 159.0
+    index.random_album_id()
+    now[0] = 160.0
+    index.random_album_id()
+    assert len(calls) == 2
+
+
+def test_owned_set_tracks_inserts_and_deletes(monkeypatch):
+    """Owned Spotify IDs follow inserts and deletes without a reload."""
+    calls = []
+    monkeypatch.setattr(collection_index, "get_owned_spotify_album_ids",
+                        lambda: calls.append(1) or ["a", "b"])
+    owned = OwnedAlbumSet()
+    owned.handle_change('insert', {9: "z"})
+    snapshot = owned.get()
+    assert snapshot == {"a", "b"}
+    owned.handle_change('insert', {3: "c"})
+    owned.handle_change('delete', {1: "a"})
+    owned.handle_change('update', {2: "b"})
+    assert owned.get() == {"b", "c"}
+    assert snapshot == {"a", "b"}
+    assert len(calls) == 1
+
+
+def test_mark_owned_leaves_the_originals_untouched(monkeypatch):
+    """Owned flags are set on copies of the album results."""
+    owned = OwnedAlbumSet()
+    monkeypatch.setattr(owned, "get", lambda: frozenset({"a"}))
+    monkeypatch.setattr(collection_index, "OWNED_ALBUMS", owned)
+    albums = [{'spotify_id': "a"}, {'spotify_id': "b"}]
+    assert mark_owned(albums) == [{'spotify_id': "a", 'owned': True},
+                                  {'spotify_id': "b", 'owned': False}]
+    assert albums == [{'spotify_id': "a"}, {'spotify_id': "b"}]
@@ -0,0 +1,28 @@
+"""Tests for the page cursors in db_utils."""
+
+from datetime import date
+
+import pytest
+
+from db_utils import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trips_sort_values():
+    """Cursors decode back to the stringified sort value and the album ID."""
+    assert decode_cursor(encode_cursor("Björk", 12)) == ("Björk", 12)
+    assert decode_cursor(encode_cursor(date(1999, 1, 31), 7)) == ("1999-01-31", 7)
+
+
+def test_cursor_is_url_safe():
+    """Cursors can be passed in a query string without escaping."""
+    page_cursor = encode_cursor("?/+&=" * 10, 123456)
+    assert all(x.isalnum() or x in "-_=" for x in page_cursor)
+
+
+@pytest.mark.parametrize("page_cursor", ["", "not a cursor", "bnVsbA==",
+                                         encode_cursor("a", 1)[:-4],
+                                         "WyJhIiwgImIiXQ=="])
+def test_decode_cursor_rejects_invalid_cursors(page_cursor):
+    """Malformed cursors raise a ValueError rather than reaching the query."""
+    with pytest.raises(ValueError, match="Invalid page cursor"):
+        decode_cursor(page_cursor)
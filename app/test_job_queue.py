@@ -0,0 +1,141 @@
+"""Tests for claiming, running and requeueing jobs in job_queue."""
+
+from contextlib import contextmanager
+
+import pytest
+
+import job_queue
+
+
+class StopWorker(Exception):
+    """Raised to end a worker loop under test."""
+
+
+class FakeCursor:
+    """Records executed statements and returns canned results."""
+
+    def __init__(self, row: dict = None, rowcount: int = 0):
+        self.row = row
+        self.rowcount = rowcount
+        self.executed = []
+
+    def execute(self, stmt: str, params: tuple = None):
+        """Records a statement and its parameters."""
+        self.executed.append((stmt, params))
+
+    def fetchone(self) -> dict:
+        """Returns the canned row."""
+        return self.row
+
+
+def use_cursor(monkeypatch, fake_cursor: FakeCursor):
+    """Points job_queue's connections at a fake cursor."""
+    @contextmanager
+    def fake_context(*_):
+        """Yields nothing in place of a connection, or the fake cursor."""
+        yield fake_cursor
+
+    monkeypatch.setattr(job_queue, "get_connection", fake_context)
+    monkeypatch.setattr(job_queue, "get_cursor", fake_context)
+
+
+class FakeEvent:
+    """Stands in for the wake-up event, ending the loop after some waits."""
+
+    def __init__(self, waits: int, on_wait=lambda: None):
+        self.waits = waits
+        self.on_wait = on_wait
+
+    def wait(self, _):
+        """Counts down the waits, then stops the worker."""
+        self.on_wait()
+        self.waits -= 1
+        if self.waits < 0:
+            raise StopWorker
+
+    def clear(self):
+        """Does nothing."""
+
+
+def test_claim_job_skips_locked_rows(monkeypatch):
+    """Claiming takes the oldest queued job without waiting on other workers."""
+    fake_cursor = FakeCursor({'job_id': 3, 'spotify_album_id': "abc"})
+    use_cursor(monkeypatch, fake_cursor)
+    assert job_queue.claim_job() == {'job_id': 3, 'spotify_album_id': "abc"}
+    stmt, _ = fake_cursor.executed[0]
+    assert "status = 'queued'" in stmt
+    assert "ORDER BY created_at, job_id" in stmt
+    assert "FOR UPDATE SKIP LOCKED" in stmt
+
+
+def test_requeue_stale_jobs_returns_the_requeued_count(monkeypatch):
+    """Requeueing only touches running jobs older than the cutoff."""
+    fake_cursor = FakeCursor(rowcount=2)
+    use_cursor(monkeypatch, fake_cursor)
+    assert job_queue.requeue_stale_jobs(minutes=7) == 2
+    stmt, params = fake_cursor.executed[0]
+    assert "WHERE status = 'running'" in stmt
+    assert params == (7,)
+
+
+def test_run_job_records_success_and_failure(monkeypatch):
+    """A job records the new album ID, or the error it failed with."""
+    finished = []
+    monkeypatch.setattr(job_queue, "get_valid_token", lambda: "token")
+    monkeypatch.setattr(job_queue, "finish_job",
+                        lambda job_id, **outcome: finished.append((job_id, outcome)))
+    monkeypatch.setattr(job_queue, "add_album", lambda spotify_id, _: 10)
+    job_queue.run_job({'job_id': 1, 'spotify_album_id': "abc"})
+
+    def fail(*_):
+        """Fails as the Spotify API would."""
+        raise ConnectionError("Code: 503")
+
+    monkeypatch.setattr(job_queue, "add_album", fail)
+    job_queue.run_job({'job_id': 2, 'spotify_album_id': "def"})
+    assert finished == [(1, {'album_id': 10}),
+                        (2, {'error': "ConnectionError: Code: 503"})]
+
+
+def test_worker_requeues_stale_jobs_periodically(monkeypatch):
+    """An idle worker sweeps for stale jobs once every REQUEUE_INTERVAL."""
+    now = [0.0]
+    requeues = []
+
+    def advance():
+        """Lets half an interval pass on each poll."""
+        now[0] += job_queue.REQUEUE_INTERVAL / 2
+
+    monkeypatch.setattr(job_queue, "monotonic", lambda: now[0])
+    monkeypatch.setattr(job_queue, "claim_job", lambda: None)
+    monkeypatch.setattr(job_queue, "requeue_stale_jobs", lambda: requeues.append(now[0]))
+    monkeypatch.setattr(job_queue, "_wake_up", FakeEvent(waits=5, on_wait=advance))
+    with pytest.raises(StopWorker):
+        job_queue.work()
+    assert requeues == [job_queue.REQUEUE_INTERVAL, job_queue.REQUEUE_INTERVAL * 2]
+
+
+def test_worker_survives_database_errors(monkeypatch):
+    """Failures claiming or finishing a job are logged and the loop goes on."""
+    jobs = [RuntimeError("claim"), {'job_id': 1, 'spotify_album_id': "abc"}, None]
+    ran = []
+
+    def claim_job():
+        """Returns the next canned job, raising any canned error."""
+        job = jobs.pop(0) if jobs else None
+        if isinstance(job, Exception):
+            raise job
+        return job
+
+    def run_job(job: dict):
+        """Fails to record the outcome of a job."""
+        ran.append(job['job_id'])
+        raise RuntimeError("finish")
+
+    monkeypatch.setattr(job_queue, "claim_job", claim_job)
+    monkeypatch.setattr(job_queue, "run_job", run_job)
+    monkeypatch.setattr(job_queue, "_wake_up", FakeEvent(waits=2))
+    with pytest.raises(StopWorker):
+        job_queue.work()
+    assert ran == [1]
+    assert not jobs
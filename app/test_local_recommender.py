@@ -0,0 +1,90 @@
+"""Tests for keeping the FeatureMatrix in local_recommender in step with changes."""
+
+import pytest
+
+import local_recommender
+from local_recommender import FeatureMatrix
+
+
+@pytest.fixture(name="features")
+def fixture_features(monkeypatch) -> dict:
+    """Returns a mutable stand-in for the collection's album features, which
+    the matrix reads through get_album_features."""
+    features = {
+        1: [('genre', "rock"), ('tag', "loud")],
+        2: [('genre', "rock"), ('tag', "loud")],
+        3: [('genre', "rock"), ('tag', "quiet")],
+        4: [('genre', "jazz")]
+    }
+
+    def get_album_features(album_ids: list[int] = None) -> list[tuple]:
+        """Returns (album_id, kind, name) rows for every album or the given ones."""
+        album_ids = features if album_ids is None else album_ids
+        return [(x, kind, name) for x in album_ids for kind, name in features.get(x, [])]
+
+    monkeypatch.setattr(local_recommender, "get_album_features", get_album_features)
+    return features
+
+
+def similar_ids(matrix: FeatureMatrix, album_id: int) -> list[int]:
+    """Returns the IDs of the albums most similar to an album, in order."""
+    return [x for x, _ in matrix.similar(album_id, 10)]
+
+
+@pytest.mark.usefixtures("features")
+def test_similar_ranks_albums_by_shared_features():
+    """Albums sharing more features rank higher, and unrelated albums are left out."""
+    matrix = FeatureMatrix()
+    assert similar_ids(matrix, 1) == [2, 3]
+    assert not matrix.similar(4, 10)
+    assert not matrix.similar(99, 10)
+
+
+def test_inserted_and_updated_albums_are_appended(features):
+    """Inserted albums and updated features are read on the next query."""
+    matrix = FeatureMatrix()
+    similar_ids(matrix, 1)
+    features[5] = [('genre', "jazz"), ('tag', "smooth")]
+    matrix.handle_change('insert', {5: "spotify5"})
+    assert similar_ids(matrix, 4) == [5]
+    features[3] = [('genre', "rock"), ('tag', "loud")]
+    matrix.handle_change('update', {3: "spotify3"})
+    assert similar_ids(matrix, 1)[:2] == [2, 3]
+    assert [x for x, score in matrix.similar(1, 10) if score > 0.99] == [2, 3]
+
+
+def test_deleted_albums_are_blanked(features):
+    """Deleted albums are never recommended and have no neighbours."""
+    matrix = FeatureMatrix()
+    similar_ids(matrix, 1)
+    del features[2]
+    matrix.handle_change('delete', {2: "spotify2"})
+    assert similar_ids(matrix, 1) == [3]
+    assert not matrix.similar(2, 10)
+
+
+def test_blank_rows_are_compacted(features, monkeypatch):
+    """Once enough rows are blank, they are dropped and the rest still match."""
+    monkeypatch.setattr(local_recommender, "MIN_COMPACT_ROWS", 1)
+    matrix = FeatureMatrix()
+    similar_ids(matrix, 1)
+    for album_id in [2, 4]:
+        del features[album_id]
+        matrix.handle_change('delete', {album_id: f"spotify{album_id}"})
+    assert similar_ids(matrix, 1) == [3]
+    assert matrix._counts.shape[0] == 2  # pylint: disable=protected-access
+    features[6] = [('tag', "loud")]
+    matrix.handle_change('insert', {6: "spotify6"})
+    assert similar_ids(matrix, 1) == [6, 3]
+
+
+def test_matrix_reloads_after_the_refresh_interval(features, monkeypatch):
+    """Changes made without an event are picked up by the periodic reload."""
+    now = [100.0]
+    monkeypatch.setattr(local_recommender, "monotonic", lambda: now[0])
+    matrix = FeatureMatrix(refresh_interval=60)
+    similar_ids(matrix, 4)
+    features[7] = [('genre', "jazz")]
+    assert not matrix.similar(4, 10)
+    now[0] = 160.0
+    assert similar_ids(matrix, 4) == [7]
@@ -0,0 +1,120 @@
+"""Tests for the price parsing, saving and refreshing in price_tracker."""
+
+from contextlib import contextmanager
+from decimal import Decimal
+
+import price_tracker
+from price_tracker import parse_amount, parse_prices, parse_page_listings, save_listings
+
+LISTING_ROW = """<tr class="shortcut_navigable ">
+<td class="item_description"><strong><a href="/sell/item/{item}"
+class="item_description_title">Artist - Album (LP)</a></strong>
+<p class="item_condition"><span>Media:</span><span>Media:</span>
+<span>Near Mint (NM or M-)
+<span class="tooltip">A comment</span></span>
+<br><span>Sleeve:</span><span class="item_sleeve_condition">Very Good (VG)</span></p></td>
+<td class="seller_info"><ul><li>seller</li><li><strong>99.5%</strong>, 10 ratings</li></ul></td>
+<td class="item_price"><span class="price">{price}</span>
+<span class="converted_price">{converted_price}</span></td></tr>"""
+
+
+def test_parse_amount_handles_both_decimal_marks():
+    """Amounts parse with either decimal mark."""
+    assert parse_amount("12") == Decimal("12")
+    assert parse_amount("12.5") == Decimal("12.5")
+    assert parse_amount("1,020.00") == Decimal("1020.00")
+    assert parse_amount("1.234,56") == Decimal("1234.56")
+    assert parse_amount("12,50") == Decimal("12.50")
+    assert parse_amount("1,234") == Decimal("1234")
+    assert parse_amount("1.234.567") == Decimal("1234567")
+
+
+def test_parse_prices_reads_amounts_and_currencies():
+    """Labels parse into amounts and ISO currency codes."""
+    assert parse_prices(["£12.50", "about CA$1,020.00 total", "€1.234,56",
+                         "JP¥1,500", "¥980", "$7.99.", "1.234,56 €", "12,50\xa0€"]) == [
+        (Decimal("12.50"), "GBP"), (Decimal("1020.00"), "CAD"),
+        (Decimal("1234.56"), "EUR"), (Decimal("1500"), "JPY"),
+        (Decimal("980"), "JPY"), (Decimal("7.99"), "USD"),
+        (Decimal("1234.56"), "EUR"), (Decimal("12.50"), "EUR")]
+
+
+def test_parse_prices_marks_labels_without_a_price():
+    """Labels without a price parse as (None, None)."""
+    assert parse_prices(["", None, "Make an offer"]) == [(None, None)] * 3
+
+
+def use_fake_database(monkeypatch) -> dict:
+    """Points price_tracker's database calls at fakes, returning the rows
+    and statements they receive."""
+    written = {'listings': [], 'snapshots': [], 'executed': []}
+
+    @contextmanager
+    def fake_context(*_):
+        """Yields a fake cursor in place of a connection or cursor."""
+        yield FakeCursor()
+
+    class FakeCursor:
+        """Records executed statements."""
+
+        def execute(self, stmt: str, params: tuple):
+            """Records a statement and its parameters."""
+            written['executed'].append((stmt, params))
+
+    def fake_execute_values(_, stmt: str, rows: list, fetch: bool = False) -> list:
+        """Records bulk-inserted rows, returning listing IDs for listings."""
+        if "discogs_listing" in stmt:
+            written['listings'].extend(rows)
+            return [{'listing_id': i, 'listing_url': x[1]} for i, x in enumerate(rows)]
+        written['snapshots'].extend(rows)
+        return [] if fetch else None
+
+    monkeypatch.setattr(price_tracker, "get_connection", fake_context)
+    monkeypatch.setattr(price_tracker, "get_cursor", fake_context)
+    monkeypatch.setattr(price_tracker, "execute_values", fake_execute_values)
+    return written
+
+
+def test_scraped_listings_are_saved_with_their_prices(monkeypatch):
+    """Prices scraped in any format reach the snapshots, and only the albums
+    whose listings were scraped are marked as checked."""
+    page = "<table>" + "".join(LISTING_ROW.format(item=i, price=price, converted_price=converted)
+                               for i, (price, converted) in enumerate([
+                                   ("€1.234,56", "about £1,050.00 total"),
+                                   ("€ 1.234,56", "about £1,050.00 total"),
+                                   ("1.234,56 €", "about 1.300,00 € total")])) + "</table>"
+    listings = parse_page_listings(page)
+    assert [x['original_price'] for x in listings] == ["€1.234,56", "€ 1.234,56", "1.234,56 €"]
+    assert listings[0]['media_condition'] == "Near Mint (NM or M-)"
+
+    written = use_fake_database(monkeypatch)
+    assert save_listings({7: listings, 8: listings[:1], 9: []}) == 3
+    assert [x[0] for x in written['listings']] == [8, 7, 7]
+    assert [x[1:] for x in written['snapshots']] == [
+        (8, Decimal("1234.56"), "EUR", Decimal("1050.00"), "GBP"),
+        (7, Decimal("1234.56"), "EUR", Decimal("1050.00"), "GBP"),
+        (7, Decimal("1234.56"), "EUR", Decimal("1300.00"), "EUR")]
+    assert written['executed'][-1][1] == ([7, 8, 9],)
+
+
+def test_refresh_skips_failed_albums_without_marking_them(monkeypatch):
+    """Albums that fail to load are left unchecked and not retried in the
+    same refresh."""
+    stale = [[{'album_id': 1}, {'album_id': 2}], [{'album_id': 3}], []]
+    excluded, saved = [], []
+
+    def get_stale_albums(_, __, exclude_ids):
+        """Returns the next batch of stale albums."""
+        excluded.append(list(exclude_ids))
+        return stale.pop(0)
+
+    monkeypatch.setattr(price_tracker, "get_stale_albums", get_stale_albums)
+    monkeypatch.setattr(price_tracker, "scrape_album_listings",
+                        lambda albums: ({x['album_id']: [] for x in albums[1:]},
+                                        [x['album_id'] for x in albums[:1]]))
+    monkeypatch.setattr(price_tracker, "save_listings",
+                        lambda album_listings: saved.append(list(album_listings)) or 0)
+    assert price_tracker.refresh_prices() == {
+        'albums_checked': 1, 'albums_failed': 2, 'snapshots': 0}
+    assert saved == [[2], []]
+    assert excluded == [[], [1], [1, 3]]
@@ -0,0 +1,88 @@
+"""Benchmarks full-tree against strained parsing of saved Last.fm and Discogs
+pages, for each available parser backend. Also checks that every mode
+extracts identical data. Results are printed as JSON."""
+
+import json
+import sys
+import tracemalloc
+from argparse import ArgumentParser
+from importlib.util import find_spec
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
+
+# pylint: disable=wrong-import-position
+from html_parsing import make_soup
+from extract_lastfm import get_soup, get_tag_section, parse_tags
+from extract_discogs import get_soop, scrape_listings, parse_listing
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+
+def extract_lastfm_tags(source: str, parser: str, strained: bool) -> list:
+    """Returns the tags parsed from a Last.fm album page."""
+    soup = get_soup(source, parser) if strained else make_soup(source, parser=parser)
+    return parse_tags(get_tag_section(soup))
+
+
+def extract_discogs_listings(source: str, parser: str, strained: bool) -> list:
+    """Returns the listings parsed from a Discogs marketplace page."""
+    soup = get_soop(source, parser) if strained else make_soup(source, parser=parser)
+    return [parse_listing(x) for x in scrape_listings(soup)]
+
+
+def measure(extract, source: str, parser: str, strained: bool, repeats: int) -> dict:
+    """Returns the median time and peak traced memory of an extraction."""
+    timings = []
+    for _ in range(repeats):
+        start = perf_counter()
+        extract(source, parser, strained)
+        timings.append(perf_counter() - start)
+
+    tracemalloc.start()
+    result = extract(source, parser, strained)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'median_ms': round(median(timings) * 1000, 3),
+        'peak_kib': round(peak / 1024, 1),
+        'result': result
+    }
+
+
+def run(repeats: int) -> dict:
+    """Runs every page/parser/mode combination, returning the results."""
+    parsers = ["html.parser"] + (["lxml"] if find_spec("lxml") else [])
+    pages = {
+        'lastfm_album': (FIXTURES / "lastfm_album.html", extract_lastfm_tags),
+        'discogs_marketplace': (FIXTURES / "discogs_marketplace.html", extract_discogs_listings)
+    }
+    results = {}
+    for page, (path, extract) in pages.items():
+        source = path.read_text(encoding="utf-8")
+        baseline = None
+        results[page] = {'size_kib': round(len(source.encode()) / 1024, 1)}
+        for parser in parsers:
+            for strained in (False, True):
+                stats = measure(extract, source, parser, strained, repeats)
+                result = stats.pop('result')
+                if baseline is None:
+                    baseline = result
+                stats['matches_baseline'] = result == baseline
+                mode = "strained" if strained else "full"
+                results[page][f"{parser}/{mode}"] = stats
+        full = results[page]["html.parser/full"]
+        fastest = min((v for k, v in results[page].items() if "/" in k),
+                      key=lambda x: x['median_ms'])
+        results[page]['speedup'] = round(full['median_ms'] / fastest['median_ms'], 1)
+        results[page]['memory_reduction'] = round(full['peak_kib'] / fastest['peak_kib'], 1)
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--repeats", type=int, default=20)
+    args = arg_parser.parse_args()
+    print(json.dumps(run(args.repeats), indent=2))
@@ -0,0 +1,102 @@
+"""Benchmarks ORDER BY RANDOM() seed selection against the key-probe sampling
+used by the recommendation handler, on synthetic collections of 10k and 100k
+artists. The tables are created as temporary tables that shadow the real ones
+for the benchmark's transaction only, so the database's data is untouched.
+Needs the usual DB_* connection settings. Results are printed as JSON."""
+
+import json
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
+
+# pylint: disable=wrong-import-position
+from db_pool import get_connection
+from recommendation_handler import (SEED_OVERSAMPLING, ARTIST_SEED_STMT, GENRE_SEED_STMT,
+                                    WEIGHTED_ARTIST_SEED_STMT, WEIGHTED_GENRE_SEED_STMT)
+
+ALBUMS_PER_ARTIST = 3
+GENRES = 2000
+GENRES_PER_ARTIST = 3
+
+SETUP_STMTS = [
+    """CREATE TEMP TABLE artist ON COMMIT DROP AS
+    SELECT i AS artist_id, 'artist' || i AS spotify_artist_id, 'Artist ' || i AS artist_name
+    FROM GENERATE_SERIES(1, %(artists)s) AS i;""",
+    """CREATE TEMP TABLE genre ON COMMIT DROP AS
+    SELECT i AS genre_id, 'genre ' || i AS genre_name
+    FROM GENERATE_SERIES(1, %(genres)s) AS i;""",
+    # Album counts per artist are skewed, so weighted draws differ from uniform ones.
+    """CREATE TEMP TABLE album ON COMMIT DROP AS
+    SELECT ROW_NUMBER() OVER ()::INT AS album_id, artist_id
+    FROM artist, GENERATE_SERIES(1, %(albums_per_artist)s * 2) AS n
+    WHERE n <= 1 + artist_id %% (%(albums_per_artist)s * 2);""",
+    """CREATE TEMP TABLE artist_genre_assignment ON COMMIT DROP AS
+    SELECT DISTINCT artist_id, 1 + (artist_id * 7919 + n * 104729) %% %(genres)s AS genre_id
+    FROM artist, GENERATE_SERIES(1, %(genres_per_artist)s) AS n;""",
+    "ALTER TABLE artist ADD PRIMARY KEY (artist_id);",
+    "ALTER TABLE genre ADD PRIMARY KEY (genre_id);",
+    "ALTER TABLE album ADD PRIMARY KEY (album_id);",
+    "ALTER TABLE artist_genre_assignment ADD UNIQUE (artist_id, genre_id);",
+    "ANALYZE artist, genre, album, artist_genre_assignment;"
+]
+
+# The statements seeding used before: sort the whole table, fetch every row.
+ORDER_BY_RANDOM_STMTS = {
+    'artist': "SELECT spotify_artist_id AS seed FROM artist ORDER BY RANDOM();",
+    'genre': "SELECT genre_name AS seed FROM genre ORDER BY RANDOM();"
+}
+
+
+def time_statement(cur, stmt: str, params: tuple, repeats: int) -> dict:
+    """Returns the median time and the rows fetched by a statement."""
+    timings = []
+    for _ in range(repeats):
+        start = perf_counter()
+        cur.execute(stmt, params)
+        rows = cur.fetchall()
+        timings.append(perf_counter() - start)
+    return {'median_ms': round(median(timings) * 1000, 3), 'rows_fetched': len(rows)}
+
+
+def run_size(artists: int, repeats: int, n: int = 3) -> dict:
+    """Runs every sampling mode against a synthetic collection of a given size."""
+    params = {
+        'artists': artists,
+        'genres': GENRES,
+        'albums_per_artist': ALBUMS_PER_ARTIST,
+        'genres_per_artist': GENRES_PER_ARTIST
+    }
+    probes = (n * SEED_OVERSAMPLING,)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            for stmt in SETUP_STMTS:
+                cur.execute(stmt, params)
+            cur.execute("SELECT COUNT(*) FROM album;")
+            albums = cur.fetchone()[0]
+            results = {
+                'albums': albums,
+                'artist/order_by_random': time_statement(
+                    cur, ORDER_BY_RANDOM_STMTS['artist'], (), repeats),
+                'artist/probe': time_statement(cur, ARTIST_SEED_STMT, probes, repeats),
+                'artist/weighted_probe': time_statement(
+                    cur, WEIGHTED_ARTIST_SEED_STMT, probes, repeats),
+                'genre/order_by_random': time_statement(
+                    cur, ORDER_BY_RANDOM_STMTS['genre'], (), repeats),
+                'genre/probe': time_statement(cur, GENRE_SEED_STMT, probes, repeats),
+                'genre/weighted_probe': time_statement(
+                    cur, WEIGHTED_GENRE_SEED_STMT, probes, repeats)
+            }
+        conn.rollback()
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    arg_parser.add_argument("--repeats", type=int, default=20)
+    args = arg_parser.parse_args()
+    print(json.dumps({size: run_size(size, args.repeats) for size in args.sizes}, indent=2))
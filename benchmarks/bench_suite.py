@@ -0,0 +1,272 @@
+"""Runs the offline benchmark suite: album ingestion, the collection queries, the
+analytics queries and full page renders, against a throwaway Postgres database
+built from schema/schema.sql and loaded with synthetic collections, with
+Spotify and Last.fm replaced by the local fakes in fake_services.py.
+Results are printed (or written) as JSON, and can be compared with a
+previous run to spot regressions between commits."""
+
+import json
+import platform
+import subprocess
+import sys
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from os import environ as ENV, getpid
+from pathlib import Path
+from random import Random
+from statistics import median
+from time import perf_counter
+
+import psycopg2
+from dotenv import load_dotenv
+
+ROOT = Path(__file__).resolve().parents[1]
+SCHEMA = ROOT / "schema" / "schema.sql"
+sys.path.insert(0, str(ROOT / "app"))
+sys.path.insert(0, str(ROOT / "app" / "analytics"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+# The app's modules read their settings at import, so they are only imported
+# once the fakes and the throwaway database have been set up.
+# pylint: disable=wrong-import-position,import-outside-toplevel
+from fake_services import start_server
+
+GENRES = 500
+TAGS = 2000
+ALBUMS_PER_ARTIST = 4
+GENRES_PER_ARTIST = 3
+TAGS_PER_ALBUM = 5
+
+POPULATE_STMTS = [
+    """TRUNCATE album_tag_assignment, artist_genre_assignment, album, artist,
+    genre, tag RESTART IDENTITY CASCADE;""",
+    """INSERT INTO genre(genre_name)
+    SELECT 'genre ' || i FROM GENERATE_SERIES(1, %(genres)s) AS i;""",
+    """INSERT INTO tag(tag_name)
+    SELECT 'tag ' || i FROM GENERATE_SERIES(1, %(tags)s) AS i;""",
+    """INSERT INTO artist(spotify_artist_id, artist_name)
+    SELECT 'bench-artist-' || i, 'Artist ' || i FROM GENERATE_SERIES(1, %(artists)s) AS i;""",
+    """INSERT INTO album(artist_id, spotify_album_id, album_type, album_name,
+    release_date, num_tracks, runtime_seconds, album_art_url, tags_checked_at)
+    SELECT 1 + i %% %(artists)s, 'bench-album-' || i, 'album', 'Album ' || i,
+    DATE '1960-01-01' + (i * 7919) %% 23000, 10, 2400,
+    'https://i.scdn.co/image/bench' || i, NOW()
+    FROM GENERATE_SERIES(1, %(albums)s) AS i;""",
+    """INSERT INTO artist_genre_assignment(artist_id, genre_id)
+    SELECT DISTINCT a, 1 + (a * 31 + k * 97) %% %(genres)s
+    FROM GENERATE_SERIES(1, %(artists)s) AS a, GENERATE_SERIES(1, %(genres_per_artist)s) AS k;""",
+    """INSERT INTO album_tag_assignment(album_id, tag_id)
+    SELECT DISTINCT i, 1 + (i * 53 + k * 211) %% %(tags)s
+    FROM GENERATE_SERIES(1, %(albums)s) AS i, GENERATE_SERIES(1, %(tags_per_album)s) AS k;""",
+    "SELECT rebuild_analytics_counts();",
+    "SELECT refresh_album_search(NULL);",
+    "ANALYZE;"
+]
+
+
+def get_admin_connection():
+    """Returns an autocommit connection to the server's maintenance database."""
+    conn = psycopg2.connect(dbname=ENV.get('BENCH_ADMIN_DB', "postgres"), user=ENV['DB_USER'],
+                            password=ENV['DB_PASSWORD'], host=ENV['DB_HOST'],
+                            port=ENV['DB_PORT'])
+    conn.autocommit = True
+    return conn
+
+
+def create_database(name: str):
+    """Creates a throwaway database and loads the schema into it, skipping
+    the schema's \\c line since the connection already targets it."""
+    admin = get_admin_connection()
+    with admin.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{name}";')
+        cur.execute(f'CREATE DATABASE "{name}";')
+    admin.close()
+
+    schema = "\n".join(x for x in SCHEMA.read_text(encoding="utf-8").splitlines()
+                       if not x.startswith("\\c"))
+    conn = psycopg2.connect(dbname=name, user=ENV['DB_USER'], password=ENV['DB_PASSWORD'],
+                            host=ENV['DB_HOST'], port=ENV['DB_PORT'])
+    with conn, conn.cursor() as cur:
+        cur.execute(schema)
+    conn.close()
+
+
+def drop_database(name: str):
+    """Drops the throwaway database."""
+    admin = get_admin_connection()
+    with admin.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{name}";')
+    admin.close()
+
+
+def populate(albums: int):
+    """Replaces the collection with a synthetic one of a given size."""
+    from db_pool import get_connection
+    params = {
+        'albums': albums,
+        'artists': max(1, albums // ALBUMS_PER_ARTIST),
+        'genres': GENRES,
+        'tags': TAGS,
+        'genres_per_artist': GENRES_PER_ARTIST,
+        'tags_per_album': TAGS_PER_ALBUM
+    }
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            for stmt in POPULATE_STMTS:
+                cur.execute(stmt, params)
+    reset_app_state()
+
+
+def reset_app_state():
+    """Drops every in-process cache and index, so each size starts cold."""
+    from cache import get_cache_stats, make_cache
+    from collection_index import ALBUM_INDEX, OWNED_ALBUMS
+    for index in (ALBUM_INDEX, OWNED_ALBUMS):
+        index._loaded_at = None  # pylint: disable=protected-access
+    for name in get_cache_stats():
+        make_cache(name).clear()
+
+
+def measure(run, repeats: int) -> dict:
+    """Returns timing statistics for a callable run with the iteration number."""
+    timings = []
+    for i in range(repeats):
+        start = perf_counter()
+        run(i)
+        timings.append((perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        'median_ms': round(median(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'min_ms': round(timings[0], 3),
+        'runs': repeats
+    }
+
+
+def run_size(albums: int, repeats: int) -> dict:
+    """Runs every benchmark against a synthetic collection of a given size."""
+    import db_utils
+    import extract_spotify
+    import recommendation_handler
+    import analytics_utils
+    from authorisation.access_manager import get_valid_token
+    from main import create_app
+
+    populate(albums)
+    client = create_app().test_client()
+    rng = Random(albums)
+    album_ids = [rng.randint(1, albums) for _ in range(repeats)]
+
+    def get(path: str):
+        response = client.get(path)
+        assert response.status_code == 200, (path, response.status_code)
+
+    def display_search(i: int):
+        extract_spotify.SEARCH_CACHE.clear()
+        response = client.post("/display_search", data={'search_query': f"album {i}"})
+        assert response.status_code == 200, response.status_code
+
+    def recommend(_):
+        recommendation_handler.RECOMMENDATION_CACHE.clear()
+        get("/recommend")
+
+    results = {
+        'add_album': measure(lambda i: extract_spotify.add_album(
+            f"bench-new-{albums}-{i}", get_valid_token()), repeats),
+        'get_all_albums': measure(lambda _: db_utils.get_all_albums(), repeats),
+        'get_album_by_id': measure(lambda i: db_utils.get_album_by_id(album_ids[i]), repeats),
+        'get_album_page': measure(lambda _: db_utils.get_album_page(), repeats),
+        'search_collection': measure(
+            lambda i: db_utils.search_collection(f"album {album_ids[i]}"), repeats),
+        'analytics/get_all_counts': measure(lambda _: analytics_utils.get_all_counts(), repeats),
+        'analytics/get_genre_counts': measure(
+            lambda _: analytics_utils.get_genre_counts(), repeats),
+        'analytics/get_tag_counts': measure(lambda _: analytics_utils.get_tag_counts(), repeats),
+        'analytics/get_decade_counts': measure(
+            lambda _: analytics_utils.get_decade_counts(), repeats),
+        'page/collection': measure(lambda _: get("/collection"), repeats),
+        'page/collection_page': measure(lambda _: get("/collection/page?sort=newest"), repeats),
+        'page/album': measure(lambda i: get(f"/collection/{album_ids[i]}"), repeats),
+        'page/display_search': measure(display_search, repeats),
+        'page/recommend_uncached': measure(recommend, repeats)
+    }
+    return results
+
+
+def get_commit() -> str:
+    """Returns the current git commit, or None outside a checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict) -> dict:
+    """Returns the ratio of each median to the baseline's (above 1 is slower)."""
+    ratios = {}
+    for size, benchmarks in results.items():
+        for name, stats in benchmarks.items():
+            before = baseline.get('results', {}).get(size, {}).get(name)
+            if before and before['median_ms']:
+                ratios.setdefault(size, {})[name] = round(
+                    stats['median_ms'] / before['median_ms'], 3)
+    return ratios
+
+
+def main():
+    """Starts the fakes and the throwaway database, runs every size and
+    reports the results."""
+    arg_parser = ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    arg_parser.add_argument("--repeats", type=int, default=10)
+    arg_parser.add_argument("--output", type=Path, help="Write results to this file.")
+    arg_parser.add_argument("--compare", type=Path, help="A previous results file.")
+    args = arg_parser.parse_args()
+
+    load_dotenv()
+    server = start_server()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    db_name = f"vinylvault_bench_{getpid()}"
+    ENV.update({
+        'SPOTIFY_API_URL': f"{base_url}/v1",
+        'SPOTIFY_ACCOUNTS_URL': base_url,
+        'LASTFM_URL': base_url,
+        'CLIENT_ID': "bench-client",
+        'CLIENT_SECRET': "bench-secret",
+        'INGEST_WORKERS': "0",
+        'TAG_ENRICHMENT_WORKER': "0",
+        'PRICE_REFRESH_WORKER': "0",
+        'DB_NAME': db_name,
+        'CACHE_REDIS_URL': ""
+    })
+
+    create_database(db_name)
+    try:
+        results = {str(size): run_size(size, args.repeats) for size in args.sizes}
+    finally:
+        from db_pool import close_pool
+        close_pool()
+        drop_database(db_name)
+        server.shutdown()
+
+    report = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'repeats': args.repeats,
+        'results': results
+    }
+    if args.compare:
+        report['compared_to'] = str(args.compare)
+        report['median_ratios'] = compare(
+            results, json.loads(args.compare.read_text(encoding="utf-8")))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output + "\n", encoding="utf-8")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""A local stand-in for the Spotify Web API, the Spotify token endpoint and
+Last.fm album pages, serving the recorded fixtures in fixtures/. Responses
+are keyed on the requested IDs, so every ID gets a distinct, stable entity.
+Point the app at it with SPOTIFY_API_URL, SPOTIFY_ACCOUNTS_URL and LASTFM_URL."""
+
+import json
+from argparse import ArgumentParser
+from copy import deepcopy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Thread
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+ALBUM = json.loads((FIXTURES / "spotify_album.json").read_text(encoding="utf-8"))
+ARTIST = json.loads((FIXTURES / "spotify_artist.json").read_text(encoding="utf-8"))
+LASTFM_PAGE = (FIXTURES / "lastfm_album.html").read_bytes()
+GENRES = ["shoegaze", "dream pop", "noise pop", "post-punk", "krautrock", "ambient",
+          "jazz", "hip hop", "trip hop", "indie rock", "folk", "techno"]
+RESULTS_PER_PAGE = 20
+
+
+def get_artist_id(album_id: str) -> str:
+    """Returns the artist of a fake album; every four albums share one."""
+    return f"artist{sum(map(ord, album_id)) // 4}"
+
+
+def make_album(album_id: str) -> dict:
+    """Returns the fixture album, re-keyed to an album ID."""
+    album = deepcopy(ALBUM)
+    album['id'] = album_id
+    album['name'] = f"Album {album_id}"
+    album['artists'][0]['id'] = get_artist_id(album_id)
+    album['artists'][0]['name'] = f"Artist {get_artist_id(album_id)}"
+    album['release_date'] = f"{1960 + sum(map(ord, album_id)) % 60}-05-20"
+    return album
+
+
+def make_artist(artist_id: str) -> dict:
+    """Returns the fixture artist, re-keyed to an artist ID."""
+    artist = deepcopy(ARTIST)
+    artist['id'] = artist_id
+    artist['name'] = f"Artist {artist_id}"
+    offset = sum(map(ord, artist_id)) % len(GENRES)
+    artist['genres'] = [GENRES[(offset + i) % len(GENRES)] for i in range(3)]
+    return artist
+
+
+def make_track(album_id: str) -> dict:
+    """Returns a recommended track on a fake album."""
+    album = make_album(album_id)
+    return {'id': f"track-{album_id}", 'album': album, 'artists': album['artists']}
+
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    """Answers the Spotify and Last.fm requests the app makes."""
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Keeps request logging out of benchmark output."""
+
+    def send_json(self, body: dict, status: int = 200):
+        """Sends a JSON response."""
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Issues a token from the fake accounts service."""
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if urlsplit(self.path).path == "/api/token":
+            self.send_json({'access_token': "fake-token", 'token_type': "Bearer",
+                            'expires_in': 3600})
+        else:
+            self.send_json({'error': "Not found"}, 404)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serves the Spotify API and Last.fm page routes."""
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        parts = [x for x in url.path.split("/") if x]
+        ids = query.get("ids", [""])[0].split(",")
+
+        if parts[:1] == ["music"]:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(LASTFM_PAGE)))
+            self.end_headers()
+            self.wfile.write(LASTFM_PAGE)
+        elif parts == ["v1", "search"]:
+            term = query.get("q", [""])[0]
+            self.send_json({'albums': {'items': [
+                make_album(f"search-{term}-{i}") for i in range(RESULTS_PER_PAGE)]}})
+        elif parts == ["v1", "albums"]:
+            self.send_json({'albums': [make_album(x) for x in ids]})
+        elif parts[:2] == ["v1", "albums"] and len(parts) == 3:
+            self.send_json(make_album(parts[2]))
+        elif parts == ["v1", "artists"]:
+            self.send_json({'artists': [make_artist(x) for x in ids]})
+        elif parts[:2] == ["v1", "artists"] and len(parts) == 3:
+            self.send_json(make_artist(parts[2]))
+        elif parts == ["v1", "recommendations"]:
+            seed = query.get("seed_artists", [""])[0]
+            self.send_json({'tracks': [make_track(f"rec-{seed}-{i // 2}")
+                                       for i in range(RESULTS_PER_PAGE)]})
+        else:
+            self.send_json({'error': "Not found"}, 404)
+
+
+def start_server(port: int = 0) -> ThreadingHTTPServer:
+    """Starts the fake services on a background thread. Port 0 picks a
+    free port; the bound address is on server.server_address."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeServiceHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name="fake-services", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    arg_parser = ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--port", type=int, default=8765)
+    args = arg_parser.parse_args()
+    print(f"Serving fake Spotify and Last.fm on http://127.0.0.1:{args.port}")
+    ThreadingHTTPServer(("127.0.0.1", args.port), FakeServiceHandler).serve_forever()
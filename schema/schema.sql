@@ -1,12 +1,23 @@
 \c vinylvault
 
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 DROP TABLE IF EXISTS access_tokens;
+DROP TABLE IF EXISTS album_search;
+DROP TABLE IF EXISTS collection_stats;
+DROP TABLE IF EXISTS decade_count;
+DROP TABLE IF EXISTS genre_count;
+DROP TABLE IF EXISTS tag_count;
+DROP TABLE IF EXISTS ingest_job;
+DROP TABLE IF EXISTS price_snapshot;
+DROP TABLE IF EXISTS discogs_listing;
 DROP TABLE IF EXISTS genre CASCADE;
 DROP TABLE IF EXISTS tag CASCADE;
 DROP TABLE IF EXISTS album CASCADE;
 DROP TABLE IF EXISTS artist CASCADE;
 DROP TABLE IF EXISTS artist_genre_assignment;
 DROP TABLE IF EXISTS album_genre_assignment;
+DROP TABLE IF EXISTS album_tag_assignment;
 
 CREATE TABLE access_tokens(
     access_token_id INT GENERATED ALWAYS AS IDENTITY,
@@ -48,6 +59,10 @@ CREATE TABLE album(
     num_tracks SMALLINT NOT NULL,
     runtime_seconds SMALLINT NOT NULL,
     album_art_url TEXT,
+    added_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    tags_checked_at TIMESTAMPTZ,
+    tag_attempts SMALLINT NOT NULL DEFAULT 0,
+    prices_checked_at TIMESTAMPTZ,
     PRIMARY KEY (album_id),
     FOREIGN KEY (artist_id) REFERENCES artist(artist_id)
 );
@@ -71,4 +86,281 @@ CREATE TABLE artist_genre_assignment(
 );
 
 CREATE INDEX idx_spotify_artist_id ON artist(spotify_artist_id, artist_name);
-CREATE INDEX idx_spotify_album_id ON album(spotify_album_id, album_name);
\ No newline at end of file
+CREATE INDEX idx_spotify_album_id ON album(spotify_album_id, album_name);
+CREATE INDEX idx_artist_name ON artist(artist_name, artist_id);
+CREATE INDEX idx_artist_name_lower ON artist(LOWER(artist_name));
+CREATE INDEX idx_album_artist_id ON album(artist_id);
+CREATE INDEX idx_album_name ON album(album_name, album_id);
+CREATE INDEX idx_album_release_date ON album(release_date, album_id);
+CREATE INDEX idx_album_prices_checked_at ON album(prices_checked_at NULLS FIRST, album_id);
+CREATE INDEX idx_album_tags_pending ON album(album_id) WHERE tags_checked_at IS NULL;
+CREATE INDEX idx_tag_name_lower ON tag(LOWER(tag_name));
+CREATE INDEX idx_album_tag_assignment_tag_id ON album_tag_assignment(tag_id);
+CREATE INDEX idx_artist_genre_assignment_genre_id ON artist_genre_assignment(genre_id);
+
+CREATE TABLE ingest_job(
+    job_id INT GENERATED ALWAYS AS IDENTITY,
+    spotify_album_id VARCHAR(50) NOT NULL,
+    status VARCHAR(10) NOT NULL DEFAULT 'queued',
+    attempts SMALLINT NOT NULL DEFAULT 0,
+    album_id INT,
+    error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (job_id),
+    CHECK (status IN ('queued', 'running', 'done', 'failed'))
+);
+
+CREATE UNIQUE INDEX idx_ingest_job_in_flight ON ingest_job(spotify_album_id)
+WHERE status IN ('queued', 'running');
+CREATE INDEX idx_ingest_job_queued ON ingest_job(created_at, job_id)
+WHERE status = 'queued';
+
+CREATE TABLE discogs_listing(
+    listing_id INT GENERATED ALWAYS AS IDENTITY,
+    album_id INT NOT NULL,
+    listing_url TEXT NOT NULL UNIQUE,
+    description TEXT,
+    media_condition VARCHAR(50),
+    sleeve_condition VARCHAR(50),
+    seller_rating NUMERIC(5, 2),
+    first_seen_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    last_seen_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (listing_id),
+    FOREIGN KEY (album_id) REFERENCES album(album_id) ON DELETE CASCADE
+);
+
+CREATE TABLE price_snapshot(
+    snapshot_id BIGINT GENERATED ALWAYS AS IDENTITY,
+    listing_id INT NOT NULL,
+    album_id INT NOT NULL,
+    price NUMERIC(10, 2),
+    currency CHAR(3),
+    converted_price NUMERIC(10, 2),
+    converted_currency CHAR(3),
+    captured_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (snapshot_id),
+    FOREIGN KEY (listing_id) REFERENCES discogs_listing(listing_id) ON DELETE CASCADE,
+    FOREIGN KEY (album_id) REFERENCES album(album_id) ON DELETE CASCADE
+);
+
+CREATE INDEX idx_discogs_listing_album ON discogs_listing(album_id, last_seen_at);
+CREATE INDEX idx_price_snapshot_listing ON price_snapshot(listing_id, captured_at DESC);
+CREATE INDEX idx_price_snapshot_album ON price_snapshot(album_id, captured_at);
+
+-- Analytics aggregates, kept up to date by statement-level triggers on the
+-- ingest and delete paths so the dashboard never scans the base tables.
+-- Album release dates are never updated, so album triggers only cover
+-- inserts and deletes. SELECT rebuild_analytics_counts(); backfills them.
+-- collection_stats.version is bumped once by every transaction that changes
+-- the collection, so readers can tell whether anything they cached is out of
+-- date. Its single row is only written at commit, by a deferred trigger that
+-- applies the changes noted by the statement triggers, so concurrent writers
+-- don't queue on its lock for the length of their transactions.
+CREATE TABLE tag_count(
+    tag_id INT NOT NULL,
+    album_count INT NOT NULL,
+    PRIMARY KEY (tag_id),
+    FOREIGN KEY (tag_id) REFERENCES tag(tag_id) ON DELETE CASCADE
+);
+
+CREATE TABLE genre_count(
+    genre_id INT NOT NULL,
+    assignment_count INT NOT NULL,
+    PRIMARY KEY (genre_id),
+    FOREIGN KEY (genre_id) REFERENCES genre(genre_id) ON DELETE CASCADE
+);
+
+CREATE TABLE decade_count(
+    decade SMALLINT NOT NULL,
+    album_count INT NOT NULL,
+    PRIMARY KEY (decade)
+);
+
+CREATE TABLE collection_stats(
+    singleton BOOLEAN NOT NULL DEFAULT TRUE,
+    album_count INT NOT NULL DEFAULT 0,
+    version BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (singleton),
+    CHECK (singleton)
+);
+
+INSERT INTO collection_stats DEFAULT VALUES;
+
+CREATE OR REPLACE FUNCTION note_collection_change(album_delta INT) RETURNS VOID AS $$
+BEGIN
+    PERFORM SET_CONFIG('vinylvault.album_delta', (COALESCE(NULLIF(
+        CURRENT_SETTING('vinylvault.album_delta', TRUE), ''), '0')::INT + album_delta)::TEXT, TRUE);
+    PERFORM SET_CONFIG('vinylvault.collection_changed', 'on', TRUE);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION apply_collection_changes() RETURNS TRIGGER AS $$
+BEGIN
+    -- Fires for every changed row, but only the first firing has anything to apply.
+    IF CURRENT_SETTING('vinylvault.collection_changed', TRUE) = 'on' THEN
+        UPDATE collection_stats
+        SET album_count = album_count + COALESCE(NULLIF(
+            CURRENT_SETTING('vinylvault.album_delta', TRUE), ''), '0')::INT,
+        version = version + 1;
+        PERFORM SET_CONFIG('vinylvault.album_delta', '0', TRUE);
+        PERFORM SET_CONFIG('vinylvault.collection_changed', 'off', TRUE);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION count_album_tags() RETURNS TRIGGER AS $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM changed_rows) THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO tag_count(tag_id, album_count)
+        SELECT tag_id, COUNT(*) FROM changed_rows GROUP BY tag_id
+        ON CONFLICT (tag_id) DO UPDATE
+        SET album_count = tag_count.album_count + EXCLUDED.album_count;
+    ELSE
+        -- Only existing rows are updated, as a cascade from a deleted
+        -- tag has already removed its row.
+        UPDATE tag_count AS c SET album_count = c.album_count - d.removed
+        FROM (SELECT tag_id, COUNT(*) AS removed FROM changed_rows GROUP BY tag_id) AS d
+        WHERE c.tag_id = d.tag_id;
+        DELETE FROM tag_count
+        WHERE tag_id IN (SELECT tag_id FROM changed_rows) AND album_count <= 0;
+    END IF;
+    PERFORM note_collection_change(0);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION count_artist_genres() RETURNS TRIGGER AS $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM changed_rows) THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO genre_count(genre_id, assignment_count)
+        SELECT genre_id, COUNT(*) FROM changed_rows GROUP BY genre_id
+        ON CONFLICT (genre_id) DO UPDATE
+        SET assignment_count = genre_count.assignment_count + EXCLUDED.assignment_count;
+    ELSE
+        -- Only existing rows are updated, as a cascade from a deleted
+        -- genre has already removed its row.
+        UPDATE genre_count AS c SET assignment_count = c.assignment_count - d.removed
+        FROM (SELECT genre_id, COUNT(*) AS removed FROM changed_rows GROUP BY genre_id) AS d
+        WHERE c.genre_id = d.genre_id;
+        DELETE FROM genre_count
+        WHERE genre_id IN (SELECT genre_id FROM changed_rows) AND assignment_count <= 0;
+    END IF;
+    PERFORM note_collection_change(0);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION count_albums() RETURNS TRIGGER AS $$
+DECLARE
+    direction INT := CASE TG_OP WHEN 'INSERT' THEN 1 ELSE -1 END;
+    changed INT := (SELECT COUNT(*) FROM changed_rows);
+BEGIN
+    IF changed = 0 THEN
+        RETURN NULL;
+    END IF;
+    PERFORM note_collection_change(direction * changed);
+    INSERT INTO decade_count(decade, album_count)
+    SELECT FLOOR(EXTRACT(YEAR FROM release_date) / 10) * 10, direction * COUNT(*)
+    FROM changed_rows WHERE release_date IS NOT NULL GROUP BY 1
+    ON CONFLICT (decade) DO UPDATE
+    SET album_count = decade_count.album_count + EXCLUDED.album_count;
+    DELETE FROM decade_count WHERE album_count <= 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER album_tag_assignment_inserted AFTER INSERT ON album_tag_assignment
+REFERENCING NEW TABLE AS changed_rows
+FOR EACH STATEMENT EXECUTE FUNCTION count_album_tags();
+CREATE TRIGGER album_tag_assignment_deleted AFTER DELETE ON album_tag_assignment
+REFERENCING OLD TABLE AS changed_rows
+FOR EACH STATEMENT EXECUTE FUNCTION count_album_tags();
+
+CREATE TRIGGER artist_genre_assignment_inserted AFTER INSERT ON artist_genre_assignment
+REFERENCING NEW TABLE AS changed_rows
+FOR EACH STATEMENT EXECUTE FUNCTION count_artist_genres();
+CREATE TRIGGER artist_genre_assignment_deleted AFTER DELETE ON artist_genre_assignment
+REFERENCING OLD TABLE AS changed_rows
+FOR EACH STATEMENT EXECUTE FUNCTION count_artist_genres();
+
+CREATE TRIGGER album_inserted AFTER INSERT ON album
+REFERENCING NEW TABLE AS changed_rows
+FOR EACH STATEMENT EXECUTE FUNCTION count_albums();
+CREATE TRIGGER album_deleted AFTER DELETE ON album
+REFERENCING OLD TABLE AS changed_rows
+FOR EACH STATEMENT EXECUTE FUNCTION count_albums();
+
+CREATE CONSTRAINT TRIGGER album_changes_applied AFTER INSERT OR DELETE ON album
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW EXECUTE FUNCTION apply_collection_changes();
+CREATE CONSTRAINT TRIGGER album_tag_assignment_changes_applied
+AFTER INSERT OR DELETE ON album_tag_assignment
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW EXECUTE FUNCTION apply_collection_changes();
+CREATE CONSTRAINT TRIGGER artist_genre_assignment_changes_applied
+AFTER INSERT OR DELETE ON artist_genre_assignment
+DEFERRABLE INITIALLY DEFERRED
+FOR EACH ROW EXECUTE FUNCTION apply_collection_changes();
+
+CREATE OR REPLACE FUNCTION rebuild_analytics_counts() RETURNS VOID AS $$
+BEGIN
+    LOCK TABLE album, album_tag_assignment, artist_genre_assignment IN SHARE MODE;
+    TRUNCATE tag_count, genre_count, decade_count;
+    INSERT INTO tag_count(tag_id, album_count)
+    SELECT tag_id, COUNT(*) FROM album_tag_assignment GROUP BY tag_id;
+    INSERT INTO genre_count(genre_id, assignment_count)
+    SELECT genre_id, COUNT(*) FROM artist_genre_assignment GROUP BY genre_id;
+    INSERT INTO decade_count(decade, album_count)
+    SELECT FLOOR(EXTRACT(YEAR FROM release_date) / 10) * 10, COUNT(*)
+    FROM album WHERE release_date IS NOT NULL GROUP BY 1;
+    UPDATE collection_stats
+    SET album_count = (SELECT COUNT(*) FROM album), version = version + 1;
+    -- The recount already includes this transaction's pending album changes.
+    PERFORM SET_CONFIG('vinylvault.album_delta', '0', TRUE);
+END;
+$$ LANGUAGE plpgsql;
+
+-- One search document per album (album name, artist, genres and tags),
+-- weighted in that order for full-text ranking and trigram-indexed for fuzzy
+-- matches. It is refreshed in the same transaction as ingests and tag writes;
+-- SELECT refresh_album_search(NULL); rebuilds it for every album.
+CREATE TABLE album_search(
+    album_id INT NOT NULL,
+    document TEXT NOT NULL,
+    search_vector TSVECTOR NOT NULL,
+    PRIMARY KEY (album_id),
+    FOREIGN KEY (album_id) REFERENCES album(album_id) ON DELETE CASCADE
+);
+
+CREATE INDEX idx_album_search_vector ON album_search USING GIN (search_vector);
+CREATE INDEX idx_album_search_document ON album_search USING GIN (document gin_trgm_ops);
+
+CREATE OR REPLACE FUNCTION refresh_album_search(album_ids INT[]) RETURNS VOID AS $$
+    INSERT INTO album_search(album_id, document, search_vector)
+    SELECT a.album_id,
+    CONCAT_WS(' ', a.album_name, ar.artist_name, g.genres, t.tags),
+    SETWEIGHT(TO_TSVECTOR('simple', a.album_name), 'A')
+    || SETWEIGHT(TO_TSVECTOR('simple', ar.artist_name), 'B')
+    || SETWEIGHT(TO_TSVECTOR('simple', COALESCE(g.genres, '')), 'C')
+    || SETWEIGHT(TO_TSVECTOR('simple', COALESCE(t.tags, '')), 'D')
+    FROM album AS a JOIN artist AS ar USING (artist_id)
+    LEFT JOIN LATERAL (
+        SELECT STRING_AGG(genre_name, ' ') AS genres
+        FROM artist_genre_assignment JOIN genre USING (genre_id)
+        WHERE artist_id = a.artist_id) AS g ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT STRING_AGG(tag_name, ' ') AS tags
+        FROM album_tag_assignment JOIN tag USING (tag_id)
+        WHERE album_id = a.album_id) AS t ON TRUE
+    WHERE album_ids IS NULL OR a.album_id = ANY(album_ids)
+    ON CONFLICT (album_id) DO UPDATE
+    SET document = EXCLUDED.document, search_vector = EXCLUDED.search_vector;
+$$ LANGUAGE sql;